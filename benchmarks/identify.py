@@ -0,0 +1,265 @@
+"""Benchmark the game identification hot path.
+
+ProcessIdentifierPlugin.identify_game and candidates are run against
+synthetic process tables served by a stubbed psutil, for a range of table
+sizes, registered UserApps and ignore patterns. Latency percentiles and
+allocations per poll are written as JSON.
+
+Usage:
+
+    python benchmarks/identify.py [--quick] [--polls N] [--output FILE]
+
+The benchmark uses a throwaway data directory, so it never touches the real
+gamest database.
+"""
+import argparse
+import contextlib
+import gc
+import getpass
+import itertools
+import json
+import os
+import platform
+import statistics
+import sys
+import tempfile
+import time
+import tracemalloc
+
+os.environ['XDG_DATA_HOME'] = tempfile.mkdtemp(prefix='gamest-bench-')
+os.environ['XDG_CACHE_HOME'] = os.environ['XDG_DATA_HOME']
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import psutil  # noqa: E402
+
+from gamest import db, processes  # noqa: E402
+from gamest_plugins.process_identifier import module  # noqa: E402
+
+USERNAME = getpass.getuser()
+
+
+class FakeProcess:
+    def __init__(self, table, pid):
+        try:
+            self.info = table[pid]
+        except KeyError:
+            raise psutil.NoSuchProcess(pid) from None
+        self.pid = pid
+
+    def as_dict(self, attrs):
+        return {a: self.info[a] for a in attrs}
+
+    def create_time(self):
+        return self.info['create_time']
+
+    def name(self):
+        return self.info['name']
+
+    def status(self):
+        return 'running'
+
+    @contextlib.contextmanager
+    def oneshot(self):
+        yield
+
+
+class FakePsutil:
+    """Just enough of psutil for gamest.processes."""
+
+    Error = psutil.Error
+    NoSuchProcess = psutil.NoSuchProcess
+    ZombieProcess = psutil.ZombieProcess
+    AccessDenied = psutil.AccessDenied
+    STATUS_ZOMBIE = psutil.STATUS_ZOMBIE
+
+    def __init__(self, table):
+        self.table = table
+
+    def pids(self):
+        return list(self.table)
+
+    def Process(self, pid):  # pylint: disable=invalid-name
+        return FakeProcess(self.table, pid)
+
+
+def process_info(pid, name, exe, cmdline, username=USERNAME):
+    return {
+        'name': name,
+        'username': username,
+        'exe': exe,
+        'cmdline': cmdline,
+        'create_time': 1000000.0 + pid,
+    }
+
+
+def make_table(size):
+    """Build a process table of mostly unremarkable processes.
+
+    A tenth belong to other users, a tenth have ignored names, and a few run
+    the shared emulator executable with a ROM that isn't registered, so the
+    cmdline index is exercised without producing a match.
+    """
+    table = {}
+    for pid in range(1, size + 1):
+        if pid % 10 == 0:
+            info = process_info(pid, 'daemon{}'.format(pid), '/usr/sbin/daemon', ['daemon'], 'root')
+        elif pid % 10 == 1:
+            info = process_info(pid, 'gnome-thing{}'.format(pid), '/usr/bin/gnome', ['gnome'])
+        elif pid % 100 == 2:
+            info = process_info(pid, 'emu', '/usr/bin/emu', ['/usr/bin/emu', '/roms/unknown.rom'])
+        else:
+            name = 'proc{}'.format(pid)
+            info = process_info(pid, name, '/usr/bin/' + name, ['/usr/bin/' + name, '--flag'])
+        table[pid] = info
+    return table
+
+
+def churn(table, fraction, next_pid):
+    """Replace a fraction of the table with new processes."""
+    count = int(len(table) * fraction)
+    for pid in list(itertools.islice(table, count)):
+        del table[pid]
+        name = 'proc{}'.format(next_pid)
+        table[next_pid] = process_info(next_pid, name, '/usr/bin/' + name, [name])
+        next_pid += 1
+    return next_pid
+
+
+def register_user_apps(count):
+    session = db.Session()
+    session.query(db.UserApp).delete()
+    session.query(db.App).delete()
+    for i in range(count):
+        app = db.App(name='Game {}'.format(i))
+        if i % 2:
+            data = {'exe': '/usr/bin/emu', 'cmdline': '/usr/bin/emu /roms/game{}.rom'.format(i)}
+        else:
+            data = {'exe': '/games/game{}/game.exe'.format(i), 'cmdline': ''}
+        session.add(db.UserApp(
+            app=app,
+            identifier_plugin='ProcessIdentifierPlugin',
+            identifier_data=json.dumps(data)))
+    session.commit()
+
+
+def set_patterns(count):
+    db.DBConfig.delete('ProcessIdentifierPlugin', 'trash_names')
+    for i in range(count):
+        db.DBConfig.set('ProcessIdentifierPlugin', 'trash_names', r'ignored{}-.+'.format(i), append=True)
+    db.Session.commit()
+
+
+class FakeApplication:
+    def bind(self, *args, **kwargs):
+        pass
+
+
+def percentile(values, pct):
+    values = sorted(values)
+    index = min(int(round(pct / 100 * (len(values) - 1))), len(values) - 1)
+    return values[index]
+
+
+def measure(fn, table, polls, churn_fraction):
+    next_pid = max(table) + 1
+    gc.collect()
+    start = time.perf_counter()
+    fn()
+    cold = time.perf_counter() - start
+
+    timings = []
+    for _ in range(polls):
+        next_pid = churn(table, churn_fraction, next_pid)
+        start = time.perf_counter()
+        fn()
+        timings.append(time.perf_counter() - start)
+
+    alloc_polls = max(polls // 10, 1)
+    tracemalloc.start()
+    before = tracemalloc.take_snapshot()
+    for _ in range(alloc_polls):
+        next_pid = churn(table, churn_fraction, next_pid)
+        fn()
+    after = tracemalloc.take_snapshot()
+    tracemalloc.stop()
+    stats = after.compare_to(before, 'filename')
+    allocated = sum(s.size_diff for s in stats if s.size_diff > 0)
+    blocks = sum(s.count_diff for s in stats if s.count_diff > 0)
+
+    return {
+        'cold_ms': cold * 1000,
+        'p50_ms': statistics.median(timings) * 1000,
+        'p99_ms': percentile(timings, 99) * 1000,
+        'mean_ms': statistics.fmean(timings) * 1000,
+        'alloc_bytes_per_poll': allocated / alloc_polls,
+        'alloc_blocks_per_poll': blocks / alloc_polls,
+    }
+
+
+def run_case(size, user_apps, patterns, polls, churn_fraction):
+    register_user_apps(user_apps)
+    set_patterns(patterns)
+
+    results = []
+    for operation in ('identify_game', 'candidates'):
+        table = make_table(size)
+        processes.psutil = FakePsutil(table)
+        snapshot = processes.ProcessSnapshot(ttl=0)
+        module.snapshot = snapshot
+        plugin = module.ProcessIdentifierPlugin(FakeApplication())
+        fn = getattr(plugin, operation)
+        result = {
+            'operation': operation,
+            'processes': size,
+            'user_apps': user_apps,
+            'patterns': patterns,
+            'churn': churn_fraction,
+            'polls': polls,
+        }
+        result.update(measure(fn, table, polls, churn_fraction))
+        results.append(result)
+        db.Session.rollback()
+    return results
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--polls', type=int, default=50, help="timed polls per case")
+    parser.add_argument('--sizes', type=int, nargs='+', default=[100, 1000, 5000, 20000])
+    parser.add_argument('--user-apps', type=int, nargs='+', default=[10, 100, 1000])
+    parser.add_argument('--patterns', type=int, nargs='+', default=[0, 10, 100])
+    parser.add_argument('--churn', type=float, default=0.01,
+                        help="fraction of processes replaced before each poll")
+    parser.add_argument('--quick', action='store_true', help="run a small subset of cases")
+    parser.add_argument('--output', help="write JSON here instead of stdout")
+    args = parser.parse_args(argv)
+
+    if args.quick:
+        args.sizes, args.user_apps, args.patterns, args.polls = [100, 5000], [100], [10], 20
+
+    real_psutil = processes.psutil
+    results = []
+    try:
+        for size, user_apps, patterns in itertools.product(args.sizes, args.user_apps, args.patterns):
+            print("processes={} user_apps={} patterns={}".format(size, user_apps, patterns),
+                  file=sys.stderr)
+            results.extend(run_case(size, user_apps, patterns, args.polls, args.churn))
+    finally:
+        processes.psutil = real_psutil
+
+    report = {
+        'benchmark': 'identify',
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'results': results,
+    }
+    output = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, 'w') as outfile:
+            outfile.write(output + '\n')
+    else:
+        print(output)
+
+
+if __name__ == '__main__':
+    main()
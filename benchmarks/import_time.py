@@ -0,0 +1,95 @@
+"""Check that importing gamest modules stays cheap.
+
+Each module is imported in a fresh interpreter with a throwaway data
+directory. The benchmark records the import time and checks that the import
+didn't create the data directory or the database. It exits with status 1 if
+any import is over budget or touched the disk, so it can be used as a
+regression check.
+
+Usage:
+
+    python benchmarks/import_time.py [--runs N] [--budget MS] [--output FILE]
+"""
+import argparse
+import json
+import os
+import platform
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+MODULES = ['gamest.db', 'gamest.plugins', 'gamest_plugins.process_identifier.module']
+
+PROBE = """
+import sys, time
+sys.path.insert(0, {root!r})
+start = time.perf_counter()
+import {module}
+print(time.perf_counter() - start)
+"""
+
+
+def import_once(module):
+    """Import module in a new interpreter; return (seconds, created paths)."""
+    data_home = tempfile.mkdtemp(prefix='gamest-bench-')
+    try:
+        env = dict(os.environ, XDG_DATA_HOME=data_home, XDG_CACHE_HOME=data_home)
+        output = subprocess.run(
+            [sys.executable, '-c', PROBE.format(root=ROOT, module=module)],
+            env=env, check=True, capture_output=True, text=True).stdout
+        return float(output.split()[-1]), os.listdir(data_home)
+    finally:
+        shutil.rmtree(data_home, ignore_errors=True)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--runs', type=int, default=5, help="imports per module")
+    parser.add_argument('--budget', type=float, default=500,
+                        help="maximum median import time in milliseconds")
+    parser.add_argument('--modules', nargs='+', default=MODULES)
+    parser.add_argument('--output', help="write JSON here instead of stdout")
+    args = parser.parse_args(argv)
+
+    results = []
+    failed = False
+    for module in args.modules:
+        timings = []
+        created = set()
+        for _ in range(args.runs):
+            seconds, paths = import_once(module)
+            timings.append(seconds)
+            created.update(paths)
+        median_ms = statistics.median(timings) * 1000
+        ok = median_ms <= args.budget and not created
+        failed = failed or not ok
+        results.append({
+            'module': module,
+            'p50_ms': median_ms,
+            'max_ms': max(timings) * 1000,
+            'created': sorted(created),
+            'ok': ok,
+        })
+
+    report = {
+        'benchmark': 'import_time',
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'budget_ms': args.budget,
+        'results': results,
+    }
+    output = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, 'w') as outfile:
+            outfile.write(output + '\n')
+    else:
+        print(output)
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
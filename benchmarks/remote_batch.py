@@ -0,0 +1,117 @@
+"""Benchmark sending remote-mode writes over a high-latency link.
+
+A RemoteStub that waits --latency seconds before answering each POST stands
+in for a distant server. Writes are queued in a gamest.outbox.Outbox the
+way gamest makes them, and the time until the server has answered all of
+them is measured with one request per write and with /batch coalescing,
+for two workloads: adding a game and starting a session (the "Add Game"
+window), and a bulk import of --apps games held the way remote.batch() holds them. Results
+are written as JSON.
+
+Usage:
+
+    python benchmarks/remote_batch.py [--latency SECONDS] [--apps N] [--output FILE]
+"""
+import argparse
+import json
+import os
+import platform
+import sys
+import tempfile
+import time
+
+os.environ['XDG_DATA_HOME'] = tempfile.mkdtemp(prefix='gamest-bench-')
+os.environ['XDG_CACHE_HOME'] = os.environ['XDG_DATA_HOME']
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from gamest import db, outbox, remote  # noqa: E402
+from remote_stub import RemoteStub, make_payload  # noqa: E402
+
+
+def add_game(box, number):
+    """Queue what AddBox.add_game and the tracker send for a new game."""
+    app_id = box.provisional_id()
+    box.send('/create-app', {'name': 'New game {}'.format(number), 'disambiguation': None},
+             creates={'app_id': app_id})
+    user_app_id = box.provisional_id()
+    box.send('/create-user-app', {'app_id': app_id, 'identifier_plugin': 'ProcessIdentifierPlugin'},
+             creates={'user_app_id': user_app_id})
+    play_session_id = box.provisional_id()
+    box.send('/start', {'app_id': app_id, 'user_app_id': user_app_id, 'started': time.time()},
+             creates={'play_session_id': play_session_id})
+
+
+def bulk_import(box, apps):
+    with box.hold():
+        for number in range(apps):
+            app_id = box.provisional_id()
+            box.send('/create-app', {'name': 'Imported {}'.format(number), 'disambiguation': None},
+                     creates={'app_id': app_id})
+            box.send('/create-user-app', {'app_id': app_id, 'identifier_plugin': 'manual_time'},
+                     creates={'user_app_id': box.provisional_id()})
+
+
+WORKLOADS = {
+    'add_game': lambda box, args: add_game(box, 0),
+    'bulk_import': lambda box, args: bulk_import(box, args.apps),
+}
+
+
+def run(stub, workload, batching, args):
+    path = os.path.join(tempfile.mkdtemp(prefix='gamest-outbox-'), 'outbox.jsonl')
+    client = remote.RemoteClient(stub.base_url)
+    box = outbox.Outbox(path, client).open()
+    box.batching = batching
+    box.start()
+    start = time.perf_counter()
+    WORKLOADS[workload](box, args)
+    while len(box):
+        time.sleep(0.001)
+    elapsed = time.perf_counter() - start
+    box.stop()
+    client.close()
+    return {
+        'workload': workload,
+        'batching': batching,
+        'seconds': elapsed,
+        'requests': sum(stats['count'] for stats in client.metrics.summary().values()),
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--latency', type=float, default=0.1, help="seconds per POST")
+    parser.add_argument('--apps', type=int, default=500, help="games in the bulk import")
+    parser.add_argument('--output', help="write JSON here instead of stdout")
+    args = parser.parse_args(argv)
+
+    db.init_db('sqlite://')
+    stub = RemoteStub(make_payload(10, 10)).start()
+    stub.delay = args.latency
+    results = []
+    try:
+        for workload in WORKLOADS:
+            for batching in (False, True):
+                print(workload, 'batched' if batching else 'single', file=sys.stderr)
+                results.append(run(stub, workload, batching, args))
+    finally:
+        stub.stop()
+
+    report = {
+        'benchmark': 'remote_batch',
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'latency': args.latency,
+        'apps': args.apps,
+        'results': results,
+    }
+    output = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, 'w') as outfile:
+            outfile.write(output + '\n')
+    else:
+        print(output)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,127 @@
+"""Benchmark loading the remote database at startup in remote mode.
+
+A RemoteStub serves a synthetic payload (500,000 play sessions by default)
+and the database is loaded into a fresh in-memory engine, once with the
+previous approach (parse the whole response, then Session.add every row)
+and once with gamest.remote.load_remote_db. Wall time, and with --memory the
+peak traced allocation, are written as JSON.
+
+Usage:
+
+    python benchmarks/remote_load.py [--sessions N] [--memory] [--output FILE]
+"""
+import argparse
+import datetime
+import gc
+import json
+import os
+import platform
+import sys
+import tempfile
+import time
+import tracemalloc
+
+os.environ['XDG_DATA_HOME'] = tempfile.mkdtemp(prefix='gamest-bench-')
+os.environ['XDG_CACHE_HOME'] = os.environ['XDG_DATA_HOME']
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import requests  # noqa: E402
+
+from gamest import db, remote  # noqa: E402
+from remote_stub import RemoteStub, make_payload  # noqa: E402
+
+
+def legacy_load(base_url):
+    """The loader as it was before gamest.remote: r.json() and Session.add."""
+    session = db.Session()
+    r = requests.get(base_url + '/fetch-remote-db', timeout=5)
+    r.raise_for_status()
+    d = r.json()
+    for a in d['apps']:
+        session.add(db.App(id=a['id'], name=a['name'], disambiguation=a['disambiguation']))
+    for ua in d['user_apps']:
+        session.add(db.UserApp(**{key: ua[key] for key in (
+            'id', 'app_id', 'note', 'path', 'identifier_plugin', 'identifier_data',
+            'initial_runtime', 'window_text')}))
+    for s in d['play_sessions']:
+        session.add(db.PlaySession(
+            id=s['id'],
+            user_app_id=s['user_app_id'],
+            started=datetime.datetime.fromtimestamp(s['started']),
+            duration=s['duration'],
+            note=s['note']))
+    session.query(db.Settings).delete()
+    for s in d['settings']:
+        session.add(db.Settings(id=s['id'], owner=s['owner'], key=s['key'], value=s['value']))
+    session.flush()
+    db.rebuild_runtime_totals(session)
+    db.rebuild_daily_playtime(session)
+    session.commit()
+
+
+def streaming_load(base_url):
+    remote.load_remote_db(base_url, progress=None)
+
+
+LOADERS = {
+    'legacy': legacy_load,
+    'streaming': streaming_load,
+}
+
+
+def run(loader, base_url, memory):
+    db.init_db('sqlite://')
+    gc.collect()
+    if memory:
+        tracemalloc.start()
+    start = time.perf_counter()
+    loader(base_url)
+    elapsed = time.perf_counter() - start
+    result = {'seconds': elapsed}
+    if memory:
+        result['peak_mib'] = tracemalloc.get_traced_memory()[1] / 2**20
+        tracemalloc.stop()
+    result['play_sessions'] = db.Session.query(db.PlaySession).count()
+    db.Session.remove()
+    return result
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--apps', type=int, default=500)
+    parser.add_argument('--sessions', type=int, default=500000)
+    parser.add_argument('--loaders', nargs='+', choices=sorted(LOADERS), default=sorted(LOADERS))
+    parser.add_argument('--memory', action='store_true',
+                        help="also record peak allocations (much slower)")
+    parser.add_argument('--output', help="write JSON here instead of stdout")
+    args = parser.parse_args(argv)
+
+    stub = RemoteStub(make_payload(args.apps, args.sessions)).start()
+    results = []
+    try:
+        for name in args.loaders:
+            print(name, file=sys.stderr)
+            result = {'loader': name}
+            result.update(run(LOADERS[name], stub.base_url, args.memory))
+            results.append(result)
+    finally:
+        stub.stop()
+
+    report = {
+        'benchmark': 'remote_load',
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'sessions': args.sessions,
+        'payload_mib': len(stub.payload_bytes) / 2**20,
+        'results': results,
+    }
+    output = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, 'w') as outfile:
+            outfile.write(output + '\n')
+    else:
+        print(output)
+
+
+if __name__ == '__main__':
+    main()
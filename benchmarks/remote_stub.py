@@ -0,0 +1,265 @@
+"""A stand-in for a remote gamest server, serving synthetic data.
+
+Usage:
+
+    python benchmarks/remote_stub.py [--port PORT] [--sessions N]
+
+Then run gamest with GAMEST_REMOTE=true and
+GAMEST_REMOTE_BASE_URL=http://localhost:PORT. Benchmarks can also start it
+in a thread with RemoteStub(...).start().
+
+The stub is also the reference implementation of the /sync protocol
+described in gamest.remote.sync_remote_db: every change gets the next
+sequence number, and the sync token is the last sequence number sent.
+"""
+import argparse
+import bisect
+import datetime
+import json
+import threading
+import time
+import urllib.parse
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+STARTED = datetime.datetime(2015, 1, 1, tzinfo=datetime.timezone.utc).timestamp()
+
+SYNCED = ('apps', 'user_apps', 'play_sessions')
+
+
+def make_payload(apps=500, sessions=500000, settings=50):
+    """Return a /fetch-remote-db payload as a dict."""
+    return {
+        'apps': [
+            {'id': i, 'name': 'Game {}'.format(i), 'disambiguation': None}
+            for i in range(1, apps + 1)],
+        'user_apps': [
+            {'id': i, 'app_id': i, 'note': None, 'path': None,
+             'identifier_plugin': 'ProcessIdentifierPlugin',
+             'identifier_data': json.dumps({'exe': '/games/{}/game'.format(i), 'cmdline': ''}),
+             'initial_runtime': 0, 'window_text': None}
+            for i in range(1, apps + 1)],
+        'play_sessions': [
+            {'id': i, 'user_app_id': i % apps + 1, 'started': STARTED + i * 600,
+             'duration': 60 + i % 7200, 'note': 'Note {}'.format(i) if i % 10 == 0 else None}
+            for i in range(1, sessions + 1)],
+        'settings': [
+            {'id': i, 'owner': 'Stub', 'key': 'key{}'.format(i), 'value': str(i)}
+            for i in range(1, settings + 1)],
+    }
+
+
+class Handler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    # Headers and body are separate writes; don't let the body wait for an ACK.
+    disable_nagle_algorithm = True
+
+    def log_message(self, format, *args):  # pylint: disable=redefined-builtin
+        pass
+
+    def send_json(self, body, status=200):
+        if not isinstance(body, bytes):
+            body = json.dumps(body).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):  # pylint: disable=invalid-name
+        url = urllib.parse.urlsplit(self.path)
+        query = urllib.parse.parse_qs(url.query)
+        if url.path == '/fetch-remote-db':
+            self.send_json(self.server.payload_bytes)
+        elif url.path == '/sync':
+            since = int(query['since'][0]) if 'since' in query else None
+            self.send_json(self.server.changes_since(since))
+        else:
+            self.send_json({'error': 'not found'}, status=404)
+
+    def do_POST(self):  # pylint: disable=invalid-name
+        body = json.loads(self.rfile.read(int(self.headers.get('Content-Length', 0))) or b'{}')
+        handler = self.server.POST_HANDLERS.get(urllib.parse.urlsplit(self.path).path)
+        if handler is None:
+            self.send_json({'error': 'not found'}, status=404)
+            return
+        if self.server.delay:
+            time.sleep(self.server.delay)
+        key = self.headers.get('Idempotency-Key')
+        try:
+            with self.server.lock:
+                if key in self.server.answered:
+                    response = self.server.answered[key]
+                else:
+                    response = handler(self.server, body)
+                    if key:
+                        self.server.answered[key] = response
+        except KeyError as e:
+            self.send_json({'error': 'unknown id {}'.format(e)}, status=400)
+        else:
+            self.send_json(response)
+
+
+class RemoteStub(ThreadingHTTPServer):
+    """HTTP server for payload, on localhost. port=0 picks a free port."""
+
+    daemon_threads = True
+
+    def __init__(self, payload, port=0):
+        super().__init__(('127.0.0.1', port), Handler)
+        self.lock = threading.RLock()
+        self.rows = {key: {} for key in SYNCED}
+        self.settings = list(payload.get('settings', []))
+        self.seq = 0
+        self.settings_seq = 0
+        self.log = []  # (seq, key, id), in seq order
+        self.delay = 0  # seconds to sleep before answering a POST
+        self.answered = {}  # Idempotency-Key: response
+        for key in SYNCED:
+            for row in payload.get(key, []):
+                self.put(key, row)
+        self._payload_bytes = None
+
+    @property
+    def base_url(self):
+        return 'http://127.0.0.1:{}'.format(self.server_address[1])
+
+    @property
+    def payload_bytes(self):
+        with self.lock:
+            if self._payload_bytes is None:
+                payload = {key: list(rows.values()) for key, rows in self.rows.items()}
+                payload['settings'] = self.settings
+                self._payload_bytes = json.dumps(payload).encode('utf-8')
+            return self._payload_bytes
+
+    def put(self, key, row):
+        """Create or replace a row, as if a client had changed it."""
+        with self.lock:
+            self.seq += 1
+            self.rows[key][row['id']] = row
+            self.log.append((self.seq, key, row['id']))
+            self._payload_bytes = None
+
+    def set_settings(self, settings):
+        with self.lock:
+            self.seq += 1
+            self.settings = list(settings)
+            self.settings_seq = self.seq
+            self._payload_bytes = None
+
+    def changes_since(self, since):
+        """Return the /sync response for the token since (None for everything)."""
+        with self.lock:
+            if since is None:
+                body = {key: list(rows.values()) for key, rows in self.rows.items()}
+            else:
+                changed = {key: {} for key in SYNCED}
+                start = bisect.bisect_right(self.log, since, key=lambda entry: entry[0])
+                for _, key, row_id in self.log[start:]:
+                    changed[key][row_id] = self.rows[key][row_id]
+                body = {key: list(rows.values()) for key, rows in changed.items()}
+            body['settings_changed'] = since is None or self.settings_seq > since
+            if body['settings_changed']:
+                body['settings'] = self.settings
+            body['token'] = str(self.seq)
+            return body
+
+    def _next_id(self, key):
+        return max(self.rows[key], default=0) + 1
+
+    def create_app(self, body):
+        app_id = self._next_id('apps')
+        self.put('apps', {'id': app_id, 'name': body['name'],
+                          'disambiguation': body.get('disambiguation')})
+        return {'app_id': app_id}
+
+    def create_user_app(self, body):
+        user_app_id = self._next_id('user_apps')
+        row = {key: body.get(key) for key in (
+            'app_id', 'note', 'path', 'identifier_plugin', 'identifier_data',
+            'initial_runtime', 'window_text')}
+        row['id'] = user_app_id
+        self.put('user_apps', row)
+        return {'user_app_id': user_app_id}
+
+    def start_session(self, body):
+        self.rows['user_apps'][body['user_app_id']]  # pylint: disable=expression-not-assigned
+        play_session_id = self._next_id('play_sessions')
+        started = int(body.get('started', time.time()))
+        self.put('play_sessions', {'id': play_session_id, 'user_app_id': body['user_app_id'],
+                                   'started': started, 'duration': 0, 'note': None})
+        return {'play_session_id': play_session_id, 'started': started}
+
+    def stop_session(self, body):
+        row = dict(self.rows['play_sessions'][body['play_session_id']])
+        row['duration'] = int(body.get('duration', time.time() - row['started']))
+        self.put('play_sessions', row)
+        return {'duration': row['duration']}
+
+    def update_session_note(self, body):
+        row = dict(self.rows['play_sessions'][body['play_session_id']])
+        row['note'] = body['note']
+        self.put('play_sessions', row)
+        return {}
+
+    def batch(self, body):
+        results = []
+        for operation in body['operations']:
+            key = operation.get('key')
+            if key in self.answered:
+                results.append({'status': 200, 'body': self.answered[key]})
+                continue
+            op_body = dict(operation.get('body', {}))
+            for name, value in op_body.items():
+                if isinstance(value, dict) and '$ref' in value:
+                    index, field = value['$ref']
+                    if results[index]['status'] != 200:
+                        break
+                    op_body[name] = results[index]['body'][field]
+            else:
+                try:
+                    response = self.POST_HANDLERS[operation['endpoint']](self, op_body)
+                except KeyError as e:
+                    results.append({'status': 400, 'body': {'error': 'unknown id {}'.format(e)}})
+                    continue
+                if key:
+                    self.answered[key] = response
+                results.append({'status': 200, 'body': response})
+                continue
+            results.append({'status': 424, 'body': {'error': 'failed dependency'}})
+        return {'results': results}
+
+    POST_HANDLERS = {
+        '/create-app': create_app,
+        '/create-user-app': create_user_app,
+        '/start': start_session,
+        '/stop': stop_session,
+        '/update-session-note': update_session_note,
+        '/batch': batch,
+    }
+
+    def start(self):
+        threading.Thread(target=self.serve_forever, daemon=True).start()
+        return self
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--apps', type=int, default=500)
+    parser.add_argument('--sessions', type=int, default=500000)
+    args = parser.parse_args(argv)
+    stub = RemoteStub(make_payload(args.apps, args.sessions), args.port)
+    print("Serving on {}".format(stub.base_url))
+    try:
+        stub.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,99 @@
+"""Benchmark remote mode startup with the persistent local cache.
+
+A RemoteStub serves a synthetic database. The benchmark times a cold sync
+into an empty cache, a warm sync with no changes, and a warm sync after the
+stub has recorded a few new and changed sessions, and compares them with a
+bare HTTP round trip to the same server. Results are written as JSON.
+
+Usage:
+
+    python benchmarks/remote_sync.py [--sessions N] [--changes N] [--output FILE]
+"""
+import argparse
+import json
+import os
+import platform
+import statistics
+import sys
+import tempfile
+import time
+
+os.environ['XDG_DATA_HOME'] = tempfile.mkdtemp(prefix='gamest-bench-')
+os.environ['XDG_CACHE_HOME'] = os.environ['XDG_DATA_HOME']
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import requests  # noqa: E402
+
+from gamest import db, remote  # noqa: E402
+from remote_stub import RemoteStub, STARTED, make_payload  # noqa: E402
+
+
+def timed(fn, *args):
+    start = time.perf_counter()
+    fn(*args)
+    return time.perf_counter() - start
+
+
+def sync(base_url):
+    remote.sync_remote_db(base_url, progress=None)
+    db.Session.remove()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--apps', type=int, default=500)
+    parser.add_argument('--sessions', type=int, default=500000)
+    parser.add_argument('--changes', type=int, default=10,
+                        help="sessions added and changed before the last warm sync")
+    parser.add_argument('--runs', type=int, default=5, help="timed warm syncs")
+    parser.add_argument('--output', help="write JSON here instead of stdout")
+    args = parser.parse_args(argv)
+
+    stub = RemoteStub(make_payload(args.apps, args.sessions)).start()
+    try:
+        os.makedirs(db.DATA_DIR, exist_ok=True)
+        db.init_db('sqlite:///{}'.format(db.remote_cache_path(stub.base_url)))
+        http = requests.Session()
+        round_trips = [timed(http.get, stub.base_url + '/missing') for _ in range(args.runs)]
+
+        print("cold", file=sys.stderr)
+        cold = timed(sync, stub.base_url)
+        print("warm", file=sys.stderr)
+        warm = [timed(sync, stub.base_url) for _ in range(args.runs)]
+
+        for i in range(args.changes):
+            session_id = args.sessions + i + 1
+            stub.put('play_sessions', {
+                'id': session_id, 'user_app_id': 1, 'started': STARTED + session_id * 600,
+                'duration': 3600, 'note': None})
+            stub.put('play_sessions', {
+                'id': i + 1, 'user_app_id': i % args.apps + 1, 'started': STARTED + (i + 1) * 600,
+                'duration': 7200, 'note': 'Changed'})
+        print("changed", file=sys.stderr)
+        changed = timed(sync, stub.base_url)
+        mismatches = db.verify_runtime_totals()
+    finally:
+        stub.stop()
+
+    report = {
+        'benchmark': 'remote_sync',
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'sessions': args.sessions,
+        'changes': args.changes,
+        'round_trip_ms': statistics.median(round_trips) * 1000,
+        'cold_sync_ms': cold * 1000,
+        'warm_sync_ms': statistics.median(warm) * 1000,
+        'changed_sync_ms': changed * 1000,
+        'runtime_totals_correct': not mismatches,
+    }
+    output = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, 'w') as outfile:
+            outfile.write(output + '\n')
+    else:
+        print(output)
+
+
+if __name__ == '__main__':
+    main()
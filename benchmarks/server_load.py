@@ -0,0 +1,198 @@
+"""Load test gamest.server with many concurrent clients on localhost.
+
+The server runs in a subprocess with a fresh database. Each simulated
+client keeps one connection open and, like gamest in remote mode, syncs,
+creates an App and a UserApp, plays several sessions (start, note, stop)
+and syncs again. The run is repeated for each --max-batch value; 1 commits every
+write on its own. Throughput, latency percentiles per endpoint, errors and
+whether the server's runtime totals add up are written as JSON.
+
+Usage:
+
+    python benchmarks/server_load.py [--clients N] [--cycles N] [--output FILE]
+"""
+import argparse
+import asyncio
+import json
+import os
+import platform
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+os.environ['XDG_DATA_HOME'] = tempfile.mkdtemp(prefix='gamest-bench-')
+os.environ['XDG_CACHE_HOME'] = os.environ['XDG_DATA_HOME']
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from sqlalchemy.orm import Session  # noqa: E402
+
+from gamest import db  # noqa: E402
+from gamest.engine import create_sqlite_engine  # noqa: E402
+
+
+class Client:
+    """A minimal keep-alive HTTP/1.1 client for one connection."""
+
+    def __init__(self, reader, writer, latencies):
+        self.reader = reader
+        self.writer = writer
+        self.latencies = latencies
+        self.errors = 0
+
+    async def request(self, method, path, body=None):
+        payload = b'' if body is None else json.dumps(body).encode('utf-8')
+        start = time.perf_counter()
+        self.writer.write(
+            '{} {} HTTP/1.1\r\nHost: localhost\r\nContent-Type: application/json\r\n'
+            'Content-Length: {}\r\n\r\n'.format(method, path, len(payload)).encode('latin-1') +
+            payload)
+        status = int((await self.reader.readline()).split()[1])
+        headers = {}
+        while (line := await self.reader.readline()) not in (b'\r\n', b''):
+            name, value = line.decode('latin-1').split(':', 1)
+            headers[name.strip().lower()] = value.strip()
+        if headers.get('transfer-encoding') == 'chunked':
+            chunks = []
+            while (size := int(await self.reader.readline(), 16)):
+                chunks.append(await self.reader.readexactly(size + 2))
+            await self.reader.readline()
+            content = b''.join(chunk[:-2] for chunk in chunks)
+        else:
+            content = await self.reader.readexactly(int(headers['content-length']))
+        self.latencies.setdefault(path.split('?')[0], []).append(time.perf_counter() - start)
+        if status != 200:
+            self.errors += 1
+            return None
+        return json.loads(content)
+
+
+async def simulate(port, number, cycles, latencies):
+    reader, writer = await asyncio.open_connection('127.0.0.1', port)
+    client = Client(reader, writer, latencies)
+    try:
+        token = (await client.request('GET', '/sync'))['token']
+        app = await client.request('POST', '/create-app', {'name': 'Game {}'.format(number)})
+        user_app = await client.request('POST', '/create-user-app', {
+            'app_id': app['app_id'], 'identifier_plugin': 'ProcessIdentifierPlugin'})
+        for cycle in range(cycles):
+            started = 1700000000 + cycle * 7200
+            play_session = await client.request('POST', '/start', {
+                'app_id': app['app_id'], 'user_app_id': user_app['user_app_id'],
+                'started': started})
+            await client.request('POST', '/update-session-note', {
+                'play_session_id': play_session['play_session_id'], 'note': 'Cycle {}'.format(cycle)})
+            await client.request('POST', '/stop', {
+                'play_session_id': play_session['play_session_id'], 'duration': 3600})
+        await client.request('GET', '/sync?since={}'.format(token))
+    finally:
+        writer.close()
+    return client.errors
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def start_server(path, port, max_batch):
+    process = subprocess.Popen(
+        [sys.executable, '-m', 'gamest.server', '--port', str(port), '--db', path,
+         '--max-batch', str(max_batch)],
+        cwd=ROOT)
+    deadline = time.monotonic() + 30
+    while time.monotonic() < deadline:
+        try:
+            socket.create_connection(('127.0.0.1', port), timeout=1).close()
+            return process
+        except OSError:
+            time.sleep(0.05)
+    process.kill()
+    raise RuntimeError("Server did not start.")
+
+
+def percentile(samples, fraction):
+    samples = sorted(samples)
+    return samples[min(int(len(samples) * fraction), len(samples) - 1)] * 1000
+
+
+async def load(port, clients, cycles):
+    latencies = {}
+    start = time.perf_counter()
+    errors = await asyncio.gather(*(
+        simulate(port, number, cycles, latencies) for number in range(clients)))
+    return time.perf_counter() - start, latencies, sum(errors)
+
+
+def run(clients, cycles, max_batch):
+    path = os.path.join(tempfile.mkdtemp(prefix='gamest-server-'), 'server.db')
+    port = free_port()
+    process = start_server(path, port, max_batch)
+    try:
+        elapsed, latencies, errors = asyncio.run(load(port, clients, cycles))
+    finally:
+        process.terminate()
+        process.wait()
+
+    engine = create_sqlite_engine('sqlite:///{}'.format(path))
+    with Session(engine) as session:
+        play_sessions = session.query(db.PlaySession).count()
+        mismatches = db.verify_runtime_totals(session)
+    engine.dispose()
+    requests = sum(len(samples) for samples in latencies.values())
+    return {
+        'max_batch': max_batch,
+        'seconds': elapsed,
+        'requests': requests,
+        'requests_per_second': requests / elapsed,
+        'errors': errors,
+        'play_sessions': play_sessions,
+        'runtime_totals_correct': not mismatches,
+        'endpoints': {
+            endpoint: {
+                'count': len(samples),
+                'p50_ms': statistics.median(samples) * 1000,
+                'p95_ms': percentile(samples, 0.95),
+                'p99_ms': percentile(samples, 0.99),
+            }
+            for endpoint, samples in sorted(latencies.items())
+        },
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--clients', type=int, default=300)
+    parser.add_argument('--cycles', type=int, default=10, help="sessions per client")
+    parser.add_argument('--max-batch', type=int, nargs='+', default=[1, 256],
+                        help="server --max-batch values to compare")
+    parser.add_argument('--output', help="write JSON here instead of stdout")
+    args = parser.parse_args(argv)
+
+    results = []
+    for max_batch in args.max_batch:
+        print("max_batch={}".format(max_batch), file=sys.stderr)
+        results.append(run(args.clients, args.cycles, max_batch))
+
+    report = {
+        'benchmark': 'server_load',
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'clients': args.clients,
+        'cycles': args.cycles,
+        'results': results,
+    }
+    output = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, 'w') as outfile:
+            outfile.write(output + '\n')
+    else:
+        print(output)
+
+
+if __name__ == '__main__':
+    main()
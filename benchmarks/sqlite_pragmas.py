@@ -0,0 +1,154 @@
+"""Compare SQLite's default settings with gamest's tuned engine.
+
+A throwaway database is seeded with play sessions and status updates, then
+for each configuration the benchmark measures the latency of the tracker's
+commit pattern (update a session's duration and commit) and the time to
+build the HTML report. Results are written as JSON.
+
+Usage:
+
+    python benchmarks/sqlite_pragmas.py [--sessions N] [--commits N] [--output FILE]
+
+The benchmark uses a throwaway data directory, so it never touches the real
+gamest database.
+"""
+import argparse
+import datetime
+import json
+import os
+import platform
+import shutil
+import statistics
+import sys
+import tempfile
+import time
+
+os.environ['XDG_DATA_HOME'] = tempfile.mkdtemp(prefix='gamest-bench-')
+os.environ['XDG_CACHE_HOME'] = os.environ['XDG_DATA_HOME']
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from sqlalchemy import create_engine, insert, update  # noqa: E402
+from sqlalchemy.orm import sessionmaker  # noqa: E402
+
+from gamest import app, db  # noqa: E402
+from gamest.engine import create_sqlite_engine  # noqa: E402
+
+CONFIGURATIONS = {
+    'default': lambda url: create_engine(url),
+    'tuned': create_sqlite_engine,
+}
+
+
+def seed(path, apps, sessions, updates):
+    """Create a database at path with the given amount of history."""
+    engine = create_engine('sqlite:///{}'.format(path))
+    db.Base.metadata.create_all(engine)
+    started = datetime.datetime(2020, 1, 1)
+    with engine.begin() as conn:
+        conn.execute(insert(db.App), [
+            {'id': i, 'name': 'Game {}'.format(i)} for i in range(1, apps + 1)])
+        conn.execute(insert(db.UserApp), [
+            {'id': i, 'app_id': i, 'identifier_plugin': 'ProcessIdentifierPlugin'}
+            for i in range(1, apps + 1)])
+        conn.execute(insert(db.PlaySession), [
+            {'id': i, 'user_app_id': i % apps + 1,
+             'started': started + datetime.timedelta(hours=i), 'duration': 3600}
+            for i in range(1, sessions + 1)])
+        conn.execute(insert(db.StatusUpdate), [
+            {'play_session_id': i % sessions + 1,
+             'timestamp': started + datetime.timedelta(hours=i % sessions + 1, minutes=1),
+             'note': 'Update {}'.format(i)}
+            for i in range(1, updates + 1)])
+        db.rebuild_runtime_totals(conn)
+    engine.dispose()
+
+
+def measure_commits(engine, commits):
+    timings = []
+    with engine.connect() as conn:
+        for i in range(commits):
+            start = time.perf_counter()
+            with conn.begin():
+                conn.execute(
+                    update(db.PlaySession).
+                    where(db.PlaySession.id == 1).
+                    values(duration=i))
+            timings.append(time.perf_counter() - start)
+    return timings
+
+
+def measure_report(engine, runs):
+    session = sessionmaker(bind=engine)()
+    timings = []
+    try:
+        for _ in range(runs):
+            start = time.perf_counter()
+            for _ in app.iter_report(session):
+                pass
+            timings.append(time.perf_counter() - start)
+            session.rollback()
+    finally:
+        session.close()
+    return timings
+
+
+def summarize(timings):
+    return {
+        'p50_ms': statistics.median(timings) * 1000,
+        'max_ms': max(timings) * 1000,
+        'mean_ms': statistics.fmean(timings) * 1000,
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--apps', type=int, default=200)
+    parser.add_argument('--sessions', type=int, default=20000)
+    parser.add_argument('--updates', type=int, default=20000)
+    parser.add_argument('--commits', type=int, default=200, help="timed commits per configuration")
+    parser.add_argument('--reports', type=int, default=5, help="timed reports per configuration")
+    parser.add_argument('--output', help="write JSON here instead of stdout")
+    args = parser.parse_args(argv)
+
+    workdir = tempfile.mkdtemp(prefix='gamest-pragmas-')
+    template = os.path.join(workdir, 'template.db')
+    print("Seeding {} sessions...".format(args.sessions), file=sys.stderr)
+    seed(template, args.apps, args.sessions, args.updates)
+
+    results = []
+    try:
+        for name, factory in CONFIGURATIONS.items():
+            print(name, file=sys.stderr)
+            path = os.path.join(workdir, name + '.db')
+            shutil.copyfile(template, path)
+            engine = factory('sqlite:///{}'.format(path))
+            with engine.connect() as conn:
+                pragmas = {
+                    pragma: conn.exec_driver_sql('PRAGMA {}'.format(pragma)).scalar()
+                    for pragma in ('journal_mode', 'synchronous', 'cache_size', 'mmap_size')}
+            result = {'configuration': name, 'pragmas': pragmas}
+            result['commit'] = summarize(measure_commits(engine, args.commits))
+            result['report'] = summarize(measure_report(engine, args.reports))
+            results.append(result)
+            engine.dispose()
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    report = {
+        'benchmark': 'sqlite_pragmas',
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'sessions': args.sessions,
+        'updates': args.updates,
+        'results': results,
+    }
+    output = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, 'w') as outfile:
+            outfile.write(output + '\n')
+    else:
+        print(output)
+
+
+if __name__ == '__main__':
+    main()
@@ -1,23 +1,22 @@
 import logging
 import os
 from logging.handlers import TimedRotatingFileHandler
-from shutil import copyfile
 
 import appdirs
-import pkg_resources
 
 DATA_DIR = appdirs.user_data_dir('gamest', False)
 LOG_DIR = appdirs.user_log_dir('gamest', False)
-
-os.makedirs(DATA_DIR, exist_ok=True)
-os.makedirs(LOG_DIR, exist_ok=True)
+LOG_FILE = os.path.join(LOG_DIR, 'gamest.log')
+LOG_FORMAT = '%(asctime)-15s %(levelname)-8s %(name)s: %(message)s'
 
 logger = logging.getLogger(__name__)
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)-15s %(levelname)-8s %(name)s: %(message)s')
-LOG_FILE = os.path.join(LOG_DIR, 'gamest.log')
 
-handler = TimedRotatingFileHandler(LOG_FILE, when='midnight')
-handler.setFormatter(logging.Formatter('%(asctime)-15s %(levelname)-8s %(name)s: %(message)s'))
-logger.addHandler(handler)
+
+def setup_logging(level=logging.INFO):
+    """Log to stderr and to a daily rotated file in LOG_DIR."""
+    os.makedirs(LOG_DIR, exist_ok=True)
+    logging.basicConfig(level=level, format=LOG_FORMAT)
+    if not any(isinstance(h, TimedRotatingFileHandler) for h in logger.handlers):
+        handler = TimedRotatingFileHandler(LOG_FILE, when='midnight')
+        handler.setFormatter(logging.Formatter(LOG_FORMAT))
+        logger.addHandler(handler)
@@ -1,29 +1,31 @@
 # pylint: disable=too-many-ancestors
 """Track time playing games."""
-import datetime
 import importlib
 import logging
 import os
 import pkgutil
 import platform
+import queue
 import sys
+import threading
 import traceback
 import webbrowser
 from collections import OrderedDict
 from typing import Tuple, Union, Dict
 
+import psutil
 import requests
 from tkinter import (Tk, Frame, Toplevel, Label, Entry, Button, Checkbutton,
                      Text, StringVar, IntVar, E, W, DISABLED, NORMAL, END,
-                     ttk, messagebox, filedialog, scrolledtext, PhotoImage)
-from sqlalchemy.sql import or_
+                     ttk, messagebox, filedialog, scrolledtext, PhotoImage, TclError)
 
 import pkg_resources
 
 import gamest_plugins
-from .db import App, UserApp, PlaySession, Session, DBConfig, REMOTE_BASE_URL
-from .util import format_time
-from . import plugins, DATA_DIR, db
+from .db import App, UserApp, PlaySession, Session, DBConfig
+from .tracker import Tracker
+from .util import format_time, positive_float
+from . import plugins, outbox, remote, setup_logging, DATA_DIR, db, engine
 
 if platform.system() == 'Windows':
     import ctypes
@@ -44,53 +46,91 @@ sys.excepthook = excepthook
 
 class FakeProcess:
     def __init__(self):
-        self.running = True
+        self._stopped = threading.Event()
+
+    @property
+    def running(self):
+        return not self._stopped.is_set()
+
+    @running.setter
+    def running(self, value):
+        if value:
+            self._stopped.clear()
+        else:
+            self._stopped.set()
 
     def is_running(self):
         return self.running
 
+    def wait(self, timeout=None):
+        if not self._stopped.wait(timeout):
+            raise psutil.TimeoutExpired(timeout)
 
-def generate_report():
-    """Generate an HTML game report and return it as a string."""
-    apps = list(Session.query(App).
-                filter(App.user_apps.any(or_(
-                    UserApp.play_sessions.any(),
-                    UserApp.initial_runtime > 0))).
-                order_by(App.name).all())
-    html = """
+
+class EventQueue(queue.Queue):
+    """A queue of tracker events that wakes the Tk event loop when it is put to.
+
+    Tkinter hands calls from other threads to the Tk thread and waits for
+    them, so close() must be called before the Tk thread waits on a thread
+    that puts events. Events put after that are drained by the idle tick.
+    """
+
+    def __init__(self, widget):
+        super().__init__()
+        self.widget = widget
+        self.closed = False
+
+    def put(self, item, block=True, timeout=None):
+        super().put(item, block, timeout)
+        if not self.closed:
+            try:
+                self.widget.event_generate('<<TrackerEvent>>', when='tail')
+            except (RuntimeError, TclError):
+                # Tk isn't running its event loop (or isn't threaded).
+                pass
+
+    def close(self):
+        self.closed = True
+
+
+REPORT_HEAD = """
 <!DOCTYPE html>
 <head>
   <title>Gamest Report</title>
   <style type="text/css">
-    td {{
+    td {
       padding: 0 15px 0 15px;
       vertical-align: top;
-    }}
-    td pre {{
+    }
+    td pre {
       margin: 0;
-    }}
-    table.details > tbody > tr:nth-child(even) {{
+    }
+    table.details > tbody > tr:nth-child(even) {
       background: #FFF;
-    }}
-    table.details > tbody > tr:nth-child(odd) {{
+    }
+    table.details > tbody > tr:nth-child(odd) {
       background: #FAFAFF;
-    }}
+    }
   </style>
 </head>
 <body>
   <section name="summaryTable">
     <h1>Summary</h1>
-    {}
+    """
+
+REPORT_MIDDLE = """
   </section>
   <section name="details">
     <h1>Details</h1>
-    {}
+    """
+
+REPORT_TAIL = """
   </section>
 </body>
 </html>
 """
 
-    summary = """
+SUMMARY_HEAD = """
 <table>
   <thead>
     <tr>
@@ -100,56 +140,100 @@ def generate_report():
   </thead>
   <tbody>
 """
-    for app in apps:
-        summary += """\
+
+DETAILS_HEAD = """\
+<h2 id="{}">{}</h2>
+<table class="details">
+  <thead>
+    <tr>
+      <th>Started</th>
+      <th>Duration</th>
+      <th>Note</th>
+    </tr>
+  </thead>
+  <tbody>
+"""
+
+
+def iter_report(session=Session):
+    """Generate an HTML game report, yielding it in chunks.
+
+    The summary and the details are each read with a single ordered query and
+    written out as the rows arrive, so memory use doesn't grow with history.
+    """
+    summary = session.execute(
+        db.report_summary_select().execution_options(stream_results=True))
+
+    yield REPORT_HEAD
+    yield SUMMARY_HEAD
+    for app_id, name, runtime in summary:
+        yield """\
     <tr>
       <td><a href=\"#{}\">{}</a></td>
       <td>{}</td>
-    </tr>""".format(app.id, app.name, format_time(app.runtime))
-
-    summary += "  </tbody>\n</table>\n"
-
-    details = ""
-    for app in apps:
-        details += "<h2 id=\"{}\">{}</h2>\n".format(app.id, app.name)
-        details += "<table class=\"details\">\n"
-        details += "  <thead>\n"
-        details += "    <tr>\n"
-        details += "      <th>Started</th>\n"
-        details += "      <th>Duration</th>\n"
-        details += "      <th>Note</th>\n"
-        details += "    </tr>\n"
-        details += "  </thead>\n"
-        details += "  <tbody>\n"
-        for uapp in app.user_apps:
-            if uapp.initial_runtime:
-                details += "    <tr>\n"
-                details += "      <td>Initial runtime</td>\n"
-                details += "      <td>{}</td>\n".format(format_time(uapp.initial_runtime))
-                details += "      <td></td>\n"
-                details += "    </tr>\n"
-            for session in uapp.play_sessions:
-                details += "    <tr>\n"
-                details += "      <td>{}</td>\n".format(
-                    session.started.strftime('%Y-%m-%d %H:%M:%S'))
-                details += "      <td>{}</td>\n".format(format_time(session.duration))
-                note = session.note if session.note else ''
-                if note and session.status_updates:
-                    note += '<br><br>'
-                if session.status_updates:
-                    note += "        <table>\n"
-                    note += "          <thead><tr><th>Timestamp</th><th>Update</th></tr></thead>\n"
-                    note += "          <tbody>\n"
-                    for update in session.status_updates:
-                        note += "            <tr><td>{}</td><td><pre>{}</pre></td></tr>\n".format(
-                            update.timestamp.strftime('%Y-%m-%d %H:%M:%S'), update.note)
-                    note += "          </tbody></table>\n"
-                details += "      <td>{}</td>\n".format(note)
-                details += "    </tr>\n"
-        details += "  </tbody>\n"
-        details += "</table>\n"
-
-    return html.format(summary, details)
+    </tr>""".format(app_id, name, format_time(runtime))
+    yield "  </tbody>\n</table>\n"
+    yield REPORT_MIDDLE
+
+    details = session.execute(
+        db.report_details_select().execution_options(stream_results=True))
+
+    app_id = user_app_id = session_id = None
+    has_updates = False
+
+    def end_session_row():
+        return "          </tbody></table>\n</td>\n    </tr>\n" if has_updates else "</td>\n    </tr>\n"
+
+    for (row_app_id, app_name, row_user_app_id, initial_runtime,
+         row_session_id, started, duration, note, update_timestamp, update_note) in details:
+        if row_session_id != session_id or row_user_app_id != user_app_id:
+            if session_id is not None:
+                yield end_session_row()
+            session_id = None
+        if row_app_id != app_id:
+            if app_id is not None:
+                yield "  </tbody>\n</table>\n"
+            app_id = row_app_id
+            yield DETAILS_HEAD.format(app_id, app_name)
+        if row_user_app_id != user_app_id:
+            user_app_id = row_user_app_id
+            if initial_runtime:
+                yield ("    <tr>\n"
+                       "      <td>Initial runtime</td>\n"
+                       "      <td>{}</td>\n"
+                       "      <td></td>\n"
+                       "    </tr>\n").format(format_time(initial_runtime))
+        if row_session_id is None:
+            continue
+        if row_session_id != session_id:
+            session_id = row_session_id
+            has_updates = update_timestamp is not None
+            note = note if note else ''
+            if note and has_updates:
+                note += '<br><br>'
+            if has_updates:
+                note += ("        <table>\n"
+                         "          <thead><tr><th>Timestamp</th><th>Update</th></tr></thead>\n"
+                         "          <tbody>\n")
+            yield ("    <tr>\n"
+                   "      <td>{}</td>\n"
+                   "      <td>{}</td>\n"
+                   "      <td>{}").format(
+                       started.strftime('%Y-%m-%d %H:%M:%S'), format_time(duration), note)
+        if has_updates:
+            yield "            <tr><td>{}</td><td><pre>{}</pre></td></tr>\n".format(
+                update_timestamp.strftime('%Y-%m-%d %H:%M:%S'), update_note)
+    if session_id is not None:
+        yield end_session_row()
+    if app_id is not None:
+        yield "  </tbody>\n</table>\n"
+
+    yield REPORT_TAIL
+
+
+def generate_report():
+    """Generate an HTML game report and return it as a string."""
+    return ''.join(iter_report())
 
 
 class SearchableCombobox(ttk.Combobox):
@@ -237,18 +321,19 @@ class AddBox(Frame):
 
     def add_game(self):
         try:
-            index = self.gamecombo.current()
-            if index != -1:
-                app = Session.get(db.App, self.games[index][0])
-            else:
-                app = create_app(name=self.gamecombo.get())
-            user_app = create_user_app(
-                app,
-                identifier_plugin=self.plugin_entry.get(),
-                identifier_data=self.data_entry.get(),
-                note=self.notes_entry.get() or None,
-                initial_runtime=(int(self.seconds_entry.get()) if self.seconds_entry.get() else 0),
-                window_text=self.title_entry.get() or None)
+            with remote.batch():
+                index = self.gamecombo.current()
+                if index != -1:
+                    app = Session.get(db.App, self.games[index][0])
+                else:
+                    app = create_app(name=self.gamecombo.get())
+                user_app = create_user_app(
+                    app,
+                    identifier_plugin=self.plugin_entry.get(),
+                    identifier_data=self.data_entry.get(),
+                    note=self.notes_entry.get() or None,
+                    initial_runtime=(int(self.seconds_entry.get()) if self.seconds_entry.get() else 0),
+                    window_text=self.title_entry.get() or None)
             Session.commit()
             logger.info("Added new userapp: %s", repr(user_app))
 
@@ -319,10 +404,12 @@ class AddTimeBox(Frame):
                         identifier_plugin='manual_time',
                         initial_runtime=0)
 
-                seconds = self.seconds_entry.get()
-                user_app.initial_runtime += int(seconds) if seconds else 0
+                seconds = int(self.seconds_entry.get() or 0)
+                user_app.initial_runtime += seconds
 
                 Session.add(user_app)
+                Session.flush()
+                db.add_runtime(user_app.id, app.id, seconds)
                 Session.commit()
                 logger.info("Added manual time for userapp: %s", repr(user_app))
         except Exception:
@@ -375,6 +462,7 @@ class ManualSessionSelector(Frame):
                 else:
                     app = Session.query(App).get(self.games[index][0])
                     uapp = begin_manual_session(app)
+                    Session.commit()
                     ManualSession(self.parent, uapp)
             else:
                 messagebox.showerror(
@@ -406,6 +494,7 @@ class ManualSession(Frame):
         self.user_app = user_app
         self.proc = FakeProcess()
         appli.RUNNING = (self.proc, self.user_app)
+        appli.tracker.begin_manual_session(self.proc, self.user_app.id)
         self.createWidgets()
 
         self.win.protocol("WM_DELETE_WINDOW", self.end_session)
@@ -540,11 +629,10 @@ def update_session_note(play_session, note):
     if db.IS_REMOTE:
         if not play_session.id:
             raise ValueError("Attempted to edit the note for a non-persisted session.")
-        r = requests.post(
-            REMOTE_BASE_URL + '/update-session-note',
-            json={'play_session_id': play_session.id,
-                  'note': note})
-        r.raise_for_status()
+        outbox.get_outbox().send(
+            '/update-session-note',
+            {'play_session_id': play_session.id,
+             'note': note})
     play_session.note = note
 
 
@@ -612,16 +700,9 @@ class SettingsTab(Frame):
                         "Error in {}: {}".format(key[0], str(exc)))
         return valid
 
-    def save_settings(self):
-        """Validate settings and save to DB."""
-        if self.validate_settings():
-            for key in self.new_values:
-                if self.settings_template[key]['type'] == 'list':
-                    DBConfig.delete(*key)
-                    for value in self.new_values[key]():
-                        DBConfig.set(*key, value, append=True)
-                else:
-                    DBConfig.set(*key, self.new_values[key]())
+    def changes(self):
+        """Return the settings in this tab as ((owner, key), value) pairs."""
+        return [(key, self.new_values[key]()) for key in self.new_values]
 
 
 class SettingsBox(Frame):
@@ -648,6 +729,12 @@ class SettingsBox(Frame):
 
             self.notebook.add(tab, text='Application')
 
+            if not db.IS_REMOTE:
+                try:
+                    self.notebook.add(SettingsTab(self.win, engine.settings_template), text='Database')
+                except Exception:
+                    logger.exception("Failed to build Database settings tab.")
+
             for plugin in parent.installed_plugins.values():
                 if plugin.plugin.get_settings_template():
                     try:
@@ -677,8 +764,11 @@ class SettingsBox(Frame):
                 if not self.nametowidget(tab).validate_settings():
                     valid = False
             if valid:
-                for tab in self.notebook.tabs():
-                    self.nametowidget(tab).save_settings()
+                DBConfig.set_many(
+                    change
+                    for tab in self.notebook.tabs()
+                    for change in self.nametowidget(tab).changes())
+                Session.commit()
                 self.parent.event_generate("<<SettingsUpdated>>")
                 self.on_closing()
         except Exception as exc:
@@ -699,6 +789,7 @@ class Application(Frame):
         self.RUNNING = None
         self.play_session = None
         self.started = None
+        self.events = EventQueue(self)
         self.config = DBConfig(owner='Application')
 
         self.installed_plugins = installed_plugins
@@ -722,6 +813,10 @@ class Application(Frame):
             except Exception:
                 logger.exception("Could not initialize plugin %r.", plugin)
 
+        self.tracker = Tracker(
+            [p for p in self.persistent_plugins if isinstance(p, plugins.IdentifierPlugin)],
+            self.events)
+
         master.grid_columnconfigure(0, weight=1)
 
         self.createWidgets()
@@ -735,7 +830,12 @@ class Application(Frame):
                 logging.getLogger().setLevel(logging.INFO)
                 logger.info("Log level set to INFO")
 
+        self.bind("<<SettingsUpdated>>", lambda e: DBConfig.invalidate_cache(), "+")
         self.bind("<<SettingsUpdated>>", update_log_level, "+")
+        self.bind("<<SettingsUpdated>>", lambda e: self.tracker.reload_settings(), "+")
+        self.bind("<<TrackerEvent>>", lambda e: self.process_events())
+
+    EVENT_INTERVAL = 5000
 
     settings_template: Dict[Tuple[str, str], Dict[str, Union[str, bool]]] = OrderedDict()
     settings_template[('Application', 'confirm_exit')] = {
@@ -744,6 +844,44 @@ class Application(Frame):
         'default': True,
         'hint': "If checked, gamest will ask for confirmation before exiting.",
     }
+    settings_template[('Application', 'identify_deadline')] = {
+        'name': 'Identification deadline (seconds)',
+        'type': 'text',
+        'validate': positive_float,
+        'default': str(Tracker.DEFAULT_DEADLINE),
+        'hint': ("How long to wait for game identifiers on each check. An identifier "
+                 "that takes longer is skipped until it finishes."),
+    }
+    settings_template[('Application', 'poll_min_interval')] = {
+        'name': 'Fastest check interval (seconds)',
+        'type': 'text',
+        'validate': positive_float,
+        'default': '1',
+        'hint': ("How often to check for a running game right after startup or after a "
+                 "game ends. While nothing is found, checks become less frequent."),
+    }
+    settings_template[('Application', 'poll_max_interval')] = {
+        'name': 'Slowest check interval (seconds)',
+        'type': 'text',
+        'validate': positive_float,
+        'default': '30',
+        'hint': "The longest time to wait between checks for a running game.",
+    }
+    settings_template[('Application', 'poll_running_interval')] = {
+        'name': 'Running game interval (seconds)',
+        'type': 'text',
+        'validate': positive_float,
+        'default': '5',
+        'hint': "How often to update the session time while a game is running.",
+    }
+    settings_template[('Application', 'checkpoint_interval')] = {
+        'name': 'Save interval (seconds)',
+        'type': 'text',
+        'validate': positive_float,
+        'default': str(int(Tracker.DEFAULT_CHECKPOINT_INTERVAL)),
+        'hint': ("How often to save the running session's time to the database. Time "
+                 "played since the last save is recovered after a crash."),
+    }
     settings_template[('Application', 'debug')] = {
         'name': 'Debug',
         'type': 'bool',
@@ -761,9 +899,9 @@ class Application(Frame):
             filetypes=(("HTML files", "*.html"),),
         )
         if filename:
-            html = generate_report()
             with open(filename, 'wb') as outfile:
-                outfile.write(html.encode('utf_8'))
+                for chunk in iter_report():
+                    outfile.write(chunk.encode('utf_8'))
             path = 'file://' + os.path.abspath(filename)
             webbrowser.open(path, new=2)
 
@@ -812,163 +950,122 @@ class Application(Frame):
 
         self.grid(stick=E+W)
 
-    def run(self):
-        """Check for a new game every five seconds.
-
-        This method runs when no game is currently being tracked.
-        """
-        try:
-            if self.RUNNING is None:
-                for p in appli.persistent_plugins:
-                    if isinstance(p, plugins.IdentifierPlugin):
-                        self.RUNNING = p.identify_game()
-                        if self.RUNNING is not None:
-                            break
-            if self.RUNNING is not None:
-                logger.debug("self.RUNNING is not None")
-                self.manual_session_button.config(state=DISABLED)
-                self.rtlabel.config(fg='green')
-                self.RUNNING = (self.RUNNING[0], Session.merge(self.RUNNING[1]))
-                self.play_session = begin_session(self.RUNNING[1].app_id, self.RUNNING[1].id)
-                self.started = self.play_session.started
-                for plugin in self.session_plugins:
-                    try:
-                        self.active_plugins.append(plugin(self))
-                        logger.debug("Plugin activated: %s", plugin.__name__)
-                    except plugins.UnsupportedAppError:
-                        pass
-                    except Exception:
-                        logger.exception("Failed to initialize session plugin %r.", plugin)
-                self.event_generate("<<GameStart{}>>".format(self.play_session.id))
-                logger.debug("Now running %s", self.RUNNING[1].app.name)
-                self.running_text.set("Now running: ")
-                self.running_app.set(
-                    "{} (#{})".format(
-                        self.RUNNING[1].app.name,
-                        self.RUNNING[1].id))
-                self.time_text.set(
-                    "{}".format(
-                        format_time(self.RUNNING[1].app.runtime)))
-                self.elapsed_text.set(format_time(0))
-            if self.RUNNING is None:
-                root.after(5000, self.run)
-                self.manual_session_button.config(state=NORMAL)
-            else:
-                root.after(5000, self.wait)
-        except Exception:
-            logger.exception("Mysterious error")
-            root.after(5000, self.run)
-        finally:
-            root.update()
-            Session.commit()
-
-    def wait(self):
-        """Update running game state every 5 seconds.
+    def process_events(self):
+        """Handle state changes posted by the tracker.
 
-        This method runs when a game is currently being tracked.
+        This runs on the Tk thread whenever the tracker posts an event and only
+        does cheap work; detection and persistence happen in the tracker.
         """
         try:
-            if self.RUNNING[0].is_running():
-                try:
-                    elapsed = int((datetime.datetime.now(tz=datetime.UTC) - self.started.replace(tzinfo=datetime.UTC)).total_seconds())
-                    update_session(self.play_session, elapsed)
-                    self.note_button.config(state=NORMAL)
-                    self.time_text.set(format_time(self.RUNNING[1].app.runtime))
-                    self.elapsed_text.set(format_time(elapsed))
-                except Exception:
-                    logger.exception("Failure in running branch")
-            else:
-                self.RUNNING = None
+            while True:
+                event = self.events.get_nowait()
                 try:
-                    self.rtlabel.config(fg='black')
-                    elapsed = int((datetime.datetime.now(tz=datetime.UTC) - self.started.replace(tzinfo=datetime.UTC)).total_seconds())
-                    self.running_text.set("Last running: ")
-                    end_session(self.play_session, elapsed)
+                    getattr(self, 'on_' + event[0])(*event[1:])
                 except Exception:
-                    logger.exception("Failure in not running branch")
-                finally:
-                    self.manual_session_button.config(state=NORMAL)
-                    self.event_generate("<<GameEnd{}>>".format(self.play_session.id))
-                    self.active_plugins = []
-                    self.unbind("<<GameStart{}>>".format(self.play_session.id))
-                    self.unbind("<<GameEnd{}>>".format(self.play_session.id))
-        except Exception:
-            self.RUNNING = None
-            logger.exception("Failure with is_running(), probably")
+                    logger.exception("Failure handling event %r", event)
+        except queue.Empty:
+            pass
         finally:
-            root.update()
-            if self.RUNNING:
-                root.after(5000, self.wait)
-            else:
-                root.after(5000, self.run)
-            Session.commit()
-
-
-def begin_session(app_id, user_app_id):
-    if db.IS_REMOTE:
-        r = requests.post(
-            REMOTE_BASE_URL + '/start',
-            json={'app_id': app_id,
-                  'user_app_id': user_app_id})
-        r.raise_for_status()
-        d = r.json()
-        play_session = PlaySession(
-            id=d['play_session_id'],
-            user_app_id=user_app_id,
-            started=datetime.datetime.fromtimestamp(d['started']).astimezone(datetime.UTC))
-    else:
-        play_session = PlaySession(
-            user_app_id=user_app_id,
-            started=datetime.datetime.now(tz=datetime.UTC))
-    Session.add(play_session)
-    Session.flush()
-    return play_session
-
-
-def update_session(play_session, elapsed):
-    play_session.duration = elapsed
-
-
-def end_session(play_session, elapsed):
-    if db.IS_REMOTE:
-        r = requests.post(
-            REMOTE_BASE_URL + '/stop',
-            json={'play_session_id': play_session.id})
-        r.raise_for_status()
-        d = r.json()
-        play_session.duration = d['duration']
-    else:
-        play_session.duration = elapsed
+            try:
+                if db.has_pending_changes(Session()):
+                    Session.commit()
+            except Exception:
+                logger.exception("Failed to commit changes")
+                Session.rollback()
+
+    def tick(self):
+        """Commit changes made in windows and catch any event that didn't wake Tk."""
+        self.process_events()
+        root.after(self.EVENT_INTERVAL, self.tick)
+
+    def on_start(self, proc, user_app_id, play_session_id, runtime):
+        self.manual_session_button.config(state=DISABLED)
+        self.rtlabel.config(fg='green')
+        self.RUNNING = (proc, Session.get(UserApp, user_app_id))
+        self.play_session = Session.get(PlaySession, play_session_id)
+        self.started = self.play_session.started
+        for plugin in self.session_plugins:
+            try:
+                self.active_plugins.append(plugin(self))
+                logger.debug("Plugin activated: %s", plugin.__name__)
+            except plugins.UnsupportedAppError:
+                pass
+            except Exception:
+                logger.exception("Failed to initialize session plugin %r.", plugin)
+        self.event_generate("<<GameStart{}>>".format(self.play_session.id))
+        self.running_text.set("Now running: ")
+        self.running_app.set(
+            "{} (#{})".format(
+                self.RUNNING[1].app.name,
+                self.RUNNING[1].id))
+        self.time_text.set(format_time(runtime))
+        self.elapsed_text.set(format_time(0))
+        self.note_button.config(state=NORMAL)
+
+    def on_update(self, play_session_id, elapsed, runtime):
+        if self.play_session is None or self.play_session.id != play_session_id:
+            return
+        self.time_text.set(format_time(runtime))
+        self.elapsed_text.set(format_time(elapsed))
+
+    def on_end(self, play_session_id, duration):
+        if self.play_session is None or self.play_session.id != play_session_id:
+            return
+        self.RUNNING = None
+        try:
+            Session.expire(self.play_session, ['duration'])
+            self.rtlabel.config(fg='black')
+            self.running_text.set("Last running: ")
+            self.elapsed_text.set(format_time(duration))
+        finally:
+            self.manual_session_button.config(state=NORMAL)
+            self.event_generate("<<GameEnd{}>>".format(play_session_id))
+            self.active_plugins = []
+            self.unbind("<<GameStart{}>>".format(play_session_id))
+            self.unbind("<<GameEnd{}>>".format(play_session_id))
+
+    def on_rejected(self, proc):
+        if self.RUNNING and self.RUNNING[0] is proc:
+            self.RUNNING = None
+            messagebox.showerror(
+                "Gaming session in progress",
+                "Another game is already running. Quit that game first.")
 
 
 def create_app(name, disambiguation=None):
+    app = db.App(
+        name=name,
+        disambiguation=disambiguation)
     if db.IS_REMOTE:
-        r = requests.post(
-            REMOTE_BASE_URL + '/create-app',
-            json={
+        box = outbox.get_outbox()
+        app.id = box.provisional_id()
+        box.send(
+            '/create-app',
+            {
                 'name': name,
                 'disambiguation': disambiguation,
-            })
-        r.raise_for_status()
-        d = r.json()
-        app = db.App(
-            id=d['app_id'],
-            name=name,
-            disambiguation=disambiguation)
-    else:
-        app = db.App(
-            name=name,
-            disambiguation=disambiguation)
+            },
+            creates={'app_id': app.id})
     Session.add(app)
     Session.flush()
     return app
 
 
 def create_user_app(app, note=None, path=None, identifier_plugin=None, identifier_data=None, initial_runtime=0, window_text=None):
+    uapp = db.UserApp(
+        app=app,
+        note=note,
+        path=path,
+        identifier_plugin=identifier_plugin,
+        identifier_data=identifier_data,
+        initial_runtime=initial_runtime,
+        window_text=window_text)
     if db.IS_REMOTE:
-        r = requests.post(
-            REMOTE_BASE_URL + '/create-user-app',
-            json={
+        box = outbox.get_outbox()
+        uapp.id = box.provisional_id()
+        box.send(
+            '/create-user-app',
+            {
                 'app_id': app.id,
                 'note': note,
                 'path': path,
@@ -976,79 +1073,17 @@ def create_user_app(app, note=None, path=None, identifier_plugin=None, identifie
                 'identifier_data': identifier_data,
                 'initial_runtime': initial_runtime,
                 'window_text': window_text,
-            })
-        r.raise_for_status()
-        d = r.json()
-        uapp = db.UserApp(
-            id=d['user_app_id'],
-            app=app,
-            note=note,
-            path=path,
-            identifier_plugin=identifier_plugin,
-            identifier_data=identifier_data,
-            initial_runtime=initial_runtime,
-            window_text=window_text)
-    else:
-        uapp = db.UserApp(
-            app=app,
-            note=note,
-            path=path,
-            identifier_plugin=identifier_plugin,
-            identifier_data=identifier_data,
-            initial_runtime=initial_runtime,
-            window_text=window_text)
+            },
+            creates={'user_app_id': uapp.id})
     Session.add(uapp)
     Session.flush()
+    db.add_runtime(uapp.id, app.id, initial_runtime or 0)
     return uapp
 
-def load_remote_db(base_url):
-    session = db.Session()
-    if session.query(db.App).count():
-        logger.error("Data exists in DB! No!")
-        raise ValueError("Tried to load data to non-empty DB.")
-    logger.error("Loading remote DB: %r.", base_url)
-    r = requests.get(base_url + '/fetch-remote-db', timeout=5)
-    r.raise_for_status()
-    d = r.json()
-    for a in d['apps']:
-        session.add(db.App(
-            id=a['id'],
-            name=a['name'],
-            disambiguation=a['disambiguation']))
-    for ua in d['user_apps']:
-        session.add(db.UserApp(
-            id=ua['id'],
-            app_id=ua['app_id'],
-            note=ua['note'],
-            path=ua['path'],
-            identifier_plugin=ua['identifier_plugin'],
-            identifier_data=ua['identifier_data'],
-            initial_runtime=ua['initial_runtime'],
-            window_text=ua['window_text']))
-    for s in d['play_sessions']:
-        session.add(db.PlaySession(
-            id=s['id'],
-            user_app_id=s['user_app_id'],
-            started=datetime.datetime.fromtimestamp(s['started']),
-            duration=s['duration'],
-            note=s['note']))
-    session.query(db.Settings).delete()
-    for s in d['settings']:
-        session.add(db.Settings(
-            id=s['id'],
-            owner=s['owner'],
-            key=s['key'],
-            value=s['value']))
-    session.flush()
-    logger.error('Done. DB now contains %r Apps, %r UserApps, and %r PlaySessions.',
-                 session.query(db.App).count(),
-                 session.query(db.UserApp).count(),
-                 session.query(db.PlaySession).count())
-    session.commit()
-
-
 
 def main():
+    setup_logging()
+    db.init_db()
     if DBConfig.getboolean('Application', 'debug', fallback=False):
         logging.getLogger().setLevel(logging.DEBUG)
     if platform.system() == 'Windows' and not ctypes.windll.shell32.IsUserAnAdmin():
@@ -1067,7 +1102,15 @@ def main():
 
     if db.IS_REMOTE:
         logger.info("Starting in remote mode.")
-        load_remote_db(REMOTE_BASE_URL)
+        outbox.get_outbox()
+        try:
+            remote.sync_remote_db(db.REMOTE_BASE_URL)
+        except requests.RequestException:
+            Session.rollback()
+            if Session.get(db.SyncState, 'token') is None:
+                raise
+            logger.exception("Couldn't sync with the remote server; using the local copy.")
+        outbox.get_outbox().start()
 
     global root
     global appli
@@ -1087,20 +1130,15 @@ def main():
     appli = Application(master=root, installed_plugins=installed_plugins)
     icon = PhotoImage("icon", file=pkg_resources.resource_filename('gamest', 'icon.png'))
     appli.tk.call('wm', 'iconphoto', root._w, icon)
-    root.after(1000, appli.run)
+    root.after(1000, appli.tracker.start)
+    root.after(appli.EVENT_INTERVAL, appli.tick)
 
     def on_closing():
         if (DBConfig.getboolean('Application', 'confirm_exit', fallback=True) is False or
                 messagebox.askokcancel("Quit", "Do you want to quit?")):
-            if appli.RUNNING is not None:
-                logger.debug("appli.RUNNING is not None")
-                try:
-                    if appli.RUNNING[0].is_running():
-                        elapsed = int((datetime.datetime.now(tz=datetime.UTC) - appli.started.replace(tzinfo=datetime.UTC)).total_seconds())
-                        appli.play_session.duration = elapsed
-                        Session.commit()
-                except Exception:
-                    logger.exception("Failed is_running check on shutdown")
+            appli.events.close()
+            if appli.tracker.is_alive():
+                appli.tracker.stop(timeout=appli.tracker.STOP_TIMEOUT)
             for plugin in set().union(appli.persistent_plugins, appli.active_plugins):
                 if hasattr(plugin, 'cleanup'):
                     try:
@@ -1110,6 +1148,9 @@ def main():
                     except Exception:
                         logger.exception("Exception cleaning up %s", plugin.__class__.__name__)
             DBConfig.set('Application', 'geometry', root.winfo_geometry())
+            if db.IS_REMOTE:
+                outbox.get_outbox().stop()
+                remote.get_client().metrics.log()
             logger.debug("Committing and quitting.")
             Session.commit()
             root.destroy()
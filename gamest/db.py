@@ -1,16 +1,21 @@
+import calendar
 import datetime
+import hashlib
 import logging
 import os
+import threading
 
 import sqlalchemy.ext.declarative
-from sqlalchemy import Column, Index, ForeignKey, Integer, Text, DateTime, text
-from sqlalchemy.exc import OperationalError
+from sqlalchemy import Column, Index, ForeignKey, Integer, Text, Date, DateTime, event, text
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker, scoped_session, relationship, backref, object_session
-from sqlalchemy import create_engine
+from sqlalchemy.orm import Session as _BaseSession
+from sqlalchemy import and_, bindparam, delete, insert, or_, select, update
 from sqlalchemy.sql import func
 
 from . import DATA_DIR
+from .engine import create_sqlite_engine
+from .migrations import migrate
 
 logger = logging.getLogger(__name__)
 
@@ -21,18 +26,103 @@ DBPATH = os.path.join(DATA_DIR, 'gamest.db')
 IS_REMOTE = os.environ.get('GAMEST_REMOTE') == 'true'
 REMOTE_BASE_URL = os.environ.get('GAMEST_REMOTE_BASE_URL')
 
-if IS_REMOTE and REMOTE_BASE_URL:
-        engine = create_engine('sqlite:///:memory:')
-else:
-    engine = create_engine(r'sqlite:///{}'.format(DBPATH))
 
-Session = scoped_session(sessionmaker(bind=engine))
+def remote_cache_path(base_url):
+    """Path of the local copy of the remote database at base_url."""
+    digest = hashlib.sha1(base_url.encode('utf-8')).hexdigest()[:12]
+    return os.path.join(DATA_DIR, 'remote-{}.db'.format(digest))
+
+_engine = None
+_engine_lock = threading.RLock()
+
+
+def default_url():
+    if IS_REMOTE and REMOTE_BASE_URL:
+        return r'sqlite:///{}'.format(remote_cache_path(REMOTE_BASE_URL))
+    return r'sqlite:///{}'.format(DBPATH)
+
+
+def init_db(url=None):
+    """Create the engine for url (by default, the gamest database) and migrate it.
+
+    Importing this module doesn't touch the database; this runs on the first
+    use of Session or get_engine() if it hasn't been called already.
+    """
+    global _engine
+    with _engine_lock:
+        if url is None:
+            url = default_url()
+            if url != 'sqlite:///:memory:':
+                os.makedirs(DATA_DIR, exist_ok=True)
+        engine = create_sqlite_engine(url)
+        migrate(engine, Base.metadata)
+        if _engine is not None:
+            Session.remove()
+            _engine.dispose()
+        _engine = engine
+        DBConfig.invalidate_cache()
+    return engine
+
+
+def get_engine():
+    with _engine_lock:
+        if _engine is None:
+            init_db()
+        return _engine
+
+
+def __getattr__(name):
+    if name == 'engine':
+        return get_engine()
+    raise AttributeError("module {!r} has no attribute {!r}".format(__name__, name))
+
+
+class _LazySession(_BaseSession):
+    """A Session that initializes the database the first time it needs it."""
+
+    def get_bind(self, *args, **kwargs):  # pylint: disable=arguments-differ
+        if self.bind is None:
+            self.bind = get_engine()
+        return super().get_bind(*args, **kwargs)
+
+
+Session = scoped_session(sessionmaker(class_=_LazySession))
+
+
+@event.listens_for(Session, 'after_flush')
+def _after_flush(session, flush_context):
+    del flush_context
+    session.info['written'] = True
+
+
+@event.listens_for(Session, 'do_orm_execute')
+def _do_orm_execute(orm_execute_state):
+    if orm_execute_state.is_insert or orm_execute_state.is_update or orm_execute_state.is_delete:
+        orm_execute_state.session.info['written'] = True
+
+
+@event.listens_for(Session, 'after_transaction_end')
+def _after_transaction_end(session, transaction):
+    if transaction.parent is None:
+        session.info.pop('written', None)
+
+
+@event.listens_for(Session, 'after_soft_rollback')
+def _after_soft_rollback(session, previous_transaction):
+    del session, previous_transaction
+    # Settings written in the rolled back transaction may be in the cache.
+    DBConfig.invalidate_cache()
+
+
+def has_pending_changes(session):
+    """Return True if session has changes that have not been committed."""
+    return bool(session.new or session.dirty or session.deleted or session.info.get('written'))
 
 class App(Base):
     __tablename__ = 'app'
     id = Column(Integer, primary_key=True)
 
-    name = Column(Text, nullable=False)
+    name = Column(Text, nullable=False, index=True)
     disambiguation = Column(Text)
 
     def __repr__(self):
@@ -44,7 +134,8 @@ class App(Base):
 
     @property
     def runtime(self):
-        return sum(u.runtime for u in self.user_apps)
+        return Session.query(AppRuntime.seconds).filter(
+            AppRuntime.app_id == self.id).scalar() or 0
 
 class UserApp(Base):
     __tablename__ = 'user_app'
@@ -67,11 +158,11 @@ class UserApp(Base):
 
     @property
     def runtime(self):
-        added = Session.query(func.sum(PlaySession.duration)).filter(
-            PlaySession.user_app == self).scalar()
-        if not added:
-            added = 0
-        return self.initial_runtime + added
+        seconds = Session.query(UserAppRuntime.seconds).filter(
+            UserAppRuntime.user_app_id == self.id).scalar()
+        if seconds is None:
+            return self.initial_runtime or 0
+        return seconds
 
     def __repr__(self):
         return "UserApp(id={}, app_id={}, path={}, window_text={}, initial_runtime={})".format(
@@ -82,9 +173,13 @@ class UserApp(Base):
 
 class PlaySession(Base):
     __tablename__ = 'play_session'
+    __table_args__ = (
+        # Covers per-UserApp runtime sums and session history in start order.
+        Index('play_session_user_app_started_duration_idx', 'user_app_id', 'started', 'duration'),
+    )
     id = Column(Integer, primary_key=True)
 
-    user_app_id = Column(Integer, ForeignKey('user_app.id'), nullable=False, index=True)
+    user_app_id = Column(Integer, ForeignKey('user_app.id'), nullable=False)
     user_app = relationship(
         'UserApp',
         backref=backref('play_sessions', order_by='PlaySession.started.asc()'))
@@ -106,9 +201,12 @@ class PlaySession(Base):
 
 class StatusUpdate(Base):
     __tablename__ = 'status_update'
+    __table_args__ = (
+        Index('status_update_play_session_timestamp_idx', 'play_session_id', 'timestamp'),
+    )
     id = Column(Integer, primary_key=True)
 
-    play_session_id = Column(Integer, ForeignKey('play_session.id'), nullable=False, index=True)
+    play_session_id = Column(Integer, ForeignKey('play_session.id'), nullable=False)
     timestamp = Column(DateTime, nullable=False, default=func.now(), index=True)
     note = Column(Text)
 
@@ -138,54 +236,273 @@ class Settings(Base):
         return "Settings(id={}, owner={!r}, key={!r}, value={!r})".format(
             self.id, self.owner, self.key, self.value)
 
-Base.metadata.create_all(engine)
-
-def schema_updates():
-    """Update the DB schema."""
-    try:
-        Session.execute(text('ALTER TABLE user_app ADD COLUMN identifier_plugin VARCHAR'))
-        logger.info("Added 'identifier_plugin' column to table 'user_app'")
-    except OperationalError:
-        logger.debug("'identifier_plugin' column already present on table 'user_app'")
-    try:
-        Session.execute(text('ALTER TABLE user_app ADD COLUMN identifier_data VARCHAR'))
-        logger.info("Added 'identifier_data' column to table 'user_app'")
-    except OperationalError:
-        logger.debug("'identifier_data' column already present on table 'user_app'")
-    try:
-        Session.execute(text('ALTER TABLE app DROP COLUMN window_text'))
-        logger.info("Removed 'window_text' column from table 'app'")
-    except OperationalError:
-        logger.debug("'window_text' column already removed from table 'app'")
-    try:
-        Session.execute(text('ALTER TABLE app DROP COLUMN use_window_text'))
-        logger.info("Removed 'use_window_text' column from table 'app'")
-    except OperationalError:
-        logger.debug("'use_window_text' column already removed from table 'app'")
-    try:
-        Session.execute(text('ALTER TABLE app DROP COLUMN default_path'))
-        logger.info("Removed 'default_path' column from table 'app'")
-    except OperationalError:
-        logger.debug("'default_path' column already removed from table 'app'")
-
-    db_version = Session.query(Settings.value).filter(
-            Settings.owner == 'DB',
-            Settings.key == 'version').\
-        scalar()
-    if not db_version:
-        # convert old timestamps to UTC
-        play_sessions = Session.query(PlaySession).filter(
-            ~PlaySession.user_app.has(
-                UserApp.identifier_plugin == 'gamest_web'))
-        for ps in play_sessions:
-            ps.started = ps.started.astimezone(datetime.timezone.utc)
-        Session.add(Settings(owner='DB', key='version', value='1'))
-
-    Session.commit()
-
-schema_updates()
+class UserAppRuntime(Base):
+    """Total runtime of a UserApp: initial_runtime plus all session durations."""
+    __tablename__ = 'user_app_runtime'
+    user_app_id = Column(Integer, ForeignKey('user_app.id'), primary_key=True)
+    seconds = Column(Integer, nullable=False, default=0)
+
+    def __repr__(self):
+        return "UserAppRuntime(user_app_id={}, seconds={})".format(self.user_app_id, self.seconds)
+
+class AppRuntime(Base):
+    """Total runtime of an App across all of its UserApps."""
+    __tablename__ = 'app_runtime'
+    app_id = Column(Integer, ForeignKey('app.id'), primary_key=True)
+    seconds = Column(Integer, nullable=False, default=0)
+
+    def __repr__(self):
+        return "AppRuntime(app_id={}, seconds={})".format(self.app_id, self.seconds)
+
+class DailyPlaytime(Base):
+    """Seconds played of an App on one UTC day, and the sessions started that day."""
+    __tablename__ = 'daily_playtime'
+    __table_args__ = (
+        Index('daily_playtime_day_idx', 'day'),
+    )
+    app_id = Column(Integer, ForeignKey('app.id'), primary_key=True)
+    day = Column(Date, primary_key=True)
+    seconds = Column(Integer, nullable=False, default=0)
+    session_count = Column(Integer, nullable=False, default=0)
+
+    def __repr__(self):
+        return "DailyPlaytime(app_id={}, day={}, seconds={}, session_count={})".format(
+            self.app_id, self.day, self.seconds, self.session_count)
+
+class SyncState(Base):
+    """Local bookkeeping for remote mode, kept apart from the synced settings."""
+    __tablename__ = 'sync_state'
+    key = Column(Text, primary_key=True)
+    value = Column(Text)
+
+    def __repr__(self):
+        return "SyncState(key={!r}, value={!r})".format(self.key, self.value)
+
+# Upserts are written out because SQLAlchemy compiles ON CONFLICT statements
+# anew on every execution, which costs far more than running them.
+_ADD_RUNTIME = [
+    text("""
+        INSERT INTO {table} ({key}, seconds) VALUES (:id, :seconds)
+        ON CONFLICT ({key}) DO UPDATE SET seconds = seconds + excluded.seconds
+    """.format(table=table, key=key))
+    for table, key in (('user_app_runtime', 'user_app_id'), ('app_runtime', 'app_id'))]
+
+def add_runtime(user_app_id, app_id, seconds, session=Session):
+    """Add seconds to the runtime totals of a UserApp and its App."""
+    for stmt, value in zip(_ADD_RUNTIME, (user_app_id, app_id)):
+        session.execute(stmt, {'id': value, 'seconds': seconds})
+
+def _user_app_runtimes():
+    """Return a select computing each UserApp's runtime from scratch."""
+    played = select(func.coalesce(func.sum(PlaySession.duration), 0)).\
+        where(PlaySession.user_app_id == UserApp.id).\
+        scalar_subquery()
+    return select(UserApp.id, UserApp.app_id, (UserApp.initial_runtime + played).label('seconds'))
+
+def rebuild_runtime_totals(session=Session, app_ids=None):
+    """Recompute the runtime totals from user_app and play_session.
+
+    If app_ids is given, only the totals of those Apps and their UserApps are
+    recomputed.
+    """
+    user_apps = _user_app_runtimes()
+    delete_user_apps = delete(UserAppRuntime.__table__)
+    delete_apps = delete(AppRuntime.__table__)
+    app_totals = select(UserApp.app_id, func.sum(UserAppRuntime.seconds)).\
+        join(UserAppRuntime, UserAppRuntime.user_app_id == UserApp.id).\
+        group_by(UserApp.app_id)
+    if app_ids is not None:
+        app_ids = list(app_ids)
+        user_apps = user_apps.where(UserApp.app_id.in_(app_ids))
+        delete_user_apps = delete_user_apps.where(UserAppRuntime.user_app_id.in_(
+            select(UserApp.id).where(UserApp.app_id.in_(app_ids))))
+        delete_apps = delete_apps.where(AppRuntime.app_id.in_(app_ids))
+        app_totals = app_totals.where(UserApp.app_id.in_(app_ids))
+    user_apps = user_apps.subquery()
+    session.execute(delete_user_apps)
+    session.execute(delete_apps)
+    session.execute(insert(UserAppRuntime.__table__).from_select(
+        ['user_app_id', 'seconds'],
+        select(user_apps.c.id, user_apps.c.seconds)))
+    session.execute(insert(AppRuntime.__table__).from_select(['app_id', 'seconds'], app_totals))
+
+SECONDS_PER_DAY = 24 * 60 * 60
+
+def _epoch(timestamp):
+    """Whole seconds since the epoch of a UTC datetime, naive or aware."""
+    return calendar.timegm(timestamp.utctimetuple())
+
+def split_by_day(start, end):
+    """Split the interval [start, end) of epoch seconds at UTC midnights.
+
+    Returns a list of (date, seconds) pairs.
+    """
+    pieces = []
+    while start < end:
+        midnight = (start // SECONDS_PER_DAY + 1) * SECONDS_PER_DAY
+        day = datetime.datetime.fromtimestamp(start, tz=datetime.timezone.utc).date()
+        pieces.append((day, min(end, midnight) - start))
+        start = midnight
+    return pieces
+
+_ADD_PLAYTIME = text("""
+    INSERT INTO daily_playtime (app_id, day, seconds, session_count)
+    VALUES (:app_id, :day, :seconds, :session_count)
+    ON CONFLICT (app_id, day) DO UPDATE SET
+        seconds = seconds + excluded.seconds,
+        session_count = session_count + excluded.session_count
+""").bindparams(bindparam('day', type_=Date))
+
+def add_playtime(app_id, started, previous, duration, new_session=False, session=Session):
+    """Update the daily playtime of a session that started at started.
+
+    previous and duration are the session's old and new durations; only the
+    time between them is added (or removed, if duration is smaller). If
+    new_session is true the session is counted on the day it started.
+    """
+    start = _epoch(started)
+    sign = 1 if duration >= previous else -1
+    pieces = [(day, sign * seconds) for day, seconds in
+              split_by_day(start + min(previous, duration), start + max(previous, duration))]
+    if new_session:
+        pieces.append((datetime.datetime.fromtimestamp(start, tz=datetime.timezone.utc).date(), 0))
+    for day, seconds in pieces:
+        session.execute(_ADD_PLAYTIME, {
+            'app_id': app_id, 'day': day, 'seconds': seconds, 'session_count': int(new_session)})
+        new_session = False
+
+# Splits every session at UTC midnights. Start times are truncated to whole
+# seconds, as in add_playtime.
+_REBUILD_DAILY_PLAYTIME = """
+    INSERT INTO daily_playtime (app_id, day, seconds, session_count)
+    WITH RECURSIVE piece(app_id, start, finish, first) AS (
+        SELECT user_app.app_id,
+               CAST(strftime('%s', play_session.started) AS INTEGER),
+               CAST(strftime('%s', play_session.started) AS INTEGER) + play_session.duration,
+               1
+        FROM play_session JOIN user_app ON user_app.id = play_session.user_app_id
+        {where}
+        UNION ALL
+        SELECT app_id, (start / 86400 + 1) * 86400, finish, 0
+        FROM piece
+        WHERE (start / 86400 + 1) * 86400 < finish
+    )
+    SELECT app_id, date(start, 'unixepoch'),
+           SUM(MAX(MIN(finish, (start / 86400 + 1) * 86400) - start, 0)),
+           SUM(first)
+    FROM piece
+    GROUP BY app_id, date(start, 'unixepoch')
+    """
+
+def rebuild_daily_playtime(session=Session, app_ids=None):
+    """Recompute daily_playtime from play_session.
+
+    If app_ids is given, only the rows of those Apps are recomputed.
+    """
+    if app_ids is None:
+        session.execute(delete(DailyPlaytime.__table__))
+        session.execute(text(_REBUILD_DAILY_PLAYTIME.format(where='')))
+    else:
+        app_ids = list(app_ids)
+        session.execute(delete(DailyPlaytime.__table__).where(DailyPlaytime.app_id.in_(app_ids)))
+        session.execute(
+            text(_REBUILD_DAILY_PLAYTIME.format(where='WHERE user_app.app_id IN :app_ids')).
+            bindparams(bindparam('app_ids', expanding=True)),
+            {'app_ids': app_ids})
+
+PERIOD_FORMATS = {
+    'day': '%Y-%m-%d',
+    'week': '%Y-W%W',
+    'month': '%Y-%m',
+    'year': '%Y',
+}
+
+def playtime_by_period(period='month', start=None, end=None, app_ids=None, session=Session):
+    """Return (period, app_id, seconds, session_count) rows from daily_playtime.
+
+    period is one of PERIOD_FORMATS; rows are labelled like '2020-03' for
+    months or '2020-W09' for weeks (weeks start on Monday). start and end are
+    optional dates limiting the days included, end exclusive. Rows are ordered
+    by period, then app_id.
+    """
+    label = func.strftime(PERIOD_FORMATS[period], DailyPlaytime.day).label('period')
+    stmt = select(
+        label,
+        DailyPlaytime.app_id,
+        func.sum(DailyPlaytime.seconds),
+        func.sum(DailyPlaytime.session_count)).\
+        group_by(label, DailyPlaytime.app_id).\
+        order_by(label, DailyPlaytime.app_id)
+    if start is not None:
+        stmt = stmt.where(DailyPlaytime.day >= start)
+    if end is not None:
+        stmt = stmt.where(DailyPlaytime.day < end)
+    if app_ids is not None:
+        stmt = stmt.where(DailyPlaytime.app_id.in_(app_ids))
+    return session.execute(stmt).all()
+
+def _reported_apps():
+    """Apps with at least one session or some initial runtime."""
+    return App.user_apps.any(or_(UserApp.play_sessions.any(), UserApp.initial_runtime > 0))
+
+def report_summary_select():
+    """Select (app id, name, runtime) for the report summary, in report order."""
+    return select(App.id, App.name, func.coalesce(AppRuntime.seconds, 0)).\
+        outerjoin(AppRuntime, AppRuntime.app_id == App.id).\
+        where(_reported_apps()).\
+        order_by(App.name, App.id)
+
+def report_details_select():
+    """Select every session and status update for the report details, in report order.
+
+    The order follows the indexes on app.name, user_app.app_id and the
+    composite session and status update indexes, so SQLite walks them in
+    order instead of sorting the whole join. Sessions that started at the
+    same moment are ordered by duration, as in the index.
+    """
+    return select(App.id, App.name,
+                  UserApp.id, UserApp.initial_runtime,
+                  PlaySession.id, PlaySession.started, PlaySession.duration, PlaySession.note,
+                  StatusUpdate.timestamp, StatusUpdate.note).\
+        join(UserApp, UserApp.app_id == App.id).\
+        outerjoin(PlaySession, PlaySession.user_app_id == UserApp.id).\
+        outerjoin(StatusUpdate, StatusUpdate.play_session_id == PlaySession.id).\
+        where(_reported_apps()).\
+        order_by(App.name, App.id, UserApp.id,
+                 PlaySession.started, PlaySession.duration, PlaySession.id,
+                 StatusUpdate.timestamp, StatusUpdate.id)
+
+def verify_runtime_totals(session=Session):
+    """Compare the runtime totals to the sessions they summarize.
+
+    Returns a list of (table, id, stored, actual) tuples, one for each total
+    that is wrong or missing.
+    """
+    user_apps = _user_app_runtimes()
+    stored = dict(session.execute(select(UserAppRuntime.user_app_id, UserAppRuntime.seconds)).all())
+    mismatches = []
+    actual_apps = {}
+    for user_app_id, app_id, seconds in session.execute(user_apps):
+        actual_apps[app_id] = actual_apps.get(app_id, 0) + seconds
+        if stored.get(user_app_id) != seconds:
+            mismatches.append(('user_app_runtime', user_app_id, stored.get(user_app_id), seconds))
+    stored = dict(session.execute(select(AppRuntime.app_id, AppRuntime.seconds)).all())
+    for app_id, seconds in sorted(actual_apps.items()):
+        if stored.get(app_id) != seconds:
+            mismatches.append(('app_runtime', app_id, stored.get(app_id), seconds))
+    return mismatches
 
 class DBConfig:
+    """Settings stored in the database.
+
+    All settings are loaded into a process-wide cache on first use, so reads
+    don't touch the database. static_set and static_delete write through to
+    the cache. invalidate_cache() drops it; it is reloaded on the next read.
+    """
+
+    _cache = None
+    _cache_lock = threading.RLock()
+
     def __init__(self, owner):
         self.owner = owner
         self.get = self.instance_get
@@ -194,15 +511,39 @@ class DBConfig:
         self.set = self.instance_set
         self.delete = self.instance_delete
 
+    @classmethod
+    def invalidate_cache(cls):
+        with cls._cache_lock:
+            cls._cache = None
+
+    @staticmethod
+    def _values(owner, key):
+        """Return a tuple of the values of owner.key, in insertion order."""
+        with DBConfig._cache_lock:
+            if DBConfig._cache is None:
+                cache = {}
+                for row in Session.query(Settings.owner, Settings.key, Settings.value).\
+                        order_by(Settings.id.asc()):
+                    cache.setdefault((row.owner, row.key), []).append(row.value)
+                DBConfig._cache = cache
+            return tuple(DBConfig._cache.get((owner, key), ()))
+
+    @staticmethod
+    def _cache_set(owner, key, values):
+        with DBConfig._cache_lock:
+            if DBConfig._cache is None:
+                return
+            if not all(isinstance(v, str) for v in values):
+                # The database will hand these back as text; let it.
+                DBConfig._cache = None
+            elif values:
+                DBConfig._cache[(owner, key)] = list(values)
+            else:
+                DBConfig._cache.pop((owner, key), None)
+
     @staticmethod
     def static_get(owner, key, *, type=lambda x: x, fallback='NO FALLBACK'):
-        value = Session.query(Settings.value).\
-            filter(
-                Settings.owner == owner,
-                Settings.key == key).\
-            order_by(Settings.id.asc()).\
-            limit(1).\
-            scalar()
+        value = next(iter(DBConfig._values(owner, key)), None)
         if value is None:
             if fallback == 'NO FALLBACK':
                 raise KeyError
@@ -217,14 +558,9 @@ class DBConfig:
 
     @staticmethod
     def static_getlist(owner, key, *, type=lambda x: x):
-        values = Session.query(Settings.value).\
-            filter(
-                Settings.owner == owner,
-                Settings.key == key).\
-            order_by(Settings.id.asc())
-        for value in values:
+        for value in DBConfig._values(owner, key):
             try:
-                yield type(value[0])
+                yield type(value)
             except Exception:
                 continue
 
@@ -236,13 +572,7 @@ class DBConfig:
 
     @staticmethod
     def static_getboolean(owner, key, *, fallback='NO FALLBACK'):
-        value = Session.query(Settings.value).\
-            filter(
-                Settings.owner == owner,
-                Settings.key == key).\
-            order_by(Settings.id.asc()).\
-            limit(1).\
-            scalar()
+        value = next(iter(DBConfig._values(owner, key)), None)
         if value is None:
             if fallback == 'NO FALLBACK':
                 raise KeyError
@@ -263,20 +593,57 @@ class DBConfig:
     @staticmethod
     def static_set(owner, key, value, append=False):
         logger.debug("Setting %s.%s to %r (append=%r)", owner, key, value, append)
-        settings = Session.query(Settings).\
-            filter(
-                Settings.owner == owner,
-                Settings.key == key)
-        if not append and settings.count() > 1:
-            raise ValueError("Cannot replace settings list.")
         if append:
-            Session.add(Settings(owner=owner, key=key, value=value))
+            values = list(DBConfig._values(owner, key)) + [value]
+            Session.execute(
+                insert(Settings.__table__),
+                [{'owner': owner, 'key': key, 'value': value}])
+            DBConfig._cache_set(owner, key, values)
         else:
-            settings = settings.first()
-            if settings:
-                settings.value = value
+            DBConfig.set_many([((owner, key), value)])
+
+    @staticmethod
+    def set_many(changes):
+        """Apply many settings changes as one batch of statements.
+
+        changes is an iterable of ((owner, key), value) pairs. A list value
+        replaces all values of a list setting. Any other value replaces a
+        scalar setting the way static_set does. Existing scalars are updated
+        in place and everything else is inserted, using at most one DELETE,
+        one UPDATE and one INSERT in total. The caller commits.
+        """
+        changes = list(changes)
+        table = Settings.__table__
+
+        deletes, updates, inserts = [], [], []
+        for (owner, key), value in changes:
+            if isinstance(value, list):
+                deletes.append((owner, key))
+                inserts.extend({'owner': owner, 'key': key, 'value': v} for v in value)
             else:
-                Session.add(Settings(owner=owner, key=key, value=value))
+                existing = DBConfig._values(owner, key)
+                if len(existing) > 1:
+                    raise ValueError("Cannot replace settings list.")
+                if existing:
+                    updates.append({'b_owner': owner, 'b_key': key, 'b_value': value})
+                else:
+                    inserts.append({'owner': owner, 'key': key, 'value': value})
+
+        if deletes:
+            Session.execute(delete(table).where(or_(*(
+                and_(table.c.owner == owner, table.c.key == key)
+                for owner, key in deletes))))
+        if updates:
+            Session.execute(
+                update(table).
+                where(table.c.owner == bindparam('b_owner'), table.c.key == bindparam('b_key')).
+                values(value=bindparam('b_value')),
+                updates)
+        if inserts:
+            Session.execute(insert(table), inserts)
+
+        for (owner, key), value in changes:
+            DBConfig._cache_set(owner, key, value if isinstance(value, list) else [value])
 
     set = static_set
 
@@ -290,6 +657,7 @@ class DBConfig:
                 Settings.owner == owner,
                 Settings.key == key).\
             delete()
+        DBConfig._cache_set(owner, key, [])
 
     delete = static_delete
 
@@ -0,0 +1,122 @@
+"""SQLite engine configuration."""
+import logging
+import re
+import sqlite3
+from collections import OrderedDict
+
+from sqlalchemy import create_engine, event
+from sqlalchemy.pool import QueuePool, StaticPool
+
+logger = logging.getLogger(__name__)
+
+# Defaults applied to every new connection. WAL lets the tracker commit while
+# the UI reads, and with WAL synchronous=NORMAL is still safe against
+# corruption; at worst the last commits before a power loss are lost.
+SQLITE_PRAGMAS = OrderedDict([
+    ('journal_mode', 'WAL'),
+    ('synchronous', 'NORMAL'),
+    ('mmap_size', str(256 * 1024 * 1024)),
+    ('cache_size', str(-16 * 1024)),
+    ('temp_store', 'MEMORY'),
+])
+
+# Number of prepared statements pysqlite keeps per connection.
+STATEMENT_CACHE_SIZE = 256
+
+_PRAGMA_VALUE = re.compile(r'^-?[A-Za-z0-9_]+$')
+
+settings_template = OrderedDict()
+settings_template[('SQLite', 'journal_mode')] = {
+    'name': 'Journal mode',
+    'type': 'text',
+    'default': SQLITE_PRAGMAS['journal_mode'],
+    'hint': ("SQLite journal_mode. WAL is recommended. Changes to database settings "
+             "take effect the next time gamest starts."),
+}
+settings_template[('SQLite', 'synchronous')] = {
+    'name': 'Synchronous',
+    'type': 'text',
+    'default': SQLITE_PRAGMAS['synchronous'],
+    'hint': ("SQLite synchronous setting. NORMAL avoids waiting for the disk on every "
+             "commit; FULL is slower but never loses a committed transaction."),
+}
+settings_template[('SQLite', 'mmap_size')] = {
+    'name': 'Memory map size (bytes)',
+    'type': 'text',
+    'validate': int,
+    'default': SQLITE_PRAGMAS['mmap_size'],
+    'hint': "How much of the database SQLite may memory-map. 0 disables it.",
+}
+settings_template[('SQLite', 'cache_size')] = {
+    'name': 'Cache size',
+    'type': 'text',
+    'validate': int,
+    'default': SQLITE_PRAGMAS['cache_size'],
+    'hint': "SQLite page cache size. Negative values are in KiB, positive in pages.",
+}
+settings_template[('SQLite', 'temp_store')] = {
+    'name': 'Temporary storage',
+    'type': 'text',
+    'default': SQLITE_PRAGMAS['temp_store'],
+    'hint': "Where SQLite keeps temporary tables: MEMORY, FILE or DEFAULT.",
+}
+
+
+def _pragma_overrides(dbapi_connection):
+    """Read pragma overrides from the settings table, if it exists yet."""
+    try:
+        rows = dbapi_connection.execute(
+            "SELECT key, value FROM settings WHERE owner = 'SQLite' ORDER BY id").fetchall()
+    except sqlite3.OperationalError:
+        return {}
+    return dict(rows)
+
+
+def configure_sqlite(engine, pragmas=None):
+    """Set pragmas on every connection engine opens.
+
+    pragmas defaults to SQLITE_PRAGMAS. Values stored in the settings table
+    under the 'SQLite' owner override them.
+    """
+    pragmas = OrderedDict(SQLITE_PRAGMAS if pragmas is None else pragmas)
+
+    @event.listens_for(engine, 'connect')
+    def set_pragmas(dbapi_connection, connection_record):
+        del connection_record
+        values = OrderedDict(pragmas)
+        for name, value in _pragma_overrides(dbapi_connection).items():
+            if name in values and value:
+                values[name] = value
+        for name, value in values.items():
+            if not _PRAGMA_VALUE.match(str(value)):
+                logger.warning("Ignoring invalid value for PRAGMA %s: %r", name, value)
+                continue
+            dbapi_connection.execute('PRAGMA {} = {}'.format(name, value))
+
+    return engine
+
+
+def create_sqlite_engine(url, pragmas=None):
+    """Create an engine for a SQLite database with gamest's tuning applied.
+
+    File databases keep a small pool of connections so that pysqlite's
+    prepared statement cache survives between transactions. In-memory
+    databases share a single connection between threads.
+    """
+    if url in ('sqlite://', 'sqlite:///:memory:'):
+        engine = create_engine(
+            url,
+            connect_args={'check_same_thread': False},
+            poolclass=StaticPool)
+        pragmas = OrderedDict(
+            (k, v) for k, v in (SQLITE_PRAGMAS if pragmas is None else pragmas).items()
+            if k not in ('journal_mode', 'mmap_size'))
+    else:
+        engine = create_engine(
+            url,
+            connect_args={
+                'check_same_thread': False,
+                'cached_statements': STATEMENT_CACHE_SIZE,
+            },
+            poolclass=QueuePool)
+    return configure_sqlite(engine, pragmas)
@@ -0,0 +1,61 @@
+"""Crash-safe record of the running session's duration.
+
+Between database checkpoints the tracker appends the running session's
+elapsed time to a small file. If gamest stops without checkpointing, the last
+value recorded for each session is restored into the database at the next
+startup.
+"""
+import logging
+import os
+
+from . import DATA_DIR
+
+logger = logging.getLogger(__name__)
+
+HEARTBEAT_FILE = os.path.join(DATA_DIR, 'heartbeat')
+
+
+class Heartbeat:
+    """Append-only log of (play_session_id, elapsed) pairs.
+
+    The file is emptied with clear() once the values in it are safely in the
+    database, so it never holds more than one checkpoint interval of beats.
+    """
+
+    def __init__(self, path=HEARTBEAT_FILE):
+        self.path = path
+        self._file = None
+
+    def beat(self, play_session_id, elapsed):
+        if self._file is None:
+            self._file = open(self.path, 'a', encoding='ascii')
+        self._file.write("{} {}\n".format(play_session_id, elapsed))
+        self._file.flush()
+
+    def clear(self):
+        if self._file is None:
+            self._file = open(self.path, 'a', encoding='ascii')
+        self._file.truncate(0)
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+    def recover(self):
+        """Return {play_session_id: elapsed} with the last beat for each session."""
+        try:
+            with open(self.path, encoding='ascii', errors='replace') as infile:
+                lines = infile.read().splitlines()
+        except FileNotFoundError:
+            return {}
+        beats = {}
+        for line in lines:
+            try:
+                play_session_id, elapsed = (int(f) for f in line.split())
+            except ValueError:
+                # A crash in the middle of a write can leave a partial line.
+                logger.debug("Ignoring heartbeat line %r", line)
+                continue
+            beats[play_session_id] = elapsed
+        return beats
@@ -0,0 +1,130 @@
+"""Database maintenance commands.
+
+Usage:
+
+    python -m gamest.maintenance verify-runtime
+    python -m gamest.maintenance rebuild-runtime
+    python -m gamest.maintenance check-query-plans [--verbose]
+"""
+import argparse
+import logging
+import re
+import sys
+
+from sqlalchemy import select
+from sqlalchemy.sql import func
+
+from . import db, setup_logging
+
+logger = logging.getLogger(__name__)
+
+
+def verify_runtime(args):
+    del args
+    mismatches = db.verify_runtime_totals()
+    for table, row_id, stored, actual in mismatches:
+        print("{} {}: stored {}, actual {}".format(table, row_id, stored, actual))
+    if mismatches:
+        print("{} runtime totals are wrong. Run rebuild-runtime to fix them.".format(len(mismatches)))
+        return 1
+    print("Runtime totals are correct.")
+    return 0
+
+
+def rebuild_runtime(args):
+    del args
+    db.rebuild_runtime_totals()
+    db.rebuild_daily_playtime()
+    db.Session.commit()
+    print("Runtime totals and daily playtime rebuilt.")
+    return 0
+
+
+# The checked queries must look rows up in these tables, never scan them.
+INDEXED_TABLES = ('play_session', 'status_update')
+
+QUERY_PLAN_CHECKS = {
+    'user app runtime': lambda: select(func.sum(db.PlaySession.duration)).
+    where(db.PlaySession.user_app_id == 1),
+    'all user app runtimes': db._user_app_runtimes,  # pylint: disable=protected-access
+    'session history': lambda: select(db.PlaySession).
+    where(db.PlaySession.user_app_id == 1).
+    order_by(db.PlaySession.started.asc()),
+    'status updates': lambda: select(db.StatusUpdate).
+    where(db.StatusUpdate.play_session_id == 1).
+    order_by(db.StatusUpdate.timestamp.asc()),
+    'report summary': db.report_summary_select,
+    'report details': db.report_details_select,
+}
+
+# These checks stream every row in order and must not sort them in a temp B-tree.
+UNSORTED_CHECKS = ('report summary', 'report details')
+
+
+def explain(stmt, session=db.Session):
+    """Return the EXPLAIN QUERY PLAN detail lines for stmt."""
+    compiled = stmt.compile(dialect=session.get_bind().dialect)
+    params = tuple(compiled.params[name] for name in compiled.positiontup)
+    rows = session.connection().exec_driver_sql('EXPLAIN QUERY PLAN ' + str(compiled), params)
+    return [row[3] for row in rows]
+
+
+def table_scans(plan):
+    """Return the plan lines that scan one of INDEXED_TABLES.
+
+    A scan in the order of some unrelated index is still a scan, so only
+    SEARCH steps pass.
+    """
+    pattern = re.compile(r'^SCAN ({})\b'.format('|'.join(INDEXED_TABLES)))
+    return [line for line in plan if pattern.match(line)]
+
+
+def sorts(plan):
+    """Return the plan lines that sort rows in a temporary B-tree."""
+    return [line for line in plan if line.startswith('USE TEMP B-TREE')]
+
+
+def problems(name, plan):
+    """Return the plan lines that make the check called name fail."""
+    return table_scans(plan) + (sorts(plan) if name in UNSORTED_CHECKS else [])
+
+
+def check_query_plans(args):
+    failures = 0
+    for name, build in QUERY_PLAN_CHECKS.items():
+        plan = explain(build())
+        failed = problems(name, plan)
+        print("{}: {}".format(name, "table scan or sort" if failed else "ok"))
+        for line in (plan if args.verbose else failed):
+            print("    " + line)
+        failures += bool(failed)
+    db.Session.rollback()
+    if failures:
+        print("{} queries scan {} or sort their results.".format(
+            failures, " or ".join(INDEXED_TABLES)))
+        return 1
+    return 0
+
+
+COMMANDS = {
+    'verify-runtime': (verify_runtime, "check the runtime totals against play sessions"),
+    'rebuild-runtime': (rebuild_runtime,
+                        "recompute the runtime totals and daily playtime from play sessions"),
+    'check-query-plans': (check_query_plans, "check that hot queries use indexes"),
+}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='python -m gamest.maintenance')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    for name, (command, help_text) in COMMANDS.items():
+        subparsers.add_parser(name, help=help_text).set_defaults(func=command)
+    subparsers.choices['check-query-plans'].add_argument(
+        '--verbose', action='store_true', help="print the full query plans")
+    args = parser.parse_args(argv)
+    setup_logging()
+    return args.func(args)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
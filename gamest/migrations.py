@@ -0,0 +1,163 @@
+"""Versioned schema migrations.
+
+The schema version is stored in the settings table as DB.version. migrate()
+reads it with a single query; on a current database nothing else happens.
+A new database is created from the models and stamped with the latest
+version. Otherwise every migration newer than the stored version runs, in
+order, inside one transaction, and the version is updated at the end. The
+version is read again once the transaction holds the write lock, so when
+two instances start at once only the first one migrates.
+
+Migrations are plain functions of a Connection, registered with the
+@migration decorator. They should be set-based SQL, and they must tolerate
+tables that create_all has already brought up to date.
+"""
+import logging
+
+from sqlalchemy import text
+from sqlalchemy.exc import OperationalError
+
+logger = logging.getLogger(__name__)
+
+MIGRATIONS = []
+
+
+def migration(version):
+    """Register the decorated function as the migration to version."""
+    def register(func):
+        assert not MIGRATIONS or MIGRATIONS[-1][0] < version, "Migrations must be in order."
+        MIGRATIONS.append((version, func))
+        return func
+    return register
+
+
+def latest_version():
+    return MIGRATIONS[-1][0]
+
+
+def current_version(conn):
+    """Return the stored schema version, 0 for a database that predates
+    versioning, or None for an empty database."""
+    try:
+        version = conn.execute(text(
+            "SELECT value FROM settings WHERE owner = 'DB' AND key = 'version'")).scalar()
+    except OperationalError:
+        version = None
+    if version is not None:
+        return int(version)
+    has_apps = conn.execute(text(
+        "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'app'")).scalar()
+    return 0 if has_apps else None
+
+
+def _columns(conn, table):
+    return {row[1] for row in conn.execute(text("PRAGMA table_info({})".format(table)))}
+
+
+def _stamp(conn, version):
+    updated = conn.execute(text(
+        "UPDATE settings SET value = :version WHERE owner = 'DB' AND key = 'version'"),
+        {'version': str(version)}).rowcount
+    if not updated:
+        conn.execute(text(
+            "INSERT INTO settings (owner, key, value) VALUES ('DB', 'version', :version)"),
+            {'version': str(version)})
+
+
+@migration(1)
+def identifier_plugins_and_utc(conn):
+    """Add identifier plugin columns, drop old App columns, store times in UTC."""
+    user_app_columns = _columns(conn, 'user_app')
+    for column in ('identifier_plugin', 'identifier_data'):
+        if column not in user_app_columns:
+            conn.execute(text("ALTER TABLE user_app ADD COLUMN {} VARCHAR".format(column)))
+            logger.info("Added '%s' column to table 'user_app'", column)
+    app_columns = _columns(conn, 'app')
+    for column in ('window_text', 'use_window_text', 'default_path'):
+        if column in app_columns:
+            conn.execute(text("ALTER TABLE app DROP COLUMN {}".format(column)))
+            logger.info("Removed '%s' column from table 'app'", column)
+
+    # Session start times used to be stored in local time. datetime() drops
+    # the microseconds, so they are carried over from the original value.
+    converted = conn.execute(text("""
+        UPDATE play_session
+        SET started = datetime(started, 'utc') || substr(started, 20)
+        WHERE NOT EXISTS (
+            SELECT 1 FROM user_app
+            WHERE user_app.id = play_session.user_app_id
+            AND user_app.identifier_plugin = 'gamest_web')
+        """)).rowcount
+    logger.info("Converted %s session start times to UTC", converted)
+
+
+@migration(2)
+def runtime_totals(conn):
+    """Fill in the runtime total tables."""
+    from .db import rebuild_runtime_totals
+    rebuild_runtime_totals(conn)
+    logger.info("Built runtime totals.")
+
+
+@migration(3)
+def composite_indexes(conn):
+    """Replace the single-column foreign key indexes with composite ones."""
+    conn.execute(text(
+        "CREATE INDEX IF NOT EXISTS play_session_user_app_started_duration_idx "
+        "ON play_session (user_app_id, started, duration)"))
+    conn.execute(text(
+        "CREATE INDEX IF NOT EXISTS status_update_play_session_timestamp_idx "
+        "ON status_update (play_session_id, timestamp)"))
+    # Both are prefixes of the new indexes.
+    conn.execute(text("DROP INDEX IF EXISTS ix_play_session_user_app_id"))
+    conn.execute(text("DROP INDEX IF EXISTS ix_status_update_play_session_id"))
+
+
+@migration(4)
+def daily_playtime(conn):
+    """Fill in the daily playtime table."""
+    from .db import rebuild_daily_playtime
+    rebuild_daily_playtime(conn)
+
+
+@migration(5)
+def sync_state(conn):
+    """Add the sync_state table for remote mode."""
+    from .db import SyncState
+    SyncState.__table__.create(conn, checkfirst=True)
+
+
+@migration(6)
+def app_name_index(conn):
+    """Index apps by name, the order of the report."""
+    conn.execute(text("CREATE INDEX IF NOT EXISTS ix_app_name ON app (name)"))
+
+
+def migrate(engine, metadata):
+    """Bring the database behind engine up to date with metadata."""
+    with engine.connect() as conn:
+        version = current_version(conn)
+        if version is not None and version >= latest_version():
+            if version > latest_version():
+                logger.warning(
+                    "Database schema version %s is newer than this version of gamest.", version)
+            return version
+
+        with conn.begin():
+            # pysqlite doesn't open a transaction for DDL by itself.
+            conn.exec_driver_sql('BEGIN IMMEDIATE')
+            # Another process may have migrated while we waited for the lock.
+            version = current_version(conn)
+            if version is not None and version >= latest_version():
+                return version
+            metadata.create_all(conn)
+            if version is None:
+                logger.info("Created database at schema version %s.", latest_version())
+            else:
+                for target, func in MIGRATIONS:
+                    if target > version:
+                        logger.info("Migrating database to version %s: %s",
+                                    target, func.__doc__.splitlines()[0])
+                        func(conn)
+            _stamp(conn, latest_version())
+    return latest_version()
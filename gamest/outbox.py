@@ -0,0 +1,416 @@
+"""Durable, ordered delivery of remote-mode writes.
+
+In remote mode every change is also a POST to the server. Instead of waiting
+for the server, the change is made in the local copy at once and the request
+is appended to a journal in the data directory. A background thread sends
+the journal in order, and keeps retrying while the server is unreachable, so
+an outage delays writes instead of losing them.
+
+Rows created this way get a provisional id, a negative number that the
+server never uses. When the server answers with the real id, later requests
+that refer to the row are sent with it. The local rows themselves are
+renumbered the next time the outbox is opened, before the local copy is
+synced, since live ORM objects may still refer to the provisional id.
+
+Requests queued within BATCH_WINDOW of each other, or inside a hold(), are
+sent together as one /batch request; a request that refers to a row
+created earlier in the same batch does so with a "$ref" (see
+gamest.remote.RemoteClient.batch). Servers without /batch get one request
+at a time.
+
+The journal holds one JSON object per line. A request is
+
+    {"seq": 3, "endpoint": "/start", "body": {...}, "key": "...",
+     "creates": {"play_session_id": -2}}
+
+where creates maps keys of the response to the provisional ids they resolve.
+A request the server has answered is followed, later on, by
+
+    {"ack": 3, "ids": {"-2": 815}}
+
+or, if the server rejected it, by {"ack": 3, "error": "..."}. Every request
+carries its key in an Idempotency-Key header, so a server can tell a retry
+from a new request.
+"""
+import collections
+import contextlib
+import itertools
+import json
+import logging
+import os
+import threading
+import uuid
+
+import requests
+from sqlalchemy import delete, func, select, update
+
+from . import db, remote
+
+logger = logging.getLogger(__name__)
+
+# Request fields holding ids, and the columns referring to each kind of row.
+# The primary key comes first; the runtime totals are rebuilt separately.
+ID_FIELDS = {
+    'app_id': (db.App.id, db.UserApp.app_id),
+    'user_app_id': (db.UserApp.id, db.PlaySession.user_app_id),
+    'play_session_id': (db.PlaySession.id, db.StatusUpdate.play_session_id),
+}
+
+
+def journal_path(base_url):
+    """Return the outbox journal for the remote server at base_url."""
+    return os.path.splitext(db.remote_cache_path(base_url))[0] + '-outbox.jsonl'
+
+
+def read_journal(path):
+    """Return (requests in order, {seq: ack}) from the journal at path.
+
+    A line cut short by a crash is ignored.
+    """
+    entries, acks = [], {}
+    try:
+        with open(path, encoding='utf-8') as journal:
+            for line in journal:
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    continue
+                if 'ack' in record:
+                    acks[record['ack']] = record
+                else:
+                    entries.append(record)
+    except FileNotFoundError:
+        pass
+    return entries, acks
+
+
+def _translate(body, ids):
+    """Return body with the provisional ids in ids replaced by server ids."""
+    return {key: ids.get(value, value) if key in ID_FIELDS else value
+            for key, value in body.items()}
+
+
+def reconcile(ids, session=db.Session):
+    """Renumber local rows from provisional to server ids.
+
+    ids maps each field of ID_FIELDS to {provisional id: server id}. If a row
+    with the server id is already present, e.g. from a sync, the provisional
+    row is deleted instead. Runtime totals of the affected Apps are rebuilt.
+    Returns the number of rows renumbered.
+    """
+    if not any(ids.values()):
+        return 0
+    renumbered = 0
+    stale_apps, stale_user_apps = set(), set()
+    for field in ('app_id', 'user_app_id', 'play_session_id'):
+        primary, *children = ID_FIELDS[field]
+        for old, new in ids.get(field, {}).items():
+            if old == new:
+                continue
+            for column in children:
+                session.execute(update(column.table).where(column == old).values({column.key: new}))
+            if session.execute(select(primary).where(primary == new)).first():
+                session.execute(delete(primary.table).where(primary == old))
+            else:
+                result = session.execute(update(primary.table).where(primary == old).values(id=new))
+                renumbered += result.rowcount
+            if field == 'app_id':
+                stale_apps.add(old)
+            elif field == 'user_app_id':
+                stale_user_apps.add(old)
+    session.execute(delete(db.UserAppRuntime.__table__).where(
+        db.UserAppRuntime.user_app_id.in_(stale_user_apps)))
+    session.execute(delete(db.AppRuntime.__table__).where(db.AppRuntime.app_id.in_(stale_apps)))
+    session.execute(delete(db.DailyPlaytime.__table__).where(db.DailyPlaytime.app_id.in_(stale_apps)))
+    app_ids = set(ids.get('app_id', {}).values())
+    app_ids.update(session.execute(select(db.UserApp.app_id).where(
+        db.UserApp.id.in_(list(ids.get('user_app_id', {}).values())))).scalars())
+    app_ids.update(session.execute(
+        select(db.UserApp.app_id).join(db.PlaySession, db.PlaySession.user_app_id == db.UserApp.id).
+        where(db.PlaySession.id.in_(list(ids.get('play_session_id', {}).values())))).scalars())
+    db.rebuild_runtime_totals(session, app_ids)
+    db.rebuild_daily_playtime(session, app_ids)
+    return renumbered
+
+
+class Outbox:
+    """Journal of remote writes, and the thread that sends it.
+
+    send() may be called from any thread and returns at once. The journal is
+    read, applied to the local copy and compacted by open(); start() starts
+    the sender and stop() tries to deliver what is left before exiting.
+    """
+
+    RETRY_MIN = 1.0
+    RETRY_MAX = 60.0
+    STOP_TIMEOUT = 5.0
+    BATCH_SIZE = 100
+    BATCH_WINDOW = 0.05
+
+    def __init__(self, path, client):
+        self.path = path
+        self.client = client
+        self._lock = threading.Condition()
+        self._pending = collections.deque()
+        self._ids = {}  # provisional id: server id
+        self._seq = 0
+        self._next_id = -1
+        self._journal = None
+        self._thread = None
+        self._stopping = False
+        self._holds = 0
+        self.batching = True
+
+    def __len__(self):
+        with self._lock:
+            return len(self._pending)
+
+    def open(self, session=db.Session):
+        """Load the journal, apply answered requests locally and compact it.
+
+        Requests still unanswered keep their place in the queue.
+        """
+        entries, acks = read_journal(self.path)
+        ids = collections.defaultdict(dict)
+        resolved = {}
+        for entry in entries:
+            ack = acks.get(entry['seq'])
+            if ack is None:
+                continue
+            for key, old in entry.get('creates', {}).items():
+                new = ack.get('ids', {}).get(str(old))
+                if new is None:
+                    logger.warning("No server id for %s %d; keeping the provisional id.", key, old)
+                else:
+                    ids[key][old] = new
+                    resolved[old] = new
+        reconcile(ids, session)
+
+        pending = [entry for entry in entries if entry['seq'] not in acks]
+        for entry in pending:
+            entry['body'] = _translate(entry['body'], resolved)
+        lowest = [old for entry in pending for old in entry.get('creates', {}).values()]
+        for primary, *_ in ID_FIELDS.values():
+            lowest.append(session.execute(select(func.min(primary))).scalar() or 0)
+        session.commit()
+
+        temp = self.path + '.tmp'
+        with open(temp, 'w', encoding='utf-8') as journal:
+            for entry in pending:
+                journal.write(json.dumps(entry) + '\n')
+            journal.flush()
+            os.fsync(journal.fileno())
+        os.replace(temp, self.path)
+
+        with self._lock:
+            self._pending.extend(pending)
+            self._seq = max((entry['seq'] for entry in pending), default=0)
+            self._next_id = min(min(lowest, default=0), 0) - 1
+            self._journal = open(self.path, 'a', encoding='utf-8')
+        if pending:
+            logger.info("%d remote writes from the last run are waiting to be sent.", len(pending))
+        return self
+
+    def provisional_id(self):
+        """Return a new id for a row the server hasn't numbered yet."""
+        with self._lock:
+            provisional = self._next_id
+            self._next_id -= 1
+            return provisional
+
+    def _write(self, record):
+        self._journal.write(json.dumps(record) + '\n')
+        self._journal.flush()
+        os.fsync(self._journal.fileno())
+
+    def send(self, endpoint, body, creates=None):
+        """Queue a POST of body to endpoint.
+
+        creates maps keys of the expected response to the provisional ids of
+        the rows the request creates, e.g. {'app_id': -1}.
+        """
+        with self._lock:
+            self._seq += 1
+            entry = {'seq': self._seq, 'endpoint': endpoint, 'body': body, 'key': uuid.uuid4().hex}
+            if creates:
+                entry['creates'] = creates
+            self._write(entry)
+            self._pending.append(entry)
+            self._lock.notify()
+
+    def server_id(self, provisional):
+        """Return the server's id for a provisional id, or None if not known yet."""
+        with self._lock:
+            return self._ids.get(provisional)
+
+    @contextlib.contextmanager
+    def hold(self):
+        """Send nothing until the block ends, then send what it queued together."""
+        with self._lock:
+            self._holds += 1
+        try:
+            yield self
+        finally:
+            with self._lock:
+                self._holds -= 1
+                self._lock.notify()
+
+    def _deliver(self, entries):
+        """Send entries, in order. Returns how many were answered."""
+        if len(entries) == 1 or not self.batching:
+            return self._deliver_one(entries[0])
+        try:
+            results = self.client.batch(self._operations(entries))
+        except requests.HTTPError as e:
+            status = e.response.status_code if e.response is not None else None
+            if status in (404, 405):
+                logger.info("Remote has no /batch; sending writes one at a time.")
+                self.batching = False
+            elif status is None or status >= 500:
+                logger.warning("Error sending %d writes, will retry: %s", len(entries), e)
+                return 0
+            # Otherwise the batch as a whole was refused; sending the first
+            # write alone keeps a bad one from blocking the rest.
+            return self._deliver_one(entries[0])
+        except requests.RequestException as e:
+            logger.warning("Error sending %d writes, will retry: %s", len(entries), e)
+            return 0
+        answered = 0
+        for entry, result in zip(entries, results):
+            status = result.get('status')
+            if status == 200:
+                self._acknowledge(entry, self._answered(entry, result.get('body')))
+            elif isinstance(status, int) and status < 500:
+                logger.error("Server rejected %s %r: %s %s",
+                             entry['endpoint'], entry['body'], status, result.get('body'))
+                self._acknowledge(entry, {'ack': entry['seq'], 'error': str(result.get('body'))})
+            else:
+                # Retry this and the rest; their keys stop the server from
+                # applying any of them twice.
+                logger.warning("Error sending %s, will retry: %s %s",
+                               entry['endpoint'], status, result.get('body'))
+                break
+            answered += 1
+        return answered
+
+    def _deliver_one(self, entry):
+        """Send entry. Returns 0 if it should be retried later, else 1."""
+        try:
+            response = self.client.post(
+                entry['endpoint'], json=_translate(entry['body'], self._ids),
+                headers={'Idempotency-Key': entry['key']})
+        except requests.HTTPError as e:
+            if e.response is not None and e.response.status_code < 500:
+                logger.error("Server rejected %s %r: %s", entry['endpoint'], entry['body'], e)
+                self._acknowledge(entry, {'ack': entry['seq'], 'error': str(e)})
+                return 1
+            logger.warning("Error sending %s, will retry: %s", entry['endpoint'], e)
+            return 0
+        except requests.RequestException as e:
+            logger.warning("Error sending %s, will retry: %s", entry['endpoint'], e)
+            return 0
+        d = {}
+        if entry.get('creates'):
+            try:
+                d = response.json()
+            except ValueError:
+                logger.error("Invalid response to %s: %r", entry['endpoint'], response.text[:200])
+        self._acknowledge(entry, self._answered(entry, d))
+        return 1
+
+    def _operations(self, entries):
+        """Return the /batch operations for entries.
+
+        Ids of rows created earlier in the batch become references.
+        """
+        refs = {}  # provisional id: [index, response key]
+        operations = []
+        for index, entry in enumerate(entries):
+            body = _translate(entry['body'], self._ids)
+            for name, value in body.items():
+                if name in ID_FIELDS and value in refs:
+                    body[name] = {'$ref': refs[value]}
+            operations.append({'endpoint': entry['endpoint'], 'body': body, 'key': entry['key']})
+            for key, old in entry.get('creates', {}).items():
+                refs[old] = [index, key]
+        return operations
+
+    @staticmethod
+    def _answered(entry, response):
+        """Return the ack of entry given the server's response."""
+        response = response if isinstance(response, dict) else {}
+        ids = {str(old): response[key] for key, old in entry.get('creates', {}).items()
+               if key in response}
+        return {'ack': entry['seq'], 'ids': ids}
+
+    def _acknowledge(self, entry, ack):
+        with self._lock:
+            self._write(ack)
+            self._ids.update((int(old), new) for old, new in ack.get('ids', {}).items())
+            if self._pending and self._pending[0] is entry:
+                self._pending.popleft()
+
+    def run(self):
+        delay = self.RETRY_MIN
+        while True:
+            with self._lock:
+                while (not self._pending or self._holds) and not self._stopping:
+                    self._lock.wait()
+                if not self._pending:
+                    return
+                if self.batching and not self._stopping:
+                    # Let writes made together arrive before sending.
+                    self._lock.wait_for(
+                        lambda: len(self._pending) >= self.BATCH_SIZE or self._holds or self._stopping,
+                        self.BATCH_WINDOW)
+                    if self._holds and not self._stopping:
+                        continue
+                entries = list(itertools.islice(self._pending, self.BATCH_SIZE))
+            if self._deliver(entries):
+                delay = self.RETRY_MIN
+                continue
+            with self._lock:
+                if self._stopping:
+                    return
+                self._lock.wait(delay)
+            delay = min(delay * 2, self.RETRY_MAX)
+
+    def start(self):
+        self._thread = threading.Thread(target=self.run, name='outbox', daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self, timeout=STOP_TIMEOUT):
+        """Stop the sender once the queue is empty, waiting at most timeout seconds.
+
+        Whatever is left stays in the journal for the next run.
+        """
+        with self._lock:
+            self._stopping = True
+            self._lock.notify()
+        if self._thread is not None:
+            self._thread.join(timeout)
+        with self._lock:
+            if self._pending:
+                logger.warning("%d remote writes not sent; they will be sent next time.",
+                               len(self._pending))
+            if self._thread is None or not self._thread.is_alive():
+                self._journal.close()
+
+
+_outbox = None
+_outbox_lock = threading.Lock()
+
+
+def get_outbox(base_url=None):
+    """Return the opened Outbox for base_url, by default the configured server.
+
+    The first call opens it, which updates the local copy, so it should be
+    made at startup before the copy is synced.
+    """
+    global _outbox
+    base_url = base_url or db.REMOTE_BASE_URL
+    with _outbox_lock:
+        if _outbox is None:
+            _outbox = Outbox(journal_path(base_url), remote.get_client(base_url)).open()
+        return _outbox
@@ -163,6 +163,10 @@ class GameReporterPlugin(GamestSessionPlugin):
             self.application.after_cancel(self.job)
 
 class IdentifierPlugin(GamestPersistentPlugin):
+    # When several identifiers find a game in the same poll, the one with the
+    # lowest PRIORITY wins. Ties are broken by class name.
+    PRIORITY = 100
+
     def candidates(self):
         return []
 
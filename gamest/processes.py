@@ -0,0 +1,136 @@
+"""Shared, incrementally maintained snapshot of running processes."""
+import logging
+import threading
+import time
+
+import psutil
+
+logger = logging.getLogger(__name__)
+
+
+class ProcessRecord:
+    """The attributes of a process as they were when it was first seen."""
+
+    __slots__ = ('pid', 'name', 'username', 'exe', 'cmdline', 'create_time')
+
+    ATTRS = ['name', 'username', 'exe', 'cmdline', 'create_time']
+
+    def __init__(self, pid, name, username, exe, cmdline, create_time):
+        self.pid = pid
+        self.name = name
+        self.username = username
+        self.exe = exe
+        self.cmdline = cmdline
+        self.create_time = create_time
+
+    def __repr__(self):
+        return "ProcessRecord(pid={}, name={!r}, create_time={})".format(
+            self.pid, self.name, self.create_time)
+
+    @classmethod
+    def from_pid(cls, pid):
+        """Read a process's attributes, or return None if it can't be read."""
+        try:
+            proc = psutil.Process(pid)
+            with proc.oneshot():
+                if proc.status() == psutil.STATUS_ZOMBIE:
+                    return None
+                info = proc.as_dict(cls.ATTRS)
+        except (psutil.NoSuchProcess, psutil.ZombieProcess):
+            return None
+        except psutil.AccessDenied:
+            logger.debug("Access denied reading process %d", pid)
+            return None
+        return cls(pid, **info)
+
+    def describes(self, proc):
+        """Return whether proc is still the process this record was read from.
+
+        A process that exec()s keeps its pid and create_time but changes its
+        name, which comes from the same read as create_time on Linux. A
+        zombie has exited, even though its pid is still listed.
+        """
+        with proc.oneshot():
+            if proc.create_time() != self.create_time:
+                return False
+            try:
+                return proc.name() == self.name and proc.status() != psutil.STATUS_ZOMBIE
+            except psutil.AccessDenied:
+                return True
+
+
+class ProcessSnapshot:
+    """Snapshot of running processes shared by all IdentifierPlugins.
+
+    Records are keyed by (pid, create_time) and attributes are read only the
+    first time a process is seen, so a refresh costs about as much as listing
+    the pids with their start times and names. A snapshot younger than ttl seconds is reused as is.
+    """
+
+    def __init__(self, ttl=2.0):
+        self.ttl = ttl
+        self._records = {}
+        self._keys = {}
+        self._snapshot = ()
+        self._taken = None
+        self._lock = threading.Lock()
+
+    def get(self):
+        """Return a tuple of ProcessRecords, refreshing it if it is stale."""
+        with self._lock:
+            if self._taken is None or time.monotonic() - self._taken >= self.ttl:
+                self._refresh()
+            return self._snapshot
+
+    def invalidate(self):
+        with self._lock:
+            self._taken = None
+
+    def resolve(self, record):
+        """Return a psutil.Process for record, or None if it has exited.
+
+        If the pid now belongs to a different process, the stale record is
+        dropped so that the next refresh reads the new one.
+        """
+        try:
+            proc = psutil.Process(record.pid)
+            if record.describes(proc):
+                return proc
+        except psutil.Error:
+            pass
+        with self._lock:
+            key = (record.pid, record.create_time)
+            if self._records.get(key) is record:
+                del self._records[key]
+                del self._keys[record.pid]
+                self._taken = None
+        return None
+
+    def _refresh(self):
+        pids = set(psutil.pids())
+
+        for pid in self._keys.keys() - pids:
+            del self._records[self._keys.pop(pid)]
+
+        # A pid that is still listed may have been reused by a new process, or
+        # its process may have exec()ed another program.
+        for pid in pids & self._keys.keys():
+            try:
+                current = self._records[self._keys[pid]].describes(psutil.Process(pid))
+            except psutil.Error:
+                current = False
+            if not current:
+                del self._records[self._keys.pop(pid)]
+
+        for pid in pids - self._keys.keys():
+            record = ProcessRecord.from_pid(pid)
+            if record is not None:
+                key = (pid, record.create_time)
+                self._keys[pid] = key
+                self._records[key] = record
+
+        self._snapshot = tuple(self._records.values())
+        self._taken = time.monotonic()
+
+
+snapshot = ProcessSnapshot()
@@ -0,0 +1,515 @@
+"""Talk to a remote gamest server."""
+import codecs
+import collections
+import contextlib
+import datetime
+import json
+import logging
+import os
+import threading
+import time
+
+import requests
+from requests.adapters import HTTPAdapter
+from sqlalchemy import insert, select
+from urllib3.util.retry import Retry
+
+from . import db
+
+logger = logging.getLogger(__name__)
+
+CHUNK_SIZE = 64 * 1024
+BATCH_SIZE = 5000
+
+_WHITESPACE = ' \t\n\r'
+# Characters that can follow a prefix of a JSON number in the rest of it.
+_NUMBER_CONTINUES = frozenset('.eE0123456789')
+
+
+class LatencyMetrics:
+    """Request latency per endpoint.
+
+    Keeps a count, error count and the most recent samples of each endpoint,
+    from which summary() computes percentiles.
+    """
+
+    def __init__(self, samples=1000):
+        self._lock = threading.Lock()
+        self._samples = samples
+        self._endpoints = {}
+
+    def record(self, endpoint, seconds, error=False):
+        with self._lock:
+            stats = self._endpoints.get(endpoint)
+            if stats is None:
+                stats = self._endpoints[endpoint] = {
+                    'count': 0, 'errors': 0, 'max': 0.0,
+                    'recent': collections.deque(maxlen=self._samples)}
+            stats['count'] += 1
+            stats['errors'] += bool(error)
+            stats['max'] = max(stats['max'], seconds)
+            stats['recent'].append(seconds)
+
+    def summary(self):
+        """Return {endpoint: {count, errors, p50_ms, p95_ms, max_ms}}."""
+        with self._lock:
+            summary = {}
+            for endpoint, stats in self._endpoints.items():
+                recent = sorted(stats['recent'])
+                summary[endpoint] = {
+                    'count': stats['count'],
+                    'errors': stats['errors'],
+                    'p50_ms': recent[len(recent) // 2] * 1000,
+                    'p95_ms': recent[min(int(len(recent) * 0.95), len(recent) - 1)] * 1000,
+                    'max_ms': stats['max'] * 1000,
+                }
+            return summary
+
+    def log(self, level=logging.INFO):
+        for endpoint, stats in sorted(self.summary().items()):
+            logger.log(level, "%s: %d requests, %d errors, p50 %.0f ms, p95 %.0f ms, max %.0f ms",
+                       endpoint, stats['count'], stats['errors'],
+                       stats['p50_ms'], stats['p95_ms'], stats['max_ms'])
+
+
+class RemoteClient:
+    """HTTP client for a remote gamest server.
+
+    Requests share a keep-alive connection pool, so only the first one pays
+    for the TCP and TLS handshakes. Every request has a timeout. Failed
+    connections are retried with exponential backoff; GET requests are also
+    retried after read errors and 502, 503 and 504 responses, but POSTs are
+    not, since the server may already have acted on them.
+
+    The defaults can be changed with the GAMEST_REMOTE_CONNECT_TIMEOUT,
+    GAMEST_REMOTE_READ_TIMEOUT and GAMEST_REMOTE_RETRIES environment variables.
+    """
+
+    CONNECT_TIMEOUT = 3.05
+    READ_TIMEOUT = 10.0
+    RETRIES = 3
+    BACKOFF = 0.5
+    POOL_SIZE = 4
+
+    def __init__(self, base_url, connect_timeout=None, read_timeout=None, retries=None,
+                 backoff=BACKOFF, pool_size=POOL_SIZE):
+        env = os.environ.get
+        self.base_url = base_url.rstrip('/')
+        self.timeout = (
+            connect_timeout or float(env('GAMEST_REMOTE_CONNECT_TIMEOUT', self.CONNECT_TIMEOUT)),
+            read_timeout or float(env('GAMEST_REMOTE_READ_TIMEOUT', self.READ_TIMEOUT)))
+        retries = retries if retries is not None else int(env('GAMEST_REMOTE_RETRIES', self.RETRIES))
+        retry = Retry(
+            total=retries,
+            backoff_factor=backoff,
+            status_forcelist=(502, 503, 504),
+            allowed_methods=frozenset(['GET', 'HEAD']),
+            raise_on_status=False)
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size, max_retries=retry)
+        self.session = requests.Session()
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+        self.metrics = LatencyMetrics()
+
+    def request(self, method, endpoint, **kwargs):
+        """Send a request to endpoint (e.g. '/start') and return the response.
+
+        Raises requests.HTTPError for error responses.
+        """
+        kwargs.setdefault('timeout', self.timeout)
+        start = time.perf_counter()
+        try:
+            response = self.session.request(method, self.base_url + endpoint, **kwargs)
+        except requests.RequestException:
+            self.metrics.record(endpoint, time.perf_counter() - start, error=True)
+            raise
+        self.metrics.record(endpoint, time.perf_counter() - start, error=not response.ok)
+        if not response.ok:
+            response.close()
+        response.raise_for_status()
+        return response
+
+    def get(self, endpoint, **kwargs):
+        return self.request('GET', endpoint, **kwargs)
+
+    def post(self, endpoint, json=None, **kwargs):  # pylint: disable=redefined-outer-name
+        return self.request('POST', endpoint, json=json, **kwargs)
+
+    def batch(self, operations, **kwargs):
+        """Send several POSTs as one /batch request and return their results.
+
+        operations is a list of {"endpoint": ..., "body": ..., "key": ...},
+        where key is optional and serves as that operation's
+        Idempotency-Key. A field of a body may be {"$ref": [index, field]}
+        to use that field of the response to an earlier operation, e.g.
+        {"app_id": {"$ref": [0, "app_id"]}} after a /create-app. The server
+        runs the operations in order and returns one {"status": ...,
+        "body": ...} per operation; an operation whose reference failed gets
+        status 424. Servers without /batch answer 404.
+        """
+        return self.post('/batch', json={'operations': operations}, **kwargs).json()['results']
+
+    def close(self):
+        self.session.close()
+
+
+_clients = {}
+_clients_lock = threading.Lock()
+
+
+def get_client(base_url=None):
+    """Return the shared RemoteClient for base_url, by default the configured server."""
+    base_url = base_url or db.REMOTE_BASE_URL
+    with _clients_lock:
+        if base_url not in _clients:
+            _clients[base_url] = RemoteClient(base_url)
+        return _clients[base_url]
+
+
+@contextlib.contextmanager
+def batch():
+    """Send the remote writes made in the block together.
+
+    Remote writes go through gamest.outbox, which already combines writes
+    made within a short time of each other into /batch requests. Inside this
+    block they are held back until it ends, so that e.g. a bulk import needs
+    a single round trip per hundred writes. Outside remote mode this does
+    nothing.
+    """
+    if not db.IS_REMOTE:
+        yield
+        return
+    from .outbox import get_outbox  # pylint: disable=import-outside-toplevel,cyclic-import
+    with get_outbox().hold():
+        yield
+
+
+class _Buffer:
+    """Text read incrementally from an iterable of byte chunks."""
+
+    def __init__(self, chunks):
+        self.chunks = iter(chunks)
+        self.decoder = codecs.getincrementaldecoder('utf-8')()
+        self.text = ''
+        self.pos = 0
+        self.eof = False
+
+    def fill(self):
+        """Read another chunk. Returns False at the end of the input."""
+        if self.eof:
+            return False
+        try:
+            chunk = next(self.chunks)
+        except StopIteration:
+            self.eof = True
+            chunk = b''
+        self.text = self.text[self.pos:] + self.decoder.decode(chunk, final=self.eof)
+        self.pos = 0
+        return True
+
+    def peek(self):
+        """Return the next non-whitespace character, or '' at the end."""
+        while True:
+            while self.pos < len(self.text) and self.text[self.pos] in _WHITESPACE:
+                self.pos += 1
+            if self.pos < len(self.text):
+                return self.text[self.pos]
+            if not self.fill():
+                return ''
+
+    def expect(self, chars):
+        char = self.peek()
+        if char not in chars:
+            raise ValueError("Expected one of {!r}, got {!r}".format(chars, char or 'end of input'))
+        self.pos += 1
+        return char
+
+    def value(self, decoder=json.JSONDecoder()):
+        """Decode one JSON value."""
+        self.peek()
+        while True:
+            try:
+                value, end = decoder.raw_decode(self.text, self.pos)
+            except json.JSONDecodeError:
+                if not self.fill():
+                    raise
+                continue
+            if (isinstance(value, (int, float)) and not isinstance(value, bool)
+                    and (end == len(self.text) or self.text[end] in _NUMBER_CONTINUES)
+                    and self.fill()):
+                # The number might continue in the next chunk.
+                continue
+            self.pos = end
+            return value
+
+
+def iter_json_members(chunks):
+    """Parse a JSON object incrementally from byte chunks.
+
+    Yields (key, item) for each item of members whose value is an array, and
+    (key, value) for other members, so arbitrarily long arrays are never held
+    in memory at once.
+    """
+    buf = _Buffer(chunks)
+    buf.expect('{')
+    if buf.peek() == '}':
+        return
+    while True:
+        key = buf.value()
+        buf.expect(':')
+        if buf.peek() == '[':
+            buf.expect('[')
+            if buf.peek() != ']':
+                while True:
+                    yield key, buf.value()
+                    if buf.expect(',]') == ']':
+                        break
+            else:
+                buf.expect(']')
+        else:
+            yield key, buf.value()
+        if buf.expect(',}') == '}':
+            return
+
+
+def _app(a):
+    return {'id': a['id'], 'name': a['name'], 'disambiguation': a['disambiguation']}
+
+
+def _user_app(ua):
+    return {key: ua[key] for key in (
+        'id', 'app_id', 'note', 'path', 'identifier_plugin', 'identifier_data',
+        'initial_runtime', 'window_text')}
+
+
+def _play_session(s):
+    return {
+        'id': s['id'],
+        'user_app_id': s['user_app_id'],
+        'started': datetime.datetime.fromtimestamp(
+            s['started'], tz=datetime.timezone.utc).replace(tzinfo=None),
+        'duration': s['duration'],
+        'note': s['note'],
+    }
+
+
+def _settings(s):
+    # Settings get new local ids; the ids of the DB owner's rows must not clash.
+    return {'owner': s['owner'], 'key': s['key'], 'value': s['value']}
+
+
+# Payload key: (table, function converting a record to a row).
+TABLES = {
+    'apps': (db.App.__table__, _app),
+    'user_apps': (db.UserApp.__table__, _user_app),
+    'play_sessions': (db.PlaySession.__table__, _play_session),
+}
+
+
+def log_progress(counts, bytes_read):
+    logger.info("Loaded %s KiB: %s", bytes_read // 1024,
+                ", ".join("{} {}".format(n, key) for key, n in counts.items()))
+
+
+def load_records(members, session, batch_size=BATCH_SIZE, progress=None, bytes_read=lambda: 0,
+                 replace=False, before_batch=None):
+    """Insert (key, record) pairs from iter_json_members into session.
+
+    Rows of TABLES are inserted with executemany in batches of batch_size;
+    with replace, rows with an existing id are replaced. before_batch, if
+    given, is called with the key and rows of each batch before it is
+    inserted. After each batch, progress is called with a dict of rows loaded
+    per key and the number of bytes read so far.
+
+    Settings records are returned rather than inserted, since they are
+    replaced as a whole. Returns (counts, settings, other members).
+    """
+    counts = {key: 0 for key in TABLES}
+    pending = {key: [] for key in TABLES}
+    settings = []
+    other = {}
+
+    def flush(key):
+        stmt = insert(TABLES[key][0])
+        if replace:
+            stmt = stmt.prefix_with('OR REPLACE')
+        if before_batch is not None:
+            before_batch(key, pending[key])
+        session.execute(stmt, pending[key])
+        counts[key] += len(pending[key])
+        pending[key] = []
+        if progress is not None:
+            progress(counts, bytes_read())
+
+    for key, record in members:
+        if key == 'settings':
+            settings.append(_settings(record))
+        elif key in TABLES:
+            pending[key].append(TABLES[key][1](record))
+            if len(pending[key]) >= batch_size:
+                flush(key)
+        else:
+            other[key] = record
+    for key, rows in pending.items():
+        if rows:
+            flush(key)
+    return counts, settings, other
+
+
+def replace_settings(session, settings):
+    """Replace all settings except the local schema version with settings."""
+    table = db.Settings.__table__
+    session.execute(table.delete().where(table.c.owner != 'DB'))
+    settings = [s for s in settings if s['owner'] != 'DB']
+    if settings:
+        session.execute(insert(table), settings)
+    db.DBConfig.invalidate_cache()
+
+
+def _stream(response):
+    """Return (byte chunk iterator, function returning bytes read so far)."""
+    bytes_read = [0]
+
+    def counted(chunks=response.iter_content(chunk_size=CHUNK_SIZE)):
+        for chunk in chunks:
+            bytes_read[0] += len(chunk)
+            yield chunk
+
+    return counted(), lambda: bytes_read[0]
+
+
+def load_remote_db(base_url, session=None, batch_size=BATCH_SIZE, progress=log_progress):
+    """Copy the remote database at base_url into the empty local database."""
+    session = session or db.Session()
+    if session.query(db.App).count():
+        logger.error("Data exists in DB! No!")
+        raise ValueError("Tried to load data to non-empty DB.")
+    logger.info("Loading remote DB: %r.", base_url)
+    with get_client(base_url).get('/fetch-remote-db', stream=True) as r:
+        chunks, bytes_read = _stream(r)
+        counts, settings, _ = load_records(
+            iter_json_members(chunks), session, batch_size, progress, bytes_read)
+    replace_settings(session, settings)
+    db.rebuild_runtime_totals(session)
+    db.rebuild_daily_playtime(session)
+    session.commit()
+    logger.info("Done. DB now contains %r Apps, %r UserApps, and %r PlaySessions.",
+                counts['apps'], counts['user_apps'], counts['play_sessions'])
+    return counts
+
+
+# Tables holding copies of remote data, children first.
+CACHE_TABLES = (
+    db.DailyPlaytime, db.AppRuntime, db.UserAppRuntime,
+    db.StatusUpdate, db.PlaySession, db.UserApp, db.App, db.SyncState)
+
+
+def clear_cache(session):
+    """Delete the local copy of the remote database."""
+    for model in CACHE_TABLES:
+        session.execute(model.__table__.delete())
+    replace_settings(session, [])
+
+
+class _Affected:
+    """Collects the Apps whose totals a sync changes."""
+
+    def __init__(self, session):
+        self.session = session
+        self.app_ids = set()
+        self.user_app_ids = set()
+
+    def _existing(self, column, key, ids):
+        table = column.table
+        for start in range(0, len(ids), 500):
+            yield from self.session.execute(
+                select(column).where(table.c[key].in_(ids[start:start + 500]))).scalars()
+
+    def before_batch(self, key, rows):
+        ids = [row['id'] for row in rows]
+        if key == 'play_sessions':
+            self.user_app_ids.update(row['user_app_id'] for row in rows)
+            self.user_app_ids.update(self._existing(db.PlaySession.__table__.c.user_app_id, 'id', ids))
+        elif key == 'user_apps':
+            self.user_app_ids.update(ids)
+            self.app_ids.update(row['app_id'] for row in rows)
+            self.app_ids.update(self._existing(db.UserApp.__table__.c.app_id, 'id', ids))
+        elif key == 'apps':
+            self.app_ids.update(ids)
+
+    def resolve(self):
+        """Return the ids of all affected Apps."""
+        user_app_ids = list(self.user_app_ids)
+        return self.app_ids.union(self._existing(db.UserApp.__table__.c.app_id, 'id', user_app_ids))
+
+
+def _delete(session, deleted, affected):
+    """Delete rows the server reports as deleted: {payload key: [ids]}."""
+    for key in ('play_sessions', 'user_apps', 'apps'):
+        ids = deleted.get(key) or []
+        if not ids:
+            continue
+        affected.before_batch(key, [{'id': i, 'user_app_id': None, 'app_id': None} for i in ids])
+        table = TABLES[key][0]
+        for start in range(0, len(ids), 500):
+            batch = ids[start:start + 500]
+            session.execute(table.delete().where(table.c.id.in_(batch)))
+            if key == 'user_apps':
+                session.execute(db.UserAppRuntime.__table__.delete().where(
+                    db.UserAppRuntime.user_app_id.in_(batch)))
+    affected.app_ids.discard(None)
+    affected.user_app_ids.discard(None)
+
+
+def sync_remote_db(base_url, session=None, batch_size=BATCH_SIZE, progress=log_progress):
+    """Bring the local copy of the remote database at base_url up to date.
+
+    The server's /sync endpoint is asked for everything changed since the
+    token saved by the previous sync; with no token it sends everything. The
+    response is a JSON object with:
+
+    * apps, user_apps, play_sessions: rows created or changed, replacing any
+      local row with the same id
+    * settings: when settings_changed is true, the complete list of settings
+    * deleted: optionally, {'apps' | 'user_apps' | 'play_sessions': [ids]}
+    * token: the value to send as since next time
+
+    Servers without /sync are loaded in full with load_remote_db. Returns
+    the number of rows received per table.
+    """
+    session = session or db.Session()
+    state = session.get(db.SyncState, 'token')
+    params = {} if state is None else {'since': state.value}
+    logger.info("Syncing remote DB %r since %r.", base_url, params.get('since'))
+    try:
+        response = get_client(base_url).get('/sync', params=params, stream=True)
+    except requests.HTTPError as exc:
+        if exc.response is None or exc.response.status_code != 404:
+            raise
+        logger.warning("Remote has no /sync; loading the whole database.")
+        clear_cache(session)
+        return load_remote_db(base_url, session, batch_size, progress)
+    with response as r:
+        chunks, bytes_read = _stream(r)
+        affected = _Affected(session)
+        counts, settings, other = load_records(
+            iter_json_members(chunks), session, batch_size, progress, bytes_read,
+            replace=True, before_batch=None if state is None else affected.before_batch)
+
+    if 'token' not in other:
+        raise ValueError("Remote sync response has no token.")
+    _delete(session, other.get('deleted') or {}, affected)
+    if other.get('settings_changed') or settings:
+        replace_settings(session, settings)
+    if state is None:
+        db.rebuild_runtime_totals(session)
+        db.rebuild_daily_playtime(session)
+    else:
+        app_ids = affected.resolve()
+        if app_ids:
+            db.rebuild_runtime_totals(session, app_ids)
+            db.rebuild_daily_playtime(session, app_ids)
+    session.merge(db.SyncState(key='token', value=str(other['token'])))
+    session.commit()
+    logger.info("Synced: %s.", ", ".join("{} {}".format(n, key) for key, n in counts.items()))
+    return counts
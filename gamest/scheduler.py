@@ -0,0 +1,55 @@
+"""Adaptive polling intervals for the tracker."""
+import collections
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+class PollScheduler:
+    """Decide how long the tracker waits between polls.
+
+    While no game is running, polling starts at min_interval and the interval
+    doubles after every poll that finds nothing, up to max_interval. The
+    tracker calls reset() when a session ends, since another game is likely to
+    be started soon after. While a game is running, polls happen every
+    running_interval seconds.
+    """
+
+    BACKOFF = 2
+    MIN_INTERVAL = 1.0
+    MAX_INTERVAL = 30.0
+    RUNNING_INTERVAL = 5.0
+
+    def __init__(self, min_interval=MIN_INTERVAL, max_interval=MAX_INTERVAL,
+                 running_interval=RUNNING_INTERVAL, history=100):
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.running_interval = running_interval
+        self.current = min_interval
+        self._idle = min_interval
+        self._history = collections.deque(maxlen=history)
+
+    def configure(self, min_interval, max_interval, running_interval):
+        self.min_interval = min_interval
+        self.max_interval = max(max_interval, min_interval)
+        self.running_interval = running_interval
+        self._idle = min(max(self._idle, self.min_interval), self.max_interval)
+
+    def reset(self):
+        self._idle = self.min_interval
+
+    def next_interval(self, running):
+        """Return the number of seconds to wait before the next poll."""
+        if running:
+            self.current = self.running_interval
+        else:
+            self.current = self._idle
+            self._idle = min(self._idle * self.BACKOFF, self.max_interval)
+        self._history.append(self.current)
+        return self.current
+
+    @property
+    def average(self):
+        if not self._history:
+            return self.current
+        return sum(self._history) / len(self._history)
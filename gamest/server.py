@@ -0,0 +1,670 @@
+"""Reference server for gamest's remote mode.
+
+Usage:
+
+    python -m gamest.server [--host HOST] [--port PORT] [--db PATH]
+
+Then run gamest with GAMEST_REMOTE=true and
+GAMEST_REMOTE_BASE_URL=http://HOST:PORT.
+
+The server keeps its data in a SQLite database with the same schema as a
+local gamest database. It implements the endpoints gamest.remote and
+gamest.outbox use:
+
+* POST /create-app, /create-user-app, /start, /stop, /update-session-note
+* POST /batch, running several of the above in one request
+* GET /fetch-remote-db and /sync
+
+Requests are served by a single asyncio event loop. All writes go through
+one writer thread holding the only writing connection, which applies
+whatever requests are waiting in one transaction, so a burst of clients
+costs one commit rather than one each. Reads run on a small pool of threads
+that, thanks to WAL, never wait for the writer.
+
+There is no authentication: only serve trusted networks.
+"""
+import argparse
+import asyncio
+import concurrent.futures
+import datetime
+import http
+import json
+import logging
+import os
+import queue
+import signal
+import threading
+import time
+import urllib.parse
+
+from sqlalchemy import Column, Float, Index, Integer, Text, bindparam, func, insert, select, text, update
+from sqlalchemy.exc import OperationalError
+from sqlalchemy.orm import declarative_base
+
+from . import DATA_DIR, db, setup_logging
+from .engine import create_sqlite_engine
+from .migrations import migrate
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_HOST = '127.0.0.1'
+DEFAULT_PORT = 8765
+SERVER_DB = os.path.join(DATA_DIR, 'server.db')
+
+ServerBase = declarative_base()
+
+
+class Change(ServerBase):
+    """The sequence number of the last change to each row, for /sync."""
+    __tablename__ = 'sync_change'
+    __table_args__ = (
+        Index('sync_change_seq_idx', 'seq'),
+    )
+    kind = Column(Text, primary_key=True)
+    row_id = Column(Integer, primary_key=True)
+    seq = Column(Integer, nullable=False)
+
+    def __repr__(self):
+        return "Change(kind={!r}, row_id={}, seq={})".format(self.kind, self.row_id, self.seq)
+
+
+class RequestKey(ServerBase):
+    """The response to a request with an Idempotency-Key, sent again on a retry."""
+    __tablename__ = 'request_key'
+    key = Column(Text, primary_key=True)
+    response = Column(Text, nullable=False)
+    created = Column(Float, nullable=False)
+
+    def __repr__(self):
+        return "RequestKey(key={!r}, created={})".format(self.key, self.created)
+
+
+class RequestError(Exception):
+    """A request that can't be carried out, and the HTTP status to answer it with."""
+
+    def __init__(self, message, status=http.HTTPStatus.BAD_REQUEST):
+        super().__init__(message)
+        self.status = status
+
+
+def _field(body, name, types, required=True):
+    value = body.get(name)
+    if value is None:
+        if required:
+            raise RequestError("Missing {}.".format(name))
+        return None
+    if not isinstance(value, types) or isinstance(value, bool):
+        raise RequestError("Invalid {}: {!r}.".format(name, value))
+    return value
+
+
+def _resolve(body, results):
+    """Replace {"$ref": [index, field]} values in body with earlier results."""
+    resolved = {}
+    for name, value in body.items():
+        if isinstance(value, dict) and '$ref' in value:
+            try:
+                index, field = value['$ref']
+                result = results[index] if 0 <= index < len(results) else None
+            except (TypeError, ValueError):
+                raise RequestError("Invalid reference for {}.".format(name)) from None
+            if result is None:
+                raise RequestError("Invalid reference for {}.".format(name))
+            if result['status'] != http.HTTPStatus.OK or field not in result['body']:
+                raise RequestError("Operation {} failed.".format(index), http.HTTPStatus.FAILED_DEPENDENCY)
+            value = result['body'][field]
+        resolved[name] = value
+    return resolved
+
+
+def _timestamp(value):
+    if value is None:
+        return datetime.datetime.now(tz=datetime.timezone.utc)
+    try:
+        return datetime.datetime.fromtimestamp(value, tz=datetime.timezone.utc)
+    except (OverflowError, OSError, ValueError):
+        raise RequestError("Invalid timestamp: {!r}.".format(value)) from None
+
+
+# The table and the (field, SQL expression) pairs sent for each kind of row.
+ROWS = {
+    'apps': ('app', (
+        ('id', 'app.id'), ('name', 'name'), ('disambiguation', 'disambiguation'))),
+    'user_apps': ('user_app', (
+        ('id', 'user_app.id'), ('app_id', 'app_id'), ('note', 'note'), ('path', 'path'),
+        ('identifier_plugin', 'identifier_plugin'), ('identifier_data', 'identifier_data'),
+        ('initial_runtime', 'initial_runtime'), ('window_text', 'window_text'))),
+    'play_sessions': ('play_session', (
+        ('id', 'play_session.id'), ('user_app_id', 'user_app_id'),
+        ('started', "CAST(strftime('%s', started) AS INTEGER)"),
+        ('duration', 'duration'), ('note', 'note'))),
+}
+
+# Statements the writer runs for every request, built once so that SQLAlchemy
+# works out their cache keys once instead of on every execution.
+_INSERT_APP = insert(db.App.__table__)
+_INSERT_USER_APP = insert(db.UserApp.__table__)
+_INSERT_PLAY_SESSION = insert(db.PlaySession.__table__)
+_INSERT_REQUEST_KEY = insert(RequestKey.__table__)
+_REQUEST_RESPONSE = select(RequestKey.response).where(RequestKey.key == bindparam('request_key'))
+_APP = select(db.App.id).where(db.App.id == bindparam('app_id'))
+_USER_APP = select(db.UserApp.app_id).where(db.UserApp.id == bindparam('user_app_id'))
+_PLAY_SESSION = select(db.PlaySession.user_app_id, db.PlaySession.started, db.PlaySession.duration).\
+    where(db.PlaySession.id == bindparam('play_session_id'))
+_SET_DURATION = update(db.PlaySession.__table__).\
+    where(db.PlaySession.id == bindparam('play_session_id')).\
+    values(duration=bindparam('new_duration'))
+_SET_NOTE = update(db.PlaySession.__table__).\
+    where(db.PlaySession.id == bindparam('play_session_id')).\
+    values(note=bindparam('new_note'))
+_CHANGED = text("""
+    INSERT INTO sync_change (kind, row_id, seq) VALUES (:kind, :row_id, :seq)
+    ON CONFLICT (kind, row_id) DO UPDATE SET seq = excluded.seq
+""")
+
+
+class Store:
+    """The server's database: one writer thread and a pool of readers.
+
+    write() queues an operation for the writer and returns a
+    concurrent.futures.Future of its result.
+    """
+
+    MAX_BATCH = 256
+    MAX_QUEUE = 4096
+    KEY_LIFETIME = 24 * 60 * 60
+    CHUNK_SIZE = 64 * 1024
+
+    def __init__(self, url, readers=4):
+        self.engine = create_sqlite_engine(url)
+        migrate(self.engine, db.Base.metadata)
+        ServerBase.metadata.create_all(self.engine)
+        with self.engine.connect() as conn:
+            self._seq = conn.execute(select(func.max(Change.seq))).scalar() or 0
+            try:
+                conn.exec_driver_sql("SELECT json_object('id', 1)")
+                self.sqlite_json = True
+            except OperationalError:
+                self.sqlite_json = False
+        self._queue = queue.SimpleQueue()
+        self._writer = None
+        self.readers = concurrent.futures.ThreadPoolExecutor(readers, thread_name_prefix='reader')
+        self.batches = 0
+        self.writes = 0
+
+    def start(self):
+        self._writer = threading.Thread(target=self._write_loop, name='writer', daemon=True)
+        self._writer.start()
+        return self
+
+    def stop(self):
+        self._queue.put(None)
+        if self._writer is not None:
+            self._writer.join()
+        self.readers.shutdown()
+        self.engine.dispose()
+
+    def busy(self):
+        return self._queue.qsize() >= self.MAX_QUEUE
+
+    def write(self, operation, body, key=None):
+        """Queue operation(conn, body), a method of Store, to run on the writer."""
+        future = concurrent.futures.Future()
+        self._queue.put((operation, body, key, future))
+        return future
+
+    def _write_loop(self):
+        with self.engine.connect() as conn:
+            stopping = False
+            while not stopping:
+                item = self._queue.get()
+                batch = []
+                while item is not None:
+                    batch.append(item)
+                    if len(batch) >= self.MAX_BATCH:
+                        break
+                    try:
+                        item = self._queue.get_nowait()
+                    except queue.Empty:
+                        break
+                else:
+                    stopping = True
+                if batch:
+                    self._apply(conn, batch)
+                if self.batches % 1000 == 1:
+                    with conn.begin():
+                        conn.execute(RequestKey.__table__.delete().where(
+                            RequestKey.created < time.time() - self.KEY_LIFETIME))
+
+    def _apply(self, conn, batch):
+        """Run a batch of operations in one transaction.
+
+        If the transaction fails as a whole, the operations are retried one
+        transaction each so that only the faulty one fails.
+        """
+        seq = self._seq
+        try:
+            with conn.begin():
+                results = [self._run(conn, *item[:3]) for item in batch]
+        except Exception:  # pylint: disable=broad-except
+            logger.exception("Batch of %d writes failed; retrying them one at a time.", len(batch))
+            self._seq = seq
+            results = []
+            for item in batch:
+                seq = self._seq
+                try:
+                    with conn.begin():
+                        results.append(self._run(conn, *item[:3]))
+                except Exception as e:  # pylint: disable=broad-except
+                    self._seq = seq
+                    results.append(e)
+        self.batches += 1
+        self.writes += len(batch)
+        for item, result in zip(batch, results):
+            if isinstance(result, Exception):
+                item[3].set_exception(result)
+            else:
+                item[3].set_result(result)
+
+    def _run(self, conn, operation, body, key):
+        """Run one operation, returning its result or the RequestError it raised.
+
+        Operations check their input before writing anything, so a
+        RequestError leaves nothing to roll back.
+        """
+        if key is not None:
+            response = conn.execute(_REQUEST_RESPONSE, {'request_key': key}).scalar()
+            if response is not None:
+                return json.loads(response)
+        try:
+            result = operation(self, conn, body)
+        except RequestError as e:
+            return e
+        if key is not None:
+            conn.execute(_INSERT_REQUEST_KEY, {
+                'key': key, 'response': json.dumps(result), 'created': time.time()})
+        return result
+
+    def _changed(self, conn, kind, row_id):
+        self._seq += 1
+        conn.execute(_CHANGED, {'kind': kind, 'row_id': row_id, 'seq': self._seq})
+
+    @staticmethod
+    def _user_app(conn, user_app_id):
+        row = conn.execute(_USER_APP, {'user_app_id': user_app_id}).first()
+        if row is None:
+            raise RequestError("No UserApp {}.".format(user_app_id), http.HTTPStatus.NOT_FOUND)
+        return row.app_id
+
+    @staticmethod
+    def _play_session(conn, play_session_id):
+        row = conn.execute(_PLAY_SESSION, {'play_session_id': play_session_id}).first()
+        if row is None:
+            raise RequestError("No PlaySession {}.".format(play_session_id), http.HTTPStatus.NOT_FOUND)
+        return row
+
+    # Operations. Each takes the writer's connection and the request body,
+    # and returns the JSON response.
+
+    def create_app(self, conn, body):
+        values = {
+            'name': _field(body, 'name', str),
+            'disambiguation': _field(body, 'disambiguation', str, required=False),
+        }
+        app_id = conn.execute(_INSERT_APP, values).inserted_primary_key[0]
+        self._changed(conn, 'apps', app_id)
+        return {'app_id': app_id}
+
+    def create_user_app(self, conn, body):
+        values = {
+            'app_id': _field(body, 'app_id', int),
+            'note': _field(body, 'note', str, required=False),
+            'path': _field(body, 'path', str, required=False),
+            'identifier_plugin': _field(body, 'identifier_plugin', str, required=False),
+            'identifier_data': _field(body, 'identifier_data', str, required=False),
+            'initial_runtime': _field(body, 'initial_runtime', int, required=False) or 0,
+            'window_text': _field(body, 'window_text', str, required=False),
+        }
+        if conn.execute(_APP, {'app_id': values['app_id']}).first() is None:
+            raise RequestError("No App {}.".format(values['app_id']), http.HTTPStatus.NOT_FOUND)
+        user_app_id = conn.execute(_INSERT_USER_APP, values).inserted_primary_key[0]
+        db.add_runtime(user_app_id, values['app_id'], values['initial_runtime'], session=conn)
+        self._changed(conn, 'user_apps', user_app_id)
+        return {'user_app_id': user_app_id}
+
+    def start_session(self, conn, body):
+        user_app_id = _field(body, 'user_app_id', int)
+        started = _timestamp(_field(body, 'started', (int, float), required=False))
+        app_id = self._user_app(conn, user_app_id)
+        play_session_id = conn.execute(_INSERT_PLAY_SESSION, {
+            'user_app_id': user_app_id, 'started': started, 'duration': 0}).inserted_primary_key[0]
+        db.add_runtime(user_app_id, app_id, 0, session=conn)
+        db.add_playtime(app_id, started, 0, 0, new_session=True, session=conn)
+        self._changed(conn, 'play_sessions', play_session_id)
+        return {'play_session_id': play_session_id, 'started': int(started.timestamp())}
+
+    def stop_session(self, conn, body):
+        play_session_id = _field(body, 'play_session_id', int)
+        duration = _field(body, 'duration', (int, float), required=False)
+        row = self._play_session(conn, play_session_id)
+        started = row.started.replace(tzinfo=datetime.timezone.utc)
+        if duration is None:
+            duration = (datetime.datetime.now(tz=datetime.timezone.utc) - started).total_seconds()
+        duration = int(duration)
+        if duration < 0:
+            raise RequestError("Invalid duration: {!r}.".format(duration))
+        delta = duration - (row.duration or 0)
+        if delta:
+            app_id = self._user_app(conn, row.user_app_id)
+            conn.execute(_SET_DURATION, {'play_session_id': play_session_id, 'new_duration': duration})
+            db.add_runtime(row.user_app_id, app_id, delta, session=conn)
+            db.add_playtime(app_id, started, row.duration or 0, duration, session=conn)
+            self._changed(conn, 'play_sessions', play_session_id)
+        return {'duration': duration}
+
+    def update_session_note(self, conn, body):
+        play_session_id = _field(body, 'play_session_id', int)
+        note = _field(body, 'note', str, required=False)
+        self._play_session(conn, play_session_id)
+        conn.execute(_SET_NOTE, {'play_session_id': play_session_id, 'new_note': note})
+        self._changed(conn, 'play_sessions', play_session_id)
+        return {}
+
+    MAX_BATCH_OPERATIONS = 1000
+
+    def batch(self, conn, body):
+        """Run the operations of a /batch request in order.
+
+        The body is {"operations": [{"endpoint": ..., "body": ..., "key": ...}]}
+        where key is optional and acts as the operation's Idempotency-Key. A
+        field of a body may be {"$ref": [index, field]}, meaning that field of
+        the response to an earlier operation. The response is
+        {"results": [{"status": ..., "body": ...}]}, one per operation; an
+        operation referring to one that failed fails with status 424.
+        """
+        operations = _field(body, 'operations', list)
+        if len(operations) > self.MAX_BATCH_OPERATIONS:
+            raise RequestError("More than {} operations.".format(self.MAX_BATCH_OPERATIONS),
+                               http.HTTPStatus.REQUEST_ENTITY_TOO_LARGE)
+        results = []
+        for operation in operations:
+            try:
+                if not isinstance(operation, dict) or not isinstance(operation.get('body', {}), dict):
+                    raise RequestError("Expected a JSON object.")
+                method = self.OPERATIONS.get(operation.get('endpoint'))
+                if method is None:
+                    raise RequestError("Unknown endpoint: {!r}.".format(operation.get('endpoint')),
+                                       http.HTTPStatus.NOT_FOUND)
+                result = self._run(conn, method, _resolve(operation.get('body', {}), results),
+                                   operation.get('key'))
+                if isinstance(result, RequestError):
+                    raise result
+            except RequestError as e:
+                results.append({'status': e.status, 'body': {'error': str(e)}})
+            else:
+                results.append({'status': http.HTTPStatus.OK, 'body': result})
+        return {'results': results}
+
+    OPERATIONS = {
+        '/create-app': create_app,
+        '/create-user-app': create_user_app,
+        '/start': start_session,
+        '/stop': stop_session,
+        '/update-session-note': update_session_note,
+    }
+
+    # Reads. These run on a reader thread and yield the response in chunks.
+
+    def _rows(self, conn, kind, since):
+        """Yield the rows of kind changed since since, each encoded as JSON.
+
+        SQLite encodes them itself if it has the JSON functions, which is
+        several times faster than building and encoding a dict per row.
+        """
+        table, fields = ROWS[kind]
+        if self.sqlite_json:
+            columns = "json_object({})".format(', '.join(
+                "'{}', {}".format(name, expression) for name, expression in fields))
+        else:
+            columns = ', '.join(expression for _, expression in fields)
+        query = "SELECT {} FROM {}".format(columns, table)
+        params = {}
+        if since is not None:
+            query += (" JOIN sync_change ON sync_change.kind = :kind"
+                      " AND sync_change.row_id = {}.id WHERE sync_change.seq > :since").format(table)
+            params = {'kind': kind, 'since': since}
+        result = conn.execute(text(query), params)
+        if self.sqlite_json:
+            for row in result:
+                yield row[0]
+        else:
+            names = [name for name, _ in fields]
+            for row in result:
+                yield json.dumps(dict(zip(names, row)))
+
+    def encode(self, since=None, sync=True):
+        """Yield the JSON body of /sync (or /fetch-remote-db if not sync) in chunks.
+
+        since is the token of the previous /sync; None sends everything.
+        """
+        encoder = json.JSONEncoder()
+        with self.engine.connect() as conn:
+            # Read the token first: a row changed after it is sent again next
+            # time, which is harmless, but never missed.
+            token = conn.execute(select(func.max(Change.seq))).scalar() or 0
+            chunk = []
+            size = 0
+            separator = '{'
+            for kind in ROWS:
+                chunk.append('{}{}: ['.format(separator, encoder.encode(kind)))
+                separator = ', '
+                first = True
+                for piece in self._rows(conn, kind, since):
+                    chunk.append(piece if first else ', ' + piece)
+                    first = False
+                    size += len(piece)
+                    if size >= self.CHUNK_SIZE:
+                        yield ''.join(chunk).encode('utf-8')
+                        chunk, size = [], 0
+                chunk.append(']')
+            if since is None or not sync:
+                settings = [
+                    dict(zip(('id', 'owner', 'key', 'value'), row)) for row in conn.execute(
+                        text("SELECT id, owner, key, value FROM settings WHERE owner != 'DB'"))]
+                chunk.append(', "settings": {}'.format(encoder.encode(settings)))
+            if sync:
+                chunk.append(', "settings_changed": {}, "token": {}'.format(
+                    encoder.encode(since is None), encoder.encode(str(token))))
+            chunk.append('}')
+            yield ''.join(chunk).encode('utf-8')
+
+
+class Server:
+    """The HTTP front end of a Store."""
+
+    MAX_BODY = 1024 * 1024
+    IDLE_TIMEOUT = 60
+
+    POST = dict(Store.OPERATIONS, **{'/batch': Store.batch})
+
+    def __init__(self, store, host=DEFAULT_HOST, port=DEFAULT_PORT):
+        self.store = store
+        self.host = host
+        self.port = port
+        self._server = None
+
+    @property
+    def base_url(self):
+        host, port = self._server.sockets[0].getsockname()[:2]
+        return 'http://{}:{}'.format(host, port)
+
+    async def start(self):
+        self._server = await asyncio.start_server(
+            self.handle, self.host, self.port, backlog=1024)
+        logger.info("Serving on %s", self.base_url)
+        return self
+
+    async def serve_forever(self):
+        async with self._server:
+            await self._server.serve_forever()
+
+    @staticmethod
+    def _head(status, headers):
+        lines = ['HTTP/1.1 {} {}'.format(status.value, status.phrase)]
+        lines.extend('{}: {}'.format(name, value) for name, value in headers)
+        return ('\r\n'.join(lines) + '\r\n\r\n').encode('latin-1')
+
+    def _send(self, writer, status, body, keep_alive):
+        body = json.dumps(body).encode('utf-8')
+        writer.write(self._head(status, [
+            ('Content-Type', 'application/json'),
+            ('Content-Length', len(body)),
+            ('Connection', 'keep-alive' if keep_alive else 'close'),
+        ]) + body)
+
+    async def _stream(self, writer, produce, keep_alive):
+        """Send the chunks produced on a reader thread with chunked encoding."""
+        loop = asyncio.get_running_loop()
+        chunks = asyncio.Queue(maxsize=4)
+        cancelled = threading.Event()
+
+        def run():
+            try:
+                for chunk in produce():
+                    if cancelled.is_set():
+                        break
+                    asyncio.run_coroutine_threadsafe(chunks.put(chunk), loop).result()
+            finally:
+                asyncio.run_coroutine_threadsafe(chunks.put(None), loop).result()
+
+        done = loop.run_in_executor(self.store.readers, run)
+        try:
+            writer.write(self._head(http.HTTPStatus.OK, [
+                ('Content-Type', 'application/json'),
+                ('Transfer-Encoding', 'chunked'),
+                ('Connection', 'keep-alive' if keep_alive else 'close'),
+            ]))
+            while (chunk := await chunks.get()) is not None:
+                writer.write(b'%x\r\n%s\r\n' % (len(chunk), chunk))
+                await writer.drain()
+            writer.write(b'0\r\n\r\n')
+        except BaseException:
+            cancelled.set()
+            while await chunks.get() is not None:
+                pass
+            raise
+        finally:
+            await done
+
+    async def handle(self, reader, writer):
+        try:
+            while await self._handle_one(reader, writer):
+                pass
+        except (ConnectionError, asyncio.IncompleteReadError, asyncio.TimeoutError):
+            pass
+        except Exception:  # pylint: disable=broad-except
+            logger.exception("Error handling a request.")
+        finally:
+            writer.close()
+
+    async def _handle_one(self, reader, writer):
+        """Answer one request. Returns whether to keep the connection open."""
+        request_line = await asyncio.wait_for(reader.readline(), self.IDLE_TIMEOUT)
+        if not request_line:
+            return False
+        try:
+            method, target, version = request_line.decode('latin-1').split()
+            headers = {}
+            while (line := await reader.readline()) not in (b'\r\n', b'\n', b''):
+                name, value = line.decode('latin-1').split(':', 1)
+                headers[name.strip().lower()] = value.strip()
+            length = int(headers.get('content-length', 0))
+        except ValueError:
+            self._send(writer, http.HTTPStatus.BAD_REQUEST, {'error': 'Malformed request.'}, False)
+            return False
+        if length > self.MAX_BODY:
+            self._send(writer, http.HTTPStatus.REQUEST_ENTITY_TOO_LARGE,
+                       {'error': 'Request too large.'}, False)
+            return False
+        body = await reader.readexactly(length)
+        keep_alive = version == 'HTTP/1.1' and headers.get('connection', '').lower() != 'close'
+
+        url = urllib.parse.urlsplit(target)
+        if method == 'GET' and url.path in ('/sync', '/fetch-remote-db'):
+            since = urllib.parse.parse_qs(url.query).get('since', [None])[0]
+            if since is not None and not since.isdigit():
+                self._send(writer, http.HTTPStatus.BAD_REQUEST, {'error': 'Invalid token.'}, keep_alive)
+            else:
+                sync = url.path == '/sync'
+                await self._stream(
+                    writer, lambda: self.store.encode(int(since) if since else None, sync), keep_alive)
+        elif method == 'POST' and url.path in self.POST:
+            status, response = await self._write(self.POST[url.path], body, headers)
+            self._send(writer, status, response, keep_alive)
+        elif url.path in self.POST or url.path in ('/sync', '/fetch-remote-db'):
+            self._send(writer, http.HTTPStatus.METHOD_NOT_ALLOWED, {'error': 'Method not allowed.'},
+                       keep_alive)
+        else:
+            self._send(writer, http.HTTPStatus.NOT_FOUND, {'error': 'Not found.'}, keep_alive)
+        await writer.drain()
+        return keep_alive
+
+    async def _write(self, operation, body, headers):
+        """Run operation on the writer; returns (status, JSON response)."""
+        try:
+            body = json.loads(body or b'{}')
+        except ValueError:
+            return http.HTTPStatus.BAD_REQUEST, {'error': 'Invalid JSON.'}
+        if not isinstance(body, dict):
+            return http.HTTPStatus.BAD_REQUEST, {'error': 'Expected a JSON object.'}
+        if self.store.busy():
+            return http.HTTPStatus.SERVICE_UNAVAILABLE, {'error': 'Too many pending writes.'}
+        try:
+            result = await asyncio.wrap_future(
+                self.store.write(operation, body, headers.get('idempotency-key')))
+        except RequestError as e:
+            return e.status, {'error': str(e)}
+        except Exception:  # pylint: disable=broad-except
+            logger.exception("Error in %s", operation.__name__)
+            return http.HTTPStatus.INTERNAL_SERVER_ERROR, {'error': 'Internal error.'}
+        return http.HTTPStatus.OK, result
+
+
+async def serve(store, host=DEFAULT_HOST, port=DEFAULT_PORT):
+    server = await Server(store, host, port).start()
+    task = asyncio.current_task()
+    try:
+        asyncio.get_running_loop().add_signal_handler(signal.SIGTERM, task.cancel)
+    except (NotImplementedError, AttributeError):
+        pass  # Windows: no SIGTERM handling in the event loop.
+    try:
+        await server.serve_forever()
+    except asyncio.CancelledError:
+        logger.info("Stopping.")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--host', default=DEFAULT_HOST)
+    parser.add_argument('--port', type=int, default=DEFAULT_PORT)
+    parser.add_argument('--db', default=SERVER_DB, help="database file (default: %(default)s)")
+    parser.add_argument('--readers', type=int, default=4, help="threads serving reads")
+    parser.add_argument('--max-batch', type=int, default=Store.MAX_BATCH,
+                        help="most writes committed together (default: %(default)s)")
+    args = parser.parse_args(argv)
+
+    setup_logging()
+    os.makedirs(os.path.dirname(os.path.abspath(args.db)), exist_ok=True)
+    store = Store('sqlite:///{}'.format(args.db), args.readers)
+    store.MAX_BATCH = args.max_batch
+    store.start()
+    try:
+        asyncio.run(serve(store, args.host, args.port))
+    except KeyboardInterrupt:
+        pass
+    finally:
+        store.stop()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,48 @@
+"""Persist play sessions."""
+import datetime
+
+from . import db, outbox
+from .db import PlaySession, Session
+
+
+def begin_session(app_id, user_app_id, started=None):
+    """Begin a play session that started at started (a UTC datetime) or now."""
+    play_session = PlaySession(
+        user_app_id=user_app_id,
+        started=started or datetime.datetime.now(tz=datetime.UTC))
+    if db.IS_REMOTE:
+        box = outbox.get_outbox()
+        play_session.id = box.provisional_id()
+        box.send(
+            '/start',
+            {'app_id': app_id,
+             'user_app_id': user_app_id,
+             'started': play_session.started.timestamp()},
+            creates={'play_session_id': play_session.id})
+    Session.add(play_session)
+    Session.flush()
+    db.add_runtime(user_app_id, app_id, 0)
+    db.add_playtime(app_id, play_session.started, 0, 0, new_session=True)
+    return play_session
+
+
+def _set_duration(play_session, duration):
+    delta = duration - (play_session.duration or 0)
+    play_session.duration = duration
+    if delta:
+        app_id = play_session.user_app.app_id
+        db.add_runtime(play_session.user_app_id, app_id, delta)
+        db.add_playtime(app_id, play_session.started, duration - delta, duration)
+
+
+def update_session(play_session, elapsed):
+    _set_duration(play_session, elapsed)
+
+
+def end_session(play_session, elapsed):
+    _set_duration(play_session, elapsed)
+    if db.IS_REMOTE:
+        outbox.get_outbox().send(
+            '/stop',
+            {'play_session_id': play_session.id,
+             'duration': elapsed})
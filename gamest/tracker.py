@@ -0,0 +1,298 @@
+"""Detect running games and persist play sessions off the Tk thread."""
+import concurrent.futures
+import datetime
+import logging
+import queue
+import threading
+import time
+
+import psutil
+
+from . import db
+from .db import DBConfig, PlaySession, Session, UserApp
+from .heartbeat import Heartbeat
+from .scheduler import PollScheduler
+from .sessions import begin_session, update_session, end_session
+from .util import positive_float
+from .watch import watch_exit
+
+logger = logging.getLogger(__name__)
+
+
+def elapsed_since(started):
+    """Return the number of whole seconds since started (a UTC datetime)."""
+    now = datetime.datetime.now(tz=datetime.UTC)
+    return int((now - started.replace(tzinfo=datetime.UTC)).total_seconds())
+
+
+def detected_start(proc, since):
+    """Return when proc started as a UTC datetime, but no earlier than since.
+
+    since is the time of the previous poll. A game found by a poll has been
+    running since its process was created, but time before the previous poll
+    either was already recorded or wasn't watched by gamest, so it isn't
+    counted. Returns None if proc has no create_time.
+    """
+    try:
+        created = proc.create_time()
+    except (AttributeError, psutil.Error):
+        return None
+    started = min(max(created, since), time.time())
+    return datetime.datetime.fromtimestamp(started, tz=datetime.UTC)
+
+
+class Tracker(threading.Thread):
+    """Background worker that does game detection and persistence.
+
+    The tracker owns its own database session. State changes are posted to the
+    events queue as tuples for the Tk thread to handle:
+
+    * ('start', proc, user_app_id, play_session_id, runtime)
+    * ('update', play_session_id, elapsed, runtime)
+    * ('end', play_session_id, duration)
+    * ('rejected', proc), when a manual session can't begin
+
+    The Tk thread talks to the tracker with begin_manual_session,
+    reload_settings and stop. Polls are spaced by a PollScheduler.
+
+    The running session's duration is kept in memory and written to the
+    database only every checkpoint_interval seconds, when the session ends and
+    on stop. In between, each poll appends it to a Heartbeat file, which is
+    used to restore the duration at the next startup after a crash.
+
+    Identifiers run concurrently in a thread pool. Each poll waits at most
+    identify_deadline seconds for them; an identifier still running after
+    that is reported and skipped until its call finishes.
+    """
+
+    STOP_TIMEOUT = 5
+    DEFAULT_DEADLINE = 2.0
+    DEFAULT_CHECKPOINT_INTERVAL = 60.0
+
+    def __init__(self, identifiers, events):
+        super().__init__(name="Tracker", daemon=True)
+        self.identifiers = sorted(
+            identifiers,
+            key=lambda p: (getattr(p, 'PRIORITY', 100), p.__class__.__name__))
+        self.events = events
+        self.commands = queue.Queue()
+        self.config = DBConfig(owner='Application')
+
+        self.pool = concurrent.futures.ThreadPoolExecutor(
+            max_workers=max(len(self.identifiers), 1),
+            thread_name_prefix="Identifier")
+        self.busy = {}
+        self.late = set()
+        self.scheduler = PollScheduler()
+        self.checkpoint_interval = self.DEFAULT_CHECKPOINT_INTERVAL
+        self.heartbeat = None if db.IS_REMOTE else Heartbeat()
+
+        self.running = None
+        self.play_session = None
+        self.watcher = None
+        self.checkpointed = None
+        # When the last poll found nothing, or a session ended (a time.time()).
+        self.idle_since = None
+
+    def begin_manual_session(self, proc, user_app_id):
+        self.commands.put(('manual', proc, user_app_id))
+
+    def reload_settings(self):
+        self.commands.put(('settings',))
+
+    def stop(self, timeout=None):
+        """Persist the running session, if any, and stop the tracker."""
+        self.commands.put(('stop',))
+        self.join(timeout)
+
+    def run(self):
+        logger.debug("Tracker started.")
+        self.load_settings()
+        self.recover()
+        next_poll = time.monotonic()
+        while True:
+            try:
+                command = self.commands.get(timeout=max(next_poll - time.monotonic(), 0))
+            except queue.Empty:
+                command = None
+
+            try:
+                if command is None:
+                    self.poll()
+                elif command[0] == 'manual':
+                    self.manual(*command[1:])
+                elif command[0] == 'exited':
+                    if self.running and command[1] is self.running[0]:
+                        self.end()
+                elif command[0] == 'settings':
+                    self.load_settings()
+                elif command[0] == 'stop':
+                    self.shutdown()
+                    break
+                Session.commit()
+            except Exception:
+                logger.exception("Tracker failure handling %r", command)
+                Session.rollback()
+
+            if command is None or command[0] in ('manual', 'exited'):
+                next_poll = time.monotonic() + self.scheduler.next_interval(self.running is not None)
+                logger.debug(
+                    "Next poll in %.1f s (average interval %.1f s).",
+                    self.scheduler.current, self.scheduler.average)
+        self.pool.shutdown(wait=False)
+        if self.heartbeat is not None:
+            self.heartbeat.close()
+        Session.remove()
+        logger.debug("Tracker stopped.")
+
+    def load_settings(self):
+        try:
+            self.scheduler.configure(
+                min_interval=self.config.get(
+                    'poll_min_interval', type=positive_float,
+                    fallback=PollScheduler.MIN_INTERVAL),
+                max_interval=self.config.get(
+                    'poll_max_interval', type=positive_float,
+                    fallback=PollScheduler.MAX_INTERVAL),
+                running_interval=self.config.get(
+                    'poll_running_interval', type=positive_float,
+                    fallback=PollScheduler.RUNNING_INTERVAL))
+        except ValueError:
+            logger.exception("Invalid polling settings; keeping the previous ones.")
+        try:
+            self.checkpoint_interval = self.config.get(
+                'checkpoint_interval', type=positive_float,
+                fallback=self.DEFAULT_CHECKPOINT_INTERVAL)
+        except ValueError:
+            logger.exception("Invalid checkpoint interval; keeping the previous one.")
+
+    def recover(self):
+        """Restore session durations recorded after the last checkpoint."""
+        if self.heartbeat is None:
+            return
+        try:
+            for play_session_id, elapsed in self.heartbeat.recover().items():
+                play_session = Session.get(PlaySession, play_session_id)
+                if play_session is not None and (play_session.duration or 0) < elapsed:
+                    logger.info(
+                        "Recovered %s s of play session %s.",
+                        elapsed - (play_session.duration or 0), play_session_id)
+                    update_session(play_session, elapsed)
+            Session.commit()
+            self.heartbeat.clear()
+        except Exception:
+            logger.exception("Failed to recover play sessions from the heartbeat file.")
+            Session.rollback()
+
+    def poll(self):
+        if self.running is None:
+            self.identify()
+        else:
+            self.update()
+
+    @property
+    def deadline(self):
+        try:
+            return self.config.get(
+                'identify_deadline', type=positive_float, fallback=self.DEFAULT_DEADLINE)
+        except ValueError:
+            logger.warning("Invalid identification deadline; using %s s.", self.DEFAULT_DEADLINE)
+            return self.DEFAULT_DEADLINE
+
+    def identify(self):
+        polled = time.time()
+        for p, future in list(self.busy.items()):
+            if future.done():
+                del self.busy[p]
+                if p in self.late:
+                    logger.info("Identifier %s has recovered.", p.__class__.__name__)
+                    self.late.discard(p)
+
+        # An identifier is never run again while its previous call is running.
+        futures = []
+        for p in self.identifiers:
+            if p not in self.busy:
+                self.busy[p] = self.pool.submit(p.identify_game)
+                futures.append((p, self.busy[p]))
+
+        deadline = time.monotonic() + self.deadline
+        for p, future in futures:
+            try:
+                found = future.result(timeout=max(deadline - time.monotonic(), 0))
+            except concurrent.futures.TimeoutError:
+                logger.warning(
+                    "Identifier %s missed the %.1f s deadline; skipping it until it finishes.",
+                    p.__class__.__name__, self.deadline)
+                self.late.add(p)
+                continue
+            except Exception:
+                logger.exception("Identifier %s failed.", p.__class__.__name__)
+                continue
+            if found is not None:
+                proc, user_app = found
+                started = None
+                if self.idle_since is not None:
+                    started = detected_start(proc, self.idle_since)
+                self.begin(proc, user_app, started)
+                return
+        self.idle_since = polled
+
+    def manual(self, proc, user_app_id):
+        if self.running is not None:
+            logger.warning("Can't begin manual session; a game is already running.")
+            self.events.put(('rejected', proc))
+            return
+        self.begin(proc, Session.get(UserApp, user_app_id))
+
+    def begin(self, proc, user_app, started=None):
+        user_app = Session.merge(user_app)
+        self.play_session = begin_session(user_app.app_id, user_app.id, started)
+        self.running = (proc, user_app)
+        Session.commit()
+        self.checkpointed = time.monotonic()
+        self.watcher = watch_exit(proc, self.commands)
+        logger.debug("Now running %s", user_app.app.name)
+        self.events.put((
+            'start', proc, user_app.id, self.play_session.id, user_app.app.runtime))
+
+    def update(self):
+        elapsed = elapsed_since(self.play_session.started)
+        if time.monotonic() - self.checkpointed >= self.checkpoint_interval:
+            self.checkpoint(elapsed)
+        elif self.heartbeat is not None:
+            self.heartbeat.beat(self.play_session.id, elapsed)
+        # The stored runtime doesn't include time since the last checkpoint.
+        unsaved = elapsed - (self.play_session.duration or 0)
+        self.events.put((
+            'update', self.play_session.id, elapsed, self.running[1].app.runtime + unsaved))
+
+    def checkpoint(self, elapsed):
+        """Write the running session's duration to the database."""
+        update_session(self.play_session, elapsed)
+        Session.commit()
+        self.checkpointed = time.monotonic()
+        if self.heartbeat is not None:
+            self.heartbeat.clear()
+
+    def end(self):
+        play_session, self.play_session = self.play_session, None
+        self.running = None
+        self.idle_since = time.time()
+        self.scheduler.reset()
+        if self.watcher is not None:
+            self.watcher.cancel()
+            self.watcher = None
+        try:
+            end_session(play_session, elapsed_since(play_session.started))
+            Session.commit()
+            if self.heartbeat is not None:
+                self.heartbeat.clear()
+        finally:
+            self.events.put(('end', play_session.id, play_session.duration))
+
+    def shutdown(self):
+        if self.watcher is not None:
+            self.watcher.cancel()
+            self.watcher = None
+        if self.running is not None:
+            self.checkpoint(elapsed_since(self.play_session.started))
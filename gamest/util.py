@@ -10,3 +10,11 @@ def format_time(t, short=True):
     segments.append("{} second{}".format(seconds, '' if seconds == 1 else 's'))
 
     return ", ".join(segments)
+
+
+def positive_float(value):
+    """Parse a setting that must be a number greater than zero."""
+    number = float(value)
+    if not number > 0:
+        raise ValueError("{!r} is not greater than zero".format(value))
+    return number
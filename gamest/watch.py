@@ -0,0 +1,113 @@
+"""Detect when a tracked process exits."""
+import logging
+import os
+import select
+import threading
+
+import psutil
+
+logger = logging.getLogger(__name__)
+
+
+class ExitWatcher(threading.Thread):
+    """Wait for a process to exit in a background thread.
+
+    When the process exits, ('exited', proc) is put on the events queue. The
+    fallback implementation waits using proc.wait(timeout), which works for
+    psutil.Process and FakeProcess alike.
+    """
+
+    CANCEL_CHECK = 1
+
+    def __init__(self, proc, events):
+        super().__init__(name="ExitWatcher-{}".format(getattr(proc, 'pid', 'fake')), daemon=True)
+        self.proc = proc
+        self.events = events
+        self._exited = threading.Event()
+        self._cancelled = threading.Event()
+
+    @property
+    def exited(self):
+        return self._exited.is_set()
+
+    def cancel(self):
+        self._cancelled.set()
+
+    def run(self):
+        try:
+            exited = self.wait_for_exit()
+        except Exception:
+            logger.exception("Failed waiting for %r; assuming it exited.", self.proc)
+            exited = True
+        if exited:
+            self._exited.set()
+            self.events.put(('exited', self.proc))
+
+    def wait_for_exit(self):
+        """Block until the process exits or the watcher is cancelled.
+
+        Return True if the process exited.
+        """
+        while not self._cancelled.is_set():
+            try:
+                self.proc.wait(timeout=self.CANCEL_CHECK)
+                return True
+            except psutil.TimeoutExpired:
+                continue
+            except psutil.NoSuchProcess:
+                return True
+        return False
+
+
+class PidfdExitWatcher(ExitWatcher):
+    """Wait for a process to exit using a Linux pidfd."""
+
+    def __init__(self, proc, events):
+        super().__init__(proc, events)
+        self._pidfd = os.pidfd_open(proc.pid)
+        self._cancel_r, self._cancel_w = os.pipe()
+        self._lock = threading.Lock()
+        self._closed = False
+
+    def cancel(self):
+        super().cancel()
+        with self._lock:
+            if not self._closed:
+                os.write(self._cancel_w, b'x')
+
+    def wait_for_exit(self):
+        try:
+            # The pid may have been reused between identification and opening
+            # the pidfd; in that case the process we wanted is already gone.
+            if not self.proc.is_running():
+                return True
+            poller = select.poll()
+            poller.register(self._pidfd, select.POLLIN)
+            poller.register(self._cancel_r, select.POLLIN)
+            while True:
+                for fd, _ in poller.poll():
+                    if fd == self._pidfd:
+                        return True
+                    if fd == self._cancel_r:
+                        return False
+        finally:
+            with self._lock:
+                self._closed = True
+                for fd in (self._pidfd, self._cancel_r, self._cancel_w):
+                    os.close(fd)
+
+
+def watch_exit(proc, events):
+    """Start and return a watcher that reports when proc exits."""
+    watcher = None
+    if hasattr(os, 'pidfd_open') and isinstance(proc, psutil.Process):
+        try:
+            watcher = PidfdExitWatcher(proc, events)
+        except ProcessLookupError:
+            logger.debug("Process %d exited before it could be watched.", proc.pid)
+        except OSError:
+            logger.debug("pidfd_open unavailable; falling back to polling.", exc_info=True)
+    if watcher is None:
+        watcher = ExitWatcher(proc, events)
+    watcher.start()
+    return watcher
@@ -0,0 +1,104 @@
+import logging
+import re
+
+logger = logging.getLogger(__name__)
+
+
+class IgnoreMatcher:
+    """Decide whether a process name should be ignored.
+
+    Exact names are checked with a set lookup, and patterns are merged into a
+    single precompiled alternation. Patterns that would behave differently
+    inside it (global flags, named groups, backreferences) are compiled on
+    their own, and if the alternation doesn't compile, every pattern is.
+    Verdicts are memoized per name; the memo is cleared once it holds more
+    than max_cache names.
+    """
+
+    # Constructs whose meaning depends on the rest of the pattern.
+    UNMERGEABLE = re.compile(r'\(\?[aiLmsux]+\)|\(\?P|\(\?\(|\\[1-9]')
+
+    def __init__(self, names=(), patterns=(), max_cache=4096):
+        self.names = frozenset(names)
+        patterns = [p for p in patterns if p and self._valid(p)]
+        merged = [p for p in patterns if not self.UNMERGEABLE.search(p)]
+        separate = [p for p in patterns if self.UNMERGEABLE.search(p)]
+        regexes = [re.compile(p) for p in separate]
+        if len(merged) > 1:
+            try:
+                regexes.insert(0, re.compile('|'.join('(?:{})'.format(p) for p in merged)))
+            except re.error:
+                logger.debug("Matching process name patterns separately", exc_info=True)
+                regexes.extend(re.compile(p) for p in merged)
+        else:
+            regexes.extend(re.compile(p) for p in merged)
+        self.regexes = tuple(regexes)
+        self.max_cache = max_cache
+        self._cache = {}
+
+    @staticmethod
+    def _valid(pattern):
+        try:
+            re.compile(pattern)
+        except re.error:
+            logger.warning("Ignoring invalid process name pattern: %r", pattern)
+            return False
+        return True
+
+    def __call__(self, name):
+        try:
+            return self._cache[name]
+        except KeyError:
+            pass
+        ignored = (name in self.names
+                   or any(regex.match(name or '') is not None for regex in self.regexes))
+        if len(self._cache) >= self.max_cache:
+            self._cache.clear()
+        self._cache[name] = ignored
+        return ignored
+
+
+class CmdlineTrie:
+    """Prefix trie mapping command line prefixes to values.
+
+    An empty prefix matches every command line.
+    """
+
+    _VALUE = ''
+
+    def __init__(self):
+        self.root = {}
+
+    def add(self, prefix, value):
+        node = self.root
+        for char in prefix or '':
+            node = node.setdefault(char, {})
+        node.setdefault(self._VALUE, value)
+
+    def longest_match(self, cmdline):
+        """Return the value of the longest prefix of cmdline, or None."""
+        node = self.root
+        found = node.get(self._VALUE)
+        for char in cmdline:
+            node = node.get(char)
+            if node is None:
+                break
+            found = node.get(self._VALUE, found)
+        return found
+
+
+class UserAppIndex:
+    """Index of UserApp ids by exe and command line prefix."""
+
+    def __init__(self, user_apps=()):
+        self._by_exe = {}
+        for user_app_id, exe, cmdline in user_apps:
+            if exe:
+                self._by_exe.setdefault(exe, CmdlineTrie()).add(cmdline, user_app_id)
+
+    def match(self, exe, cmdline):
+        """Return the id of the UserApp for exe with the longest matching cmdline."""
+        trie = self._by_exe.get(exe)
+        if trie is None:
+            return None
+        return trie.longest_match(' '.join(cmdline or ()))
@@ -1,12 +1,12 @@
 import json
-import re
-from collections import defaultdict
 
 import getpass
-import psutil
 
 from gamest import db
 from gamest.plugins import IdentifierPlugin
+from gamest.processes import snapshot
+
+from .matching import IgnoreMatcher, UserAppIndex
 
 trash_names = {
     'bash',
@@ -59,7 +59,7 @@ trash_names = {
     'unsecapp.exe',
     'WmiPrvSE.exe',
 }
-trash_regex = [
+trash_regex = (
     r'evolution-.+',
     r'gnome-.+',
     r'gsd-.+',
@@ -67,7 +67,7 @@ trash_regex = [
     r'gvfsd-.+',
     r'ibus-.+',
     r'xdg-.+',
-]
+)
 
 
 class ProcessIdentifierPlugin(IdentifierPlugin):
@@ -76,29 +76,36 @@ class ProcessIdentifierPlugin(IdentifierPlugin):
         super().__init__(application)
 
         self.username = getpass.getuser()
-        self._uas = defaultdict(list)
-        trash_regex.extend(r for r in self.config.getlist('trash_names') if r)
+        self._uas = None
+        self.ignored = self.build_ignore_matcher()
 
         def update_trash_names(event):
             del event
-            trash_regex.extend(self.config.getlist('trash_names'))
+            self.ignored = self.build_ignore_matcher()
         application.bind("<<SettingsUpdated>>", update_trash_names, "+")
 
         self.logger.debug("ProcessIdentifierPlugin initialized.")
 
     @property
     def uas(self):
-        if not self._uas:
-            q = db.Session.query(db.UserApp).filter(
-                db.UserApp.identifier_plugin == self.__class__.__name__)
-            self._uas = defaultdict(list)
-            for ua in q:
-                data = json.loads(ua.identifier_data)
-                if exe := data.get('exe'):
-                    self._uas[exe].append((ua.id, data.get('cmdline')))
+        if self._uas is None:
+            # Plain ids, so that no rows are kept from the session that loaded them.
+            q = db.Session.query(db.UserApp.id, db.UserApp.identifier_data).filter(
+                db.UserApp.identifier_plugin == self.__class__.__name__).\
+                order_by(db.UserApp.id)
+            entries = []
+            for user_app_id, identifier_data in q:
+                data = json.loads(identifier_data)
+                entries.append((user_app_id, data.get('exe'), data.get('cmdline')))
+            self._uas = UserAppIndex(entries)
 
         return self._uas
 
+    def build_ignore_matcher(self):
+        return IgnoreMatcher(
+            trash_names,
+            list(trash_regex) + list(self.config.getlist('trash_names')))
+
     @classmethod
     def get_settings_template(cls):
         d = super().get_settings_template()
@@ -114,24 +121,24 @@ class ProcessIdentifierPlugin(IdentifierPlugin):
         return d
 
     def candidates(self):
+        ignored = self.ignored
         procs = [p
-                 for p in psutil.process_iter(['name', 'username', 'exe', 'cmdline', 'create_time'])
-                 if p.info['username'].endswith(self.username)
-                 and p.info['name'] not in trash_names
-                 and not any(re.match(t, p.info['name']) for t in trash_regex)]
+                 for p in snapshot.get()
+                 if (p.username or '').endswith(self.username)
+                 and not ignored(p.name)]
 
-        procs.sort(key=lambda p: p.info['create_time'], reverse=True)
+        procs.sort(key=lambda p: p.create_time, reverse=True)
 
         candidates = []
         for p in procs:
             try:
                 candidates.append(db.UserApp(
-                    note=p.info['name'],
+                    note=p.name,
                     identifier_plugin=self.__class__.__name__,
                     identifier_data=json.dumps(
                         {
-                            'exe': p.info['exe'],
-                            'cmdline': ' '.join(p.info['cmdline']).rstrip() if p.info['cmdline'] else '',
+                            'exe': p.exe,
+                            'cmdline': ' '.join(p.cmdline).rstrip() if p.cmdline else '',
                         }
                     )
                 ))
@@ -141,22 +148,28 @@ class ProcessIdentifierPlugin(IdentifierPlugin):
         return candidates
 
     def identify_game(self):
+        ignored = self.ignored
         candidates = [p
-                      for p in psutil.process_iter(['name', 'username', 'exe', 'cmdline', 'create_time'])
-                      if p.info['username'].endswith(self.username)
-                      and p.info['name'] not in trash_names
-                      and not any(re.match(t, p.info['name']) for t in trash_regex)]
+                      for p in snapshot.get()
+                      if (p.username or '').endswith(self.username)
+                      and not ignored(p.name)]
 
         # This way we will catch the oldest process first.
-        candidates.sort(key=lambda c: c.info['create_time'])
-
-        for c in candidates:
-            if uas := self.uas.get(c.info['exe']):
-                for ua_id, cmdline in uas:
-                    if not cmdline or ' '.join(c.info['cmdline']).startswith(cmdline):
-                        return (c, db.Session.query(db.UserApp).get(ua_id))
+        candidates.sort(key=lambda c: c.create_time)
+
+        # This runs on the tracker's identifier pool, so the thread's session
+        # is removed afterwards to return its connection to the pool.
+        try:
+            uas = self.uas
+            for c in candidates:
+                if user_app_id := uas.match(c.exe, c.cmdline):
+                    if proc := snapshot.resolve(c):
+                        if ua := db.Session.get(db.UserApp, user_app_id):
+                            return (proc, ua)
+        finally:
+            db.Session.remove()
 
         return None
 
     def clear_cache(self):
-        self._uas = {}
+        self._uas = None
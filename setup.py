@@ -21,7 +21,10 @@ setup(
     entry_points={
         'gui_scripts': [
             'gamest = gamest.app:main',
-        ]
+        ],
+        'console_scripts': [
+            'gamest-server = gamest.server:main',
+        ],
     },
     classifiers=[
         "Development Status :: 4 - Beta",
@@ -0,0 +1,31 @@
+"""Importing gamest must not touch the database or the data directory."""
+import json
+import os
+import subprocess
+import sys
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+PROBE = """
+import json, sys
+sys.path.insert(0, {root!r})
+import gamest
+import gamest.db
+import gamest.plugins
+import gamest_plugins.process_identifier.module
+print(json.dumps({{'data_dir': gamest.DATA_DIR, 'engine': gamest.db._engine is not None}}))
+"""
+
+
+def test_import_has_no_side_effects(tmp_path):
+    env = dict(os.environ, XDG_DATA_HOME=str(tmp_path), XDG_CACHE_HOME=str(tmp_path))
+    output = subprocess.run(
+        [sys.executable, '-c', PROBE.format(root=ROOT)],
+        env=env, check=True, capture_output=True, text=True).stdout
+    result = json.loads(output.splitlines()[-1])
+    if not result['data_dir'].startswith(str(tmp_path)):
+        pytest.skip("The data directory doesn't follow XDG_DATA_HOME on this platform.")
+    assert not result['engine']
+    assert not os.listdir(tmp_path)
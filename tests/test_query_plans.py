@@ -0,0 +1,24 @@
+"""The hot queries must use indexes, as check-query-plans reports."""
+import pytest
+from sqlalchemy.orm import Session, configure_mappers
+
+from gamest import db, maintenance
+from gamest.engine import create_sqlite_engine
+from gamest.migrations import migrate
+
+
+@pytest.fixture(scope='module')
+def session():
+    # App.user_apps is a backref, which exists only once the mappers are configured.
+    configure_mappers()
+    engine = create_sqlite_engine('sqlite://')
+    migrate(engine, db.Base.metadata)
+    with Session(engine) as session:
+        yield session
+    engine.dispose()
+
+
+@pytest.mark.parametrize('name', maintenance.QUERY_PLAN_CHECKS)
+def test_query_uses_indexes(session, name):
+    plan = maintenance.explain(maintenance.QUERY_PLAN_CHECKS[name](), session=session)
+    assert maintenance.problems(name, plan) == []
@@ -0,0 +1,50 @@
+"""remote.iter_json_members must not depend on where the chunks are split."""
+import json
+
+import pytest
+
+from gamest.remote import iter_json_members
+
+PAYLOAD = json.dumps({
+    'token': 12345.5,
+    'apps': [{'id': 1, 'name': 'Café \U0001f3ae'}, {'id': -20, 'name': None}],
+    'play_sessions': [{'id': 3, 'started': 1.5e9, 'duration': 0}, 7, -0.25, 6E-3, 10],
+    'settings': [],
+    'deleted': {'apps': [4, 5]},
+    'flags': [True, False, None],
+    'count': 100,
+}).encode('utf-8')
+
+
+def members(chunks):
+    result = {}
+    for key, value in iter_json_members(chunks):
+        result.setdefault(key, []).append(value)
+    return result
+
+
+EXPECTED = members([PAYLOAD])
+
+
+def test_whole_payload():
+    # Arrays are yielded item by item, and empty ones not at all.
+    assert EXPECTED == {
+        key: value if isinstance(value, list) else [value]
+        for key, value in json.loads(PAYLOAD).items() if value != []}
+
+
+@pytest.mark.parametrize('offset', range(1, len(PAYLOAD)))
+def test_split_at_every_offset(offset):
+    assert members([PAYLOAD[:offset], PAYLOAD[offset:]]) == EXPECTED
+
+
+def test_one_byte_chunks():
+    assert members([PAYLOAD[i:i + 1] for i in range(len(PAYLOAD))]) == EXPECTED
+
+
+def test_number_split_after_point():
+    assert members([b'{"n": 12345.', b'5, "m": 1}']) == {'n': [12345.5], 'm': [1]}
+
+
+def test_number_split_in_exponent():
+    assert members([b'{"n": [1e', b'+5, 2E', b'-1]}']) == {'n': [1e5, 0.2]}